@@ -1,25 +1,42 @@
-import math
+import logging
 import os
 import dash
 from dash.exceptions import PreventUpdate
 from dash import html, dcc
-from dash.dependencies import Input, Output, State
+from dash.dependencies import ClientsideFunction, Input, Output, State
+from flask import Response, request
 import dash_leaflet as dl
-import pandas as pd
 
-from dash_map.layout import index_page, review_layout, select_top_200
-from dash_map.find_shelter_algo import compute_route  # Імпортуємо функцію для маршруту
+from dash_map.layout import index_page, review_layout
+from dash_map.config import (BATCH_MAX_ITEMS, BATCH_TIME_BUDGET, BATCH_WORKERS, PROFILE_SAMPLE_RATE,
+                             ROUTE_JOB_DEADLINE, ROUTE_JOB_WORKERS, SHELTER_LAYER_MODE)
+from dash_map.markers import ShelterMarkers, shelters_geojson
+from dash_map.find_shelter_algo import get_engine, get_route_cache, get_shelter_dataset, route_job
 from dash_map.layout import register_layout, login_layout
-import sqlite3
+from dash_map import db
+from dash_map.review_writer import ReviewWriter
+from dash_map import batch_routing, jobs, metrics
+from dash_map.procstats import memory_usage
 from hashlib import sha256
 
-# Завантаження укриттів
+# Помилки фонових потоків і воркерів ідуть у stderr (журнал gunicorn), а не губляться у print
+logging.basicConfig(level=logging.INFO, format="%(asctime)s %(process)d %(levelname)s %(name)s: %(message)s")
+logger = logging.getLogger(__name__)
+
+# Граф для маршрутів завантажується один раз при старті, а не на кожен запит.
+# З preload_app у gunicorn.conf.py це відбувається до fork, і воркери ділять ці сторінки пам'яті
+get_engine().prepare()
+
+# Укриття: сховище (mmap), індекс, поле і відра для маршрутів одним знімком. Коли CSV змінюється,
+# новий знімок будується у фоні й підміняється без перезапуску — і для маршрутів, і для маркерів
 filepath = 'shelters_data/shelters_coords.csv'
-shelters_df = pd.read_csv(filepath)
-shelters_df = shelters_df.dropna(subset=['latitude', 'longitude'])
-shelters_df = shelters_df.drop(columns=['account_number', 'ability_to_publish_information', 'district', 'community'])
-shelters_df.loc[shelters_df['type_of_room'] == 'Сховище', 'colour'] = 'blue'
-shelters_df.loc[shelters_df['type_of_room'] != 'Сховище', 'colour'] = 'blue'
+shelter_dataset = get_shelter_dataset(filepath)
+
+# Маркери та кластери для всіх рівнів зуму рахуються для кожної версії даних, а не на кожен запит
+if SHELTER_LAYER_MODE == 'client':
+    shelter_dataset.add_view('geojson', lambda store, previous: shelters_geojson(store))
+else:
+    shelter_dataset.add_view('markers', lambda store, previous: ShelterMarkers(store, previous=previous))
 
 # Ініціалізація додатку
 app = dash.Dash(__name__, suppress_callback_exceptions=True)
@@ -32,25 +49,44 @@ app.layout = html.Div([
 ])
 
 
-# Створює датабазу, якщо вона ще не була створена
-if not os.path.exists('instance/'):
-    os.makedirs('instance/')
-conn = sqlite3.connect('instance/shelters.sqlite')
-cursor = conn.cursor()
-cursor.execute('''CREATE TABLE IF NOT EXISTS users (
-    id INTEGER PRIMARY KEY,
-    username TEXT UNIQUE NOT NULL,
-    email TEXT UNIQUE NOT NULL,
-    token TEXT UNIQUE NOT NULL
-)
-''')
-cursor.execute('''CREATE TABLE IF NOT EXISTS reviews (
-    shelter_id VARCHAR(128) NOT NULL,
-    review_text VARCHAR(256) NOT NULL,
-    username TEXT NOT NULL
-)
-''')
-conn.close()
+# Створює датабазу, якщо вона ще не була створена, і застосовує міграції
+db.init_db()
+# Відгуки записуються у фоновому потоці пачками
+review_writer = ReviewWriter()
+# Маршрути рахуються у фонових потоках через чергу в SQLite, а не в самому колбеку
+route_jobs = jobs.JobQueue(route_job, workers=ROUTE_JOB_WORKERS, deadline=ROUTE_JOB_DEADLINE)
+
+# Метрики: час і розмір кожного колбеку, етапи маршруту, запити до SQLite; cProfile — за PROFILE_SAMPLE_RATE
+metrics.instrument_flask(server, PROFILE_SAMPLE_RATE)
+memory_caches = {'token': db.token_cache, 'reviews_page': db.reviews_page_cache,
+                 'review_counts': db.review_counts_cache}
+metrics.registry.gauge('process_memory_bytes', 'Process memory from /proc (rss, pss, shared)', lambda: {
+    (('kind', kind),): value for kind, value in memory_usage().items() if kind != 'pid'}, per_process=True)
+metrics.registry.gauge('memory_cache', 'In-process cache hits, misses and size', lambda: {
+    (('cache', name), ('stat', stat)): value
+    for name, cache in memory_caches.items() for stat, value in cache.stats().items()}, per_process=True)
+metrics.registry.gauge('route_cache_entries', 'Entries in the shared route cache',
+                       lambda: get_route_cache().stats()['size'])
+metrics.registry.gauge('route_cache', 'Route cache hits and misses of this process',
+                       lambda: route_cache_gauges(get_route_cache().stats()), per_process=True)
+metrics.registry.gauge('background_jobs', 'Background jobs in the shared queue by status', lambda: {
+    (('status', status),): count for status, count in route_jobs.counts().items()})
+metrics.registry.gauge('review_writer', 'Reviews written, lost after retries and waiting in this process', lambda: {
+    (('stat', 'written'),): review_writer.written, (('stat', 'failed'),): review_writer.failed,
+    (('stat', 'pending'),): review_writer.pending_count()}, per_process=True)
+
+
+def route_cache_gauges(stats):
+    stats.pop('size')
+    values = {}
+    for kind, counters in stats.items():
+        values.update({(('kind', kind), ('stat', stat)): value for stat, value in counters.items()})
+    return values
+
+# Метрики всіх воркерів у текстовому форматі Prometheus
+@server.route('/metrics')
+def serve_metrics():
+    return Response(metrics.registry.render(), mimetype='text/plain; version=0.0.4')
 
 
 # Перемикання між сторінками
@@ -67,43 +103,99 @@ def display_page(pathname):
         return review_layout  # Сторінка з відгуками
     return index_page
 
-# Оновлення меж карти
-@app.callback(
-    Output('bounds-store', 'data'),
-    Input('map', 'bounds')
-)
-def update_bounds(bounds):
-    if bounds:
-        return {
-            'south': bounds[0][0], 'west': bounds[0][1],
-            'north': bounds[1][0], 'east': bounds[1][1]
-        }
-    return {}
-
-# Маркери укриттів
-@app.callback(
-    Output("shelter-layer", "children"),
-    Input("bounds-store", "data")
-)
-def update_shelter_markers(bounds):
-    global shelters_df
-    shelter_markers = select_top_200(shelters_df, bounds)
-    return [
-        dl.CircleMarker(center=[row['latitude'], row['longitude']],
-                        radius=3 * math.log(row['capacity_of_persons'] / 20),
-                        color=row['colour'],
-                        fillOpacity=0.6,
-                        children=[
-                            dl.Tooltip(f"{row['type_of_room']}, "
-                                       f"{row['street']} {row['building_number']}, "
-                                       f"місткість: {row['capacity_of_persons']}"),
-                            # Додаємо лінк для переходу на сторінку відгуків
-                            dl.Popup([
-                                html.A(f"Перейти до відгуків", href=f"/review?shelter_id={row['street']}_{row['building_number']}")
-                            ])
-                        ])
-        for _, row in shelter_markers.iterrows()
-    ]
+if SHELTER_LAYER_MODE == 'client':
+    # Укриття одним GeoJSON: браузер кешує його, але кожного разу перевіряє ETag (no-cache),
+    # тож після оновлення даних отримує нову версію, а доти — 304
+    @server.route('/shelters.geojson')
+    def serve_shelters_geojson():
+        shelters_geojson_body, shelters_geojson_gzip, shelters_geojson_etag = \
+            shelter_dataset.current().views['geojson']
+        if shelters_geojson_etag in request.if_none_match:
+            response = Response(status=304)
+        elif 'gzip' in request.accept_encodings:
+            response = Response(shelters_geojson_gzip, mimetype='application/geo+json')
+            response.headers['Content-Encoding'] = 'gzip'
+        else:
+            response = Response(shelters_geojson_body, mimetype='application/geo+json')
+        response.set_etag(shelters_geojson_etag)
+        response.headers['Vary'] = 'Accept-Encoding'
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+
+    # Поточна версія GeoJSON; змінюється лише після оновлення файлу укриттів
+    @app.callback(
+        Output('shelters-version', 'data'),
+        Input('shelters-refresh', 'n_intervals'),
+        State('shelters-version', 'data')
+    )
+    def shelters_version(n_intervals, known_version):
+        version = shelter_dataset.current().views['geojson'][2]
+        if version == known_version:
+            raise PreventUpdate
+        return version
+
+    # Кількість відгуків для спливаючих вікон; надсилається лише тоді, коли змінилась ревізія відгуків
+    @app.callback(
+        Output('review-counts', 'data'),
+        Input('shelters-refresh', 'n_intervals'),
+        State('review-counts', 'data')
+    )
+    def review_counts_for_client(n_intervals, known):
+        revision = db.reviews_revision()
+        if known and known.get('revision') == revision:
+            raise PreventUpdate
+        return {'revision': revision, 'counts': db.review_counts()}
+
+    # Фільтр по видимій області і відбір найбільших укриттів виконуються у браузері;
+    # нова версія даних змушує браузер завантажити GeoJSON заново
+    app.clientside_callback(
+        ClientsideFunction(namespace='shelters', function_name='filter_viewport'),
+        Output('shelter-geojson', 'data'),
+        Input('map', 'bounds'),
+        Input('shelters-version', 'data'),
+        Input('review-counts', 'data'),
+        State('shelter-max-markers', 'data')
+    )
+else:
+    # Оновлення меж карти
+    @app.callback(
+        Output('bounds-store', 'data'),
+        Input('map', 'bounds'),
+        Input('map', 'zoom')
+    )
+    def update_bounds(bounds, zoom):
+        if bounds:
+            return {
+                'south': bounds[0][0], 'west': bounds[0][1],
+                'north': bounds[1][0], 'east': bounds[1][1],
+                'zoom': zoom
+            }
+        return {}
+
+    # Маркери укриттів: на малому зумі — кластери з сумарною місткістю, на великому — окремі укриття
+    # з кількістю відгуків у спливаючому вікні
+    @app.callback(
+        Output("shelter-layer", "children"),
+        Input("bounds-store", "data")
+    )
+    def update_shelter_markers(bounds):
+        zoom = bounds.get('zoom') if bounds else None
+        return shelter_dataset.current().views['markers'].for_viewport(bounds, zoom,
+                                                                       review_counts=db.review_counts())
+
+# Пакетний пошук укриттів: елементи розподіляються по пулу процесів, відповідь — NDJSON потоком
+@server.route('/api/nearest-shelters', methods=['POST'])
+def nearest_shelters_batch():
+    payload = request.get_json(silent=True) or {}
+    items = payload.get('items')
+    if not isinstance(items, list) or not all(isinstance(item, dict) for item in items):
+        return {'error': 'очікується {"items": [{"address": ...} або {"lat": ..., "lon": ...}]}'}, 400
+    if len(items) > BATCH_MAX_ITEMS:
+        return {'error': f'не більше {BATCH_MAX_ITEMS} елементів за запит'}, 413
+    pool = batch_routing.get_pool(BATCH_WORKERS, filepath)
+    results = batch_routing.route_batch(items, pool, filepath, bool(payload.get('include_path')),
+                                        time_budget=BATCH_TIME_BUDGET)
+    return Response(batch_routing.to_ndjson(results), mimetype='application/x-ndjson')
 
 # Реалізація логіну
 @app.callback(
@@ -115,14 +207,9 @@ def update_shelter_markers(bounds):
     prevent_initial_call=True
 )
 def handle_login(n_clicks, email, password):
-    conn = sqlite3.connect('instance/shelters.sqlite')
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
     input_ = f'{email}{password}dev'
     token = sha256(input_.encode('utf-8')).hexdigest()
-    cursor.execute('SELECT * FROM users WHERE email = ?', (email,))
-    user = cursor.fetchone()
-    conn.close()
+    user = db.find_user_by_email(email)
     if user is not None and user['token'] == token:
         return html.Div('Логін успішний!', className='success-message'), token
     return html.Div('Електронна пошта або пароль неправильні.', className='error-message'), dash.no_update
@@ -158,11 +245,7 @@ def toggle_review_input(token):
     if not token:
         return html.Div("Щоб залишити відгук, будь ласка, увійдіть.", className='error-message')
 
-    conn = sqlite3.connect('instance/shelters.sqlite')
-    cursor = conn.cursor()
-    cursor.execute('SELECT username FROM users WHERE token = ?', (token,))
-    user = cursor.fetchone()
-    conn.close()
+    user = db.resolve_token(token)
 
     if user:
         return html.Div([
@@ -177,11 +260,13 @@ def toggle_review_input(token):
 @app.callback(
     Output("user-token", "data", allow_duplicate=True),
     Input("logout-button", "n_clicks"),
+    State("user-token", "data"),
     prevent_initial_call=True
 )
-def logout(n_clicks):
+def logout(n_clicks, token):
     if not n_clicks:
         raise PreventUpdate
+    db.invalidate_token(token)
     return None
 
 # Показ логіну та реєстрації коли не на акаунті, привітання та кнопки входу в іншому випадку
@@ -197,15 +282,11 @@ def update_auth_section(token):
             dcc.Link('Реєстрація', href='/register', className='button-link')
         ])
 
-    conn = sqlite3.connect('instance/shelters.sqlite')
-    cursor = conn.cursor()
-    cursor.execute('SELECT username FROM users WHERE token = ?', (token,))
-    user = cursor.fetchone()
-    conn.close()
+    user = db.resolve_token(token)
 
     if user:
         return html.Div([
-            html.Span(f"👤 Вітаємо, {user[0]}!", className='welcome-text'),
+            html.Span(f"👤 Вітаємо, {user}!", className='welcome-text'),
             html.Button("Вийти", id="logout-button", n_clicks=0, className="logout-button")
         ])
     else:
@@ -226,26 +307,15 @@ def update_auth_section(token):
     prevent_initial_call=True
 )
 def handle_register(n_clicks, username, email, password):
-    conn = sqlite3.connect('instance/shelters.sqlite')
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
     input_ = f'{email}{password}dev'
     token = sha256(input_.encode('utf-8')).hexdigest()
-    cursor.execute('SELECT * FROM users WHERE email = ?', (email,))
-    users_with_similar_email = cursor.fetchall()
-    cursor.execute('SELECT * FROM users WHERE username = ?', (username,))
-    users_with_similar_username = cursor.fetchall()
-    cursor.execute('SELECT * FROM users WHERE token = ?', (token,))
-    users_with_similar_token = cursor.fetchall()
-    if len(users_with_similar_email) > 0:
+    taken = db.register_user(username, email, token)
+    if taken == 'email':
         return html.Div('Користувач із таким email уже зареєстрований.', className='error-message')
-    if len(users_with_similar_username) > 0:
+    if taken == 'username':
         return html.Div('Користувач із таким username уже зареєстрований.', className='error-message')
-    if len(users_with_similar_token) > 0:
+    if taken == 'token':
         return html.Div('Користувач із таким токеном уже зареєстрований.', className='error-message')
-    cursor.execute('INSERT INTO users (username, email, token) VALUES (?, ?, ?)', (username, email, token))
-    conn.commit()
-    conn.close()
     return html.Div('Користувача зареєстровано! Тепер увійдіть на сторінці логіну.', className='success-message')
 
 # @app.callback(
@@ -280,94 +350,156 @@ def handle_register(n_clicks, username, email, password):
 #     return 'Користувача зареєстровано, перейдіть на сторінку логіну і авторизуйтесь'
 
 
-# Реалізація вводу адреси та пошуку найближчого укриття
+# Реалізація вводу адреси та пошуку найближчого укриття.
+# Маршрут рахується фоновим завданням: колбек лише ставить його в чергу, а стан опитується інтервалом.
+# Нова адреса скасовує попереднє завдання цього ж користувача
 @app.callback(
+    Output("route-job", "data"),
+    Output("route-job-poll", "disabled"),
     Output("route", "children"),
     Output("route-message", "children"),
+    Output("route-alternatives", "children"),
     Input("find-route-btn-main", "n_clicks"),
     State("address-input", "value"),
+    State("route-job", "data"),
     prevent_initial_call=True
 )
-def handle_route_on_main(n_clicks, address):
+def handle_route_on_main(n_clicks, address, previous_job):
     if not address:
-        return [], "❗ Будь ласка, введіть адресу."
-    try:
-        name, minutes, coords = compute_route(address, 'shelters_data/shelters_coords.csv')
-        if name is None and coords is None:
-            return [], "❗ Початкова адреса не була знайдена. Спробуйте ще раз."
-        if not coords or len(coords) < 2:
-            return [], "⚠️ Укриття занадто близько. Побудовано пряму лінію."
-        start = coords[0]
-        end = coords[-1]
-        return [
-            [
-                dl.Polyline(positions=coords, color='red', weight=5),
-                dl.Marker(position=start, children=dl.Tooltip("Ви тут 🧍")),
-                dl.Marker(position=end, children=dl.Tooltip(f"Укриття: {name} (≈ {minutes} хв) 🛡️"))
-            ],
-            ""
-        ]
-    except Exception as e:
-        print(f"Помилка: {e}")
-        return [], "🚫 Сталася помилка при побудові маршруту. Перевірте адресу або спробуйте ще раз."
-
-
-# Показ відгуків
+        return dash.no_update, dash.no_update, [], "❗ Будь ласка, введіть адресу.", []
+    job_id = route_jobs.submit({'address': address, 'shelter_file': filepath}, replaces=previous_job)
+    return job_id, False, [], "⏳ Запит у черзі…", []
+
+# Стан фонового завдання маршруту: черга, етап, результат або помилка
+@app.callback(
+    Output("route-job-poll", "disabled", allow_duplicate=True),
+    Output("route", "children", allow_duplicate=True),
+    Output("route-message", "children", allow_duplicate=True),
+    Output("route-alternatives", "children", allow_duplicate=True),
+    Input("route-job-poll", "n_intervals"),
+    State("route-job", "data"),
+    prevent_initial_call=True
+)
+def poll_route_job(n_intervals, job_id):
+    job = route_jobs.status(job_id) if job_id else None
+    if job is None:
+        return True, dash.no_update, dash.no_update, dash.no_update
+    if job['status'] == jobs.QUEUED:
+        ahead = f" (перед вами {job['position']})" if job['position'] else ""
+        return False, dash.no_update, f"⏳ Запит у черзі{ahead}…", dash.no_update
+    if job['status'] == jobs.RUNNING:
+        return False, dash.no_update, ROUTE_STAGES.get(job['stage'], "⏳ Обробка…"), dash.no_update
+    if job['status'] == jobs.DONE:
+        return (True, *render_routes(job['result']['routes']))
+    if job['status'] == jobs.EXPIRED:
+        return True, [], "⌛ Маршрут не встиг побудуватись. Спробуйте ще раз.", []
+    if job['status'] == jobs.CANCELLED:
+        return True, dash.no_update, dash.no_update, dash.no_update
+    logger.error("Помилка фонового завдання %s: %s", job_id, job['error'])
+    return True, [], "🚫 Сталася помилка при побудові маршруту. Перевірте адресу або спробуйте ще раз.", []
+
+ROUTE_STAGES = {'geocoding': "🔎 Шукаємо адресу…", 'routing': "🧭 Будуємо маршрут…"}
+
+# Шари карти, повідомлення і список укриттів для результату compute_routes
+def render_routes(routes):
+    if routes is None:
+        return [], "❗ Початкова адреса не була знайдена. Спробуйте ще раз.", []
+    if not routes:
+        return [], "⚠️ Не вдалося знайти досяжне укриття поблизу.", []
+    # Кілька найближчих укриттів з одного пошуку: якщо перше заповнене, можна одразу йти до іншого
+    layers = [dl.Marker(position=routes[0]['coords'][0], children=dl.Tooltip("Ви тут 🧍"))]
+    # Альтернативи малюємо першими, щоб найближчий маршрут був зверху
+    for route in reversed(routes[1:]):
+        layers.append(dl.Polyline(positions=route['coords'], color='orange', weight=3, dashArray='6 6'))
+        layers.append(dl.Marker(position=route['coords'][-1], opacity=0.7,
+                                children=dl.Tooltip(shelter_tooltip(route))))
+    layers.append(dl.Polyline(positions=routes[0]['coords'], color='red', weight=5))
+    layers.append(dl.Marker(position=routes[0]['coords'][-1], children=dl.Tooltip(shelter_tooltip(routes[0]))))
+    return layers, "", render_alternatives(routes)
+
+def shelter_tooltip(route):
+    return f"Укриття: {route['name']} (≈ {route['minutes']} хв, місткість {route['capacity']} осіб) 🛡️"
+
+def render_alternatives(routes):
+    return html.Ol([html.Li(f"{route['name']} — ≈ {route['minutes']} хв, місткість {route['capacity']} осіб")
+                    for route in routes])
+
+
+# Показ відгуків: перша сторінка (найновіші), далі — кнопка "Показати ще"
 @app.callback(
     Output('reviews-container', 'children'),
+    Output('reviews-cursor', 'data'),
+    Output('load-more-reviews', 'style'),
     Input('url', 'pathname'),
     State('url', 'search')
 )
 def display_reviews(pathname, search):
     if pathname == '/review':
         # Тут можна отримати id укриття з query параметра
-        shelter_id = search.split('=')[1] if search else ''
-        # Завантажити відгуки з бази даних або з іншого джерела
-        reviews = get_reviews(shelter_id)
-        return html.Div([html.P(review) for review in reviews])
-    return []
+        shelter_id = shelter_id_from_search(search)
+        # Відгуки, що ще стоять у черзі на запис у цьому процесі, показуємо над збереженими
+        # (свої відгуки автор і так бачить через my-new-reviews, навіть якщо запит прийшов в інший воркер).
+        # Чергу читаємо першою, щоб відгук, записаний між двома читаннями, не зник
+        pending = review_writer.pending_reviews(shelter_id)
+        reviews, cursor = db.get_reviews_page(shelter_id)
+        saved = {(r['username'], r['review_text'], r['created_at']) for r in reviews}
+        reviews = [r for r in pending if (r['username'], r['review_text'], r['created_at']) not in saved] + reviews
+        return (html.Div([html.P(f"Відгуків: {db.review_count(shelter_id)}")] + render_reviews(reviews)),
+                cursor, load_more_style(cursor))
+    return [], None, load_more_style(None)
+
+# Наступна сторінка відгуків за курсором
+@app.callback(
+    Output('reviews-more', 'children'),
+    Output('reviews-cursor', 'data', allow_duplicate=True),
+    Output('load-more-reviews', 'style', allow_duplicate=True),
+    Input('load-more-reviews', 'n_clicks'),
+    State('reviews-cursor', 'data'),
+    State('reviews-more', 'children'),
+    State('url', 'search'),
+    prevent_initial_call=True
+)
+def load_more_reviews(n_clicks, cursor, shown, search):
+    if not n_clicks or not cursor:
+        raise PreventUpdate
+    reviews, cursor = db.get_reviews_page(shelter_id_from_search(search), before=cursor)
+    return (shown or []) + render_reviews(reviews), cursor, load_more_style(cursor)
+
+def shelter_id_from_search(search):
+    return search.split('=')[1] if search else ''
+
+def render_reviews(reviews):
+    return [html.P(f"{review['username']}: {review['review_text']}") for review in reviews]
 
-def get_reviews(shelter_id):
-    conn = sqlite3.connect('instance/shelters.sqlite')
-    cursor = conn.cursor()
-    all_reviews = cursor.execute('SELECT * FROM reviews WHERE shelter_id = ?', (shelter_id,)).fetchall()
-    reviews = [f"{review[2]}: {review[1]}" for review in all_reviews]
-    conn.close()
-    return reviews
+def load_more_style(cursor):
+    return {'display': 'block'} if cursor else {'display': 'none'}
 
 
 # Написання відгуків
 @app.callback(
     Output('new-review', 'value'),
+    Output('my-new-reviews', 'children'),
     Input('submit-review', 'n_clicks'),
     State('new-review', 'value'),
     State('url', 'search'),
     State('user-token', 'data'),
+    State('my-new-reviews', 'children'),
     prevent_initial_call=True
 )
-def submit_review(n_clicks, review_text, search, token):
+def submit_review(n_clicks, review_text, search, token, my_reviews):
     if n_clicks > 0 and review_text and token:
-        shelter_id = search.split('=')[1] if search else ''
-        conn = sqlite3.connect('instance/shelters.sqlite')
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        cursor.execute('SELECT username FROM users WHERE token = ?', (token,))
-        user = cursor.fetchone()
-        conn.close()
-        if user:
-            username = user['username']
+        shelter_id = shelter_id_from_search(search)
+        username = db.resolve_token(token)
+        if username:
             save_review(review_text, shelter_id, username)
-        return ''  # очищення поля
-    return review_text
+            # Автор бачить свій відгук одразу, не чекаючи запису в базу
+            my_reviews = render_reviews([{'username': username, 'review_text': review_text}]) + (my_reviews or [])
+        return '', my_reviews  # очищення поля
+    return review_text, dash.no_update
 
 def save_review(review_text, shelter_id, username):
-    conn = sqlite3.connect('instance/shelters.sqlite')
-    cursor = conn.cursor()
-    cursor.execute('INSERT INTO reviews VALUES (?, ?, ?)', (shelter_id, review_text, username,))
-    conn.commit()
+    review_writer.submit(shelter_id, review_text, username)
     print(f"Saving review: {review_text} від {username}")
-    # Ти можеш зберігати відгуки в базі даних, тут приклад з виведенням в консоль.
-    conn.close()
 
 
 
@@ -0,0 +1,66 @@
+// Клієнтський шар укриттів: GeoJSON завантажується один раз і заново лише тоді, коли сервер
+// повідомляє нову версію (ETag); фільтр по видимій області та відбір найбільших укриттів виконуються у браузері.
+window.shelters = Object.assign({}, window.shelters, {
+    layer: {
+        pointToLayer: function (feature, latlng) {
+            return L.circleMarker(latlng, {
+                radius: feature.properties.radius,
+                color: feature.properties.colour,
+                fillOpacity: 0.6
+            });
+        }
+    }
+});
+
+(function () {
+    // Завантажені дані та їхній ETag; etag відомий, щойно прийшла відповідь
+    var cached = null;
+
+    function loadShelters(version) {
+        if (cached === null || (version && cached.etag && cached.etag !== version)) {
+            var entry = {etag: null};
+            entry.promise = fetch('/shelters.geojson', {cache: 'no-cache'})
+                .then(function (response) {
+                    entry.etag = (response.headers.get('ETag') || '').replace(/^W\//, '').replace(/"/g, '');
+                    return response.json();
+                })
+                .catch(function (error) {
+                    if (cached === entry) {
+                        cached = null;
+                    }
+                    throw error;
+                });
+            cached = entry;
+        }
+        return cached.promise;
+    }
+
+    window.dash_clientside = Object.assign({}, window.dash_clientside, {
+        shelters: {
+            filter_viewport: function (bounds, version, reviewCounts, limit) {
+                var counts = (reviewCounts && reviewCounts.counts) || {};
+                return loadShelters(version).then(function (data) {
+                    var features = data.features;
+                    if (bounds) {
+                        var south = bounds[0][0], west = bounds[0][1];
+                        var north = bounds[1][0], east = bounds[1][1];
+                        features = features.filter(function (f) {
+                            var lon = f.geometry.coordinates[0], lat = f.geometry.coordinates[1];
+                            return lat >= south && lat <= north && lon >= west && lon <= east;
+                        });
+                    }
+                    // Ознаки вже відсортовані сервером за місткістю, тож беремо перші limit
+                    // і додаємо до спливаючого вікна кількість відгуків
+                    features = features.slice(0, limit).map(function (f) {
+                        var properties = Object.assign({}, f.properties, {
+                            popup: '<div>Відгуків: ' + (counts[f.properties.shelter_id] || 0) + '</div>' +
+                                f.properties.popup
+                        });
+                        return Object.assign({}, f, {properties: properties});
+                    });
+                    return {type: 'FeatureCollection', features: features};
+                });
+            }
+        }
+    });
+})();
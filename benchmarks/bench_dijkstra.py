@@ -0,0 +1,61 @@
+"""Порівняння повного Дейкстри, пошуку з зупинкою на першому укритті та A*.
+
+Запуск: python -m benchmarks.bench_dijkstra
+"""
+import random
+import time
+
+from benchmarks.synthetic import grid_city
+from dash_map.find_shelter_algo import astar, dijkstra
+
+
+def _route(distances, pre, targets):
+    reached = [t for t in targets if distances.get(t, float('inf')) != float('inf')]
+    if not reached:
+        return None, []
+    best = min(reached, key=lambda t: distances[t])
+    path = []
+    while best is not None:
+        path.append(best)
+        best = pre.get(best)
+    return distances[path[0]], path[::-1]
+
+
+def run(sizes=(50, 100, 200), queries=20, shelters=40, seed=0):
+    rnd = random.Random(seed)
+    results = []
+    for n in sizes:
+        graph, coords, targets = grid_city(n, shelters=shelters, seed=seed)
+        starts = rnd.sample(sorted(graph), queries)
+        modes = {
+            'full': lambda s, st: dijkstra(graph, s, stats=st),
+            'target': lambda s, st: dijkstra(graph, s, targets=targets, stats=st),
+            'astar': lambda s, st: astar(graph, s, targets, coords, stats=st),
+        }
+        reference = {}
+        for mode, search in modes.items():
+            settled = 0
+            elapsed = 0.0
+            for start in starts:
+                stats = {}
+                t0 = time.perf_counter()
+                distances, pre = search(start, stats)
+                elapsed += time.perf_counter() - t0
+                settled += stats['settled']
+                length, _ = _route(distances, pre, targets)
+                if mode == 'full':
+                    reference[start] = length
+                elif abs(length - reference[start]) > 1e-6:
+                    raise AssertionError(f"{mode}: маршрут з {start} відрізняється від повного Дейкстри")
+            results.append({
+                'nodes': len(graph), 'mode': mode,
+                'settled_avg': settled / queries,
+                'ms_avg': elapsed / queries * 1000,
+            })
+    return results
+
+
+if __name__ == "__main__":
+    print(f"{'nodes':>8} {'mode':>8} {'settled':>10} {'ms':>9}")
+    for row in run():
+        print(f"{row['nodes']:>8} {row['mode']:>8} {row['settled_avg']:>10.0f} {row['ms_avg']:>9.2f}")
@@ -0,0 +1,41 @@
+"""WSGI-застосунок для навантажувального тесту: app.server з локальною заглушкою геокодера.
+
+Запуск: gunicorn -c gunicorn.conf.py benchmarks.load_app:server (це робить python -m benchmarks.load_test)
+LOAD_TEST_GRID=N — синтетична сітка N x N замість знімка графу Львова, тож не потрібні ні osmnx, ні мережа.
+"""
+import hashlib
+import os
+
+from benchmarks.synthetic import LVIV_CENTER, grid_engine
+from dash_map import find_shelter_algo
+
+
+class HashGeocoder:
+    """Заглушка геокодера без мережі: адреса детерміновано перетворюється на точку
+    у квадраті span_deg навколо центру Львову. Адреси зі словом "невідома" не знаходяться."""
+
+    def __init__(self, span_deg=0.08):
+        self.span_deg = span_deg
+
+    def geocode(self, address):
+        if "невідома" in address.lower():
+            return None
+        digest = hashlib.sha256(address.strip().lower().encode('utf-8')).digest()
+        dlat = int.from_bytes(digest[:4], 'big') / 2 ** 32 - 0.5
+        dlon = int.from_bytes(digest[4:8], 'big') / 2 ** 32 - 0.5
+        return LVIV_CENTER[0] + dlat * self.span_deg, LVIV_CENTER[1] + dlon * self.span_deg
+
+    # Вулиці з графу заглушці не потрібні (get_engine засіває ними справжній геокодер)
+    def has_streets(self) -> bool:
+        return True
+
+
+# Граф і геокодер підміняються до імпорту app, який при старті відкриває рушій маршрутів
+_grid = int(os.environ.get("LOAD_TEST_GRID", "0"))
+if _grid:
+    find_shelter_algo._engine = grid_engine(_grid)
+    find_shelter_algo.set_geocoder(HashGeocoder(span_deg=_grid * 0.0015 * 0.9))
+else:
+    find_shelter_algo.set_geocoder(HashGeocoder())
+
+from app import server  # noqa: E402
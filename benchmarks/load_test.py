@@ -0,0 +1,330 @@
+"""Навантажувальний тест: сесії користувачів проти /_dash-update-component на локальному gunicorn.
+
+Запуск: python -m benchmarks.load_test --users 20 --duration 60 --grid 80 --out load.json
+Проти вже запущеного сервера: python -m benchmarks.load_test --url http://127.0.0.1:8000
+Кожен віртуальний користувач у циклі відкриває сторінку, рухає мапу, частина реєструється й входить,
+шукає маршрут (з опитуванням фонового завдання) і читає або пише відгуки. Звіт — пропускна здатність
+і p50/p95/p99 для кожного колбеку. Геокодер на сервері замінено заглушкою (benchmarks.load_app).
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+import requests
+
+from benchmarks.synthetic import LVIV_CENTER
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STREETS = ("Городоцька", "Зелена", "Замарстинівська", "Богдана Лепкого", "Личаківська", "Стрийська",
+           "Наукова", "Степана Бандери", "Шевченка", "Коновальця")
+
+
+class Recorder:
+    """Час відповіді і помилки за назвами запитів, спільні для всіх потоків."""
+
+    def __init__(self):
+        self.latencies = {}
+        self.errors = {}
+        self.sessions = 0
+        self._lock = threading.Lock()
+
+    def add(self, name, seconds, ok=True):
+        with self._lock:
+            self.latencies.setdefault(name, []).append(seconds * 1000)
+            if not ok:
+                self.errors[name] = self.errors.get(name, 0) + 1
+
+    def session_done(self):
+        with self._lock:
+            self.sessions += 1
+
+    def report(self, elapsed) -> dict:
+        rows = {}
+        with self._lock:
+            for name, times in sorted(self.latencies.items()):
+                times = sorted(times)
+                centiles = statistics.quantiles(times, n=100, method='inclusive') if len(times) > 1 else times * 99
+                rows[name] = {'count': len(times), 'errors': self.errors.get(name, 0),
+                              'rps': len(times) / elapsed, 'ms_mean': statistics.fmean(times),
+                              'ms_p50': centiles[49], 'ms_p95': centiles[94], 'ms_p99': centiles[98],
+                              'ms_max': times[-1]}
+            requests_total = sum(row['count'] for name, row in rows.items() if name != 'route_total')
+            return {'elapsed_s': elapsed, 'sessions': self.sessions, 'requests': requests_total,
+                    'rps': requests_total / elapsed, 'callbacks': rows}
+
+
+# Назва колбеку — його перший вихід без суфікса allow_duplicate, наприклад 'route-job.data'
+def _parse_outputs(output):
+    if output.startswith('..'):
+        parts = output[2:-2].split('...')
+    else:
+        parts = [output]
+    outputs = []
+    for part in parts:
+        component, prop = part.rsplit('.', 1)
+        outputs.append({'id': component, 'property': prop})
+    return outputs
+
+
+class DashClient:
+    """Клієнт одного користувача: надсилає запити колбеків так само, як це робить браузер Dash."""
+
+    def __init__(self, base_url, dependencies, recorder):
+        self.base_url = base_url.rstrip('/')
+        self.dependencies = dependencies
+        self.recorder = recorder
+        self.http = requests.Session()
+
+    @staticmethod
+    def load_dependencies(base_url) -> dict:
+        response = requests.get(f"{base_url.rstrip('/')}/_dash-dependencies", timeout=30)
+        response.raise_for_status()
+        dependencies = {}
+        for dependency in response.json():
+            if dependency.get('clientside_function'):
+                continue
+            outputs = _parse_outputs(dependency['output'])
+            first = outputs[0]
+            dependencies[f"{first['id']}.{first['property'].split('@')[0]}"] = dependency
+        return dependencies
+
+    def has(self, name) -> bool:
+        return name in self.dependencies
+
+    # Завантаження сторінки: HTML, макет і залежності колбеків
+    def page_load(self):
+        started = time.perf_counter()
+        ok = True
+        for path in ('/', '/_dash-layout', '/_dash-dependencies'):
+            response = self.http.get(self.base_url + path, timeout=60)
+            ok = ok and response.ok
+        self.recorder.add('page_load', time.perf_counter() - started, ok)
+
+    # Виклик колбеку name; values — значення входів і станів за ключами 'id.property'.
+    # Повертає {id: {property: value}} або {}, якщо колбек нічого не оновив (204)
+    def call(self, name, values, changed=None):
+        dependency = self.dependencies[name]
+        outputs = _parse_outputs(dependency['output'])
+        body = {
+            'output': dependency['output'],
+            'outputs': outputs if dependency['output'].startswith('..') else outputs[0],
+            'inputs': [dict(item, value=values.get(f"{item['id']}.{item['property']}"))
+                       for item in dependency['inputs']],
+            'state': [dict(item, value=values.get(f"{item['id']}.{item['property']}"))
+                      for item in dependency['state']],
+            'changedPropIds': changed or [f"{item['id']}.{item['property']}" for item in dependency['inputs'][:1]],
+        }
+        started = time.perf_counter()
+        try:
+            response = self.http.post(f"{self.base_url}/_dash-update-component", json=body, timeout=60)
+        except requests.RequestException:
+            self.recorder.add(name, time.perf_counter() - started, ok=False)
+            return {}
+        self.recorder.add(name, time.perf_counter() - started, ok=response.status_code in (200, 204))
+        if response.status_code != 200:
+            return {}
+        return response.json().get('response', {})
+
+
+def random_bounds(rnd, zoom):
+    width = 360 * 1200 / (256 * 2 ** zoom)
+    height = width * 0.43
+    lat = LVIV_CENTER[0] + rnd.uniform(-0.03, 0.03)
+    lon = LVIV_CENTER[1] + rnd.uniform(-0.03, 0.03)
+    return [[lat - height / 2, lon - width / 2], [lat + height / 2, lon + width / 2]]
+
+
+# Одна сесія користувача. Частки login_share, route_share і review_share задають,
+# яка частина сесій входить в акаунт, шукає маршрут і відкриває відгуки
+def run_session(client, rnd, args):
+    client.page_load()
+    client.call('page-content.children', {'url.pathname': '/'})
+    client.call('auth-section.children', {'user-token.data': None})
+    client.call('review-input-section.children', {'user-token.data': None})
+
+    # Рух мапи: межі -> bounds-store -> маркери (лише в серверному режимі шару укриттів)
+    if client.has('bounds-store.data'):
+        for _ in range(rnd.randint(2, args.pans)):
+            zoom = rnd.randint(12, 17)
+            response = client.call('bounds-store.data', {'map.bounds': random_bounds(rnd, zoom), 'map.zoom': zoom})
+            bounds = response.get('bounds-store', {}).get('data')
+            if bounds:
+                client.call('shelter-layer.children', {'bounds-store.data': bounds})
+            time.sleep(args.think)
+
+    token = None
+    if rnd.random() < args.login_share:
+        name = f"load-{uuid.uuid4().hex[:12]}"
+        email, password = f"{name}@example.com", "load-test"
+        client.call('register-output.children', {'register-button.n_clicks': 1, 'reg-username.value': name,
+                                                 'reg-email.value': email, 'reg-password.value': password})
+        response = client.call('login-output.children', {'login-button.n_clicks': 1, 'login-email.value': email,
+                                                         'login-password.value': password})
+        token = response.get('user-token', {}).get('data')
+        client.call('auth-section.children', {'user-token.data': token})
+        time.sleep(args.think)
+
+    if rnd.random() < args.route_share:
+        address = f"{rnd.choice(STREETS)} {rnd.randint(1, 150)}"
+        started = time.perf_counter()
+        response = client.call('route-job.data', {'find-route-btn-main.n_clicks': 1, 'address-input.value': address,
+                                                  'route-job.data': None})
+        job_id = response.get('route-job', {}).get('data')
+        done = False
+        # Опитування стану, як dcc.Interval у браузері
+        for n_intervals in range(1, int(args.route_timeout / args.poll_interval) + 1):
+            if not job_id:
+                break
+            time.sleep(args.poll_interval)
+            response = client.call('route-job-poll.disabled', {'route-job-poll.n_intervals': n_intervals,
+                                                               'route-job.data': job_id})
+            if response.get('route-job-poll', {}).get('disabled', True):
+                done = True
+                break
+        client.recorder.add('route_total', time.perf_counter() - started, ok=done)
+
+    if rnd.random() < args.review_share:
+        search = f"?id=shelter-{rnd.randint(1, 300)}"
+        client.call('page-content.children', {'url.pathname': '/review'})
+        client.call('reviews-container.children', {'url.pathname': '/review', 'url.search': search})
+        client.call('review-input-section.children', {'user-token.data': token})
+        if token:
+            client.call('new-review.value', {'submit-review.n_clicks': 1, 'new-review.value': "Тестовий відгук",
+                                             'url.search': search, 'user-token.data': token,
+                                             'my-new-reviews.children': None})
+    client.recorder.session_done()
+
+
+def _user_loop(base_url, dependencies, recorder, seed, deadline, args):
+    rnd = random.Random(seed)
+    client = DashClient(base_url, dependencies, recorder)
+    while time.monotonic() < deadline:
+        try:
+            run_session(client, rnd, args)
+        except requests.RequestException as e:
+            recorder.add('session_error', 0.0, ok=False)
+            print("Помилка сесії:", e, file=sys.stderr)
+        time.sleep(args.think)
+
+
+# Робоча тека сервера: свої instance/ (бази, кеші), а дані й знімок графу — посиланнями на репозиторій
+def prepare_workdir(workdir):
+    os.makedirs(workdir, exist_ok=True)
+    for name in ("shelters_data", "dash_map"):
+        target = os.path.join(workdir, name)
+        if not os.path.exists(target):
+            os.symlink(os.path.join(REPO_DIR, name), target)
+
+
+def start_server(port, workers, grid, workdir):
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [REPO_DIR, os.environ.get('PYTHONPATH')])),
+               WEB_CONCURRENCY=str(workers))
+    if grid:
+        env['LOAD_TEST_GRID'] = str(grid)
+    return subprocess.Popen([sys.executable, "-m", "gunicorn", "-c", os.path.join(REPO_DIR, "gunicorn.conf.py"),
+                             "--bind", f"127.0.0.1:{port}", "benchmarks.load_app:server"], cwd=workdir, env=env)
+
+
+def wait_ready(base_url, process=None, timeout=300):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError(f"gunicorn завершився з кодом {process.returncode}")
+        try:
+            if requests.get(f"{base_url}/_dash-dependencies", timeout=5).ok:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.5)
+    raise TimeoutError(f"сервер {base_url} не відповів за {timeout} с")
+
+
+def run(base_url, args) -> dict:
+    dependencies = DashClient.load_dependencies(base_url)
+    recorder = Recorder()
+    started = time.monotonic()
+    deadline = started + args.duration
+    threads = []
+    for user in range(args.users):
+        thread = threading.Thread(target=_user_loop, args=(base_url, dependencies, recorder, args.seed + user,
+                                                           deadline, args), daemon=True)
+        thread.start()
+        threads.append(thread)
+        # Користувачі приходять поступово, а не всі в одну мить
+        time.sleep(args.ramp_up / max(args.users, 1))
+    for thread in threads:
+        thread.join()
+    return recorder.report(time.monotonic() - started)
+
+
+def print_report(report):
+    print(f"{report['sessions']} сесій, {report['requests']} запитів за {report['elapsed_s']:.1f} с "
+          f"({report['rps']:.1f} запитів/с)")
+    print(f"{'callback':<34} {'count':>7} {'err':>5} {'rps':>7} {'p50':>8} {'p95':>8} {'p99':>8}")
+    for name, row in report['callbacks'].items():
+        print(f"{name:<34} {row['count']:>7} {row['errors']:>5} {row['rps']:>7.1f} "
+              f"{row['ms_p50']:>8.1f} {row['ms_p95']:>8.1f} {row['ms_p99']:>8.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test for the Dash callback endpoint")
+    parser.add_argument("--url", help="existing server; by default a local gunicorn is started")
+    parser.add_argument("--port", type=int, default=8050)
+    parser.add_argument("--workers", type=int, default=2, help="gunicorn workers")
+    parser.add_argument("--grid", type=int, default=0, help="synthetic N x N graph instead of the Lviv snapshot")
+    parser.add_argument("--workdir", help="server working directory (instance/ is created here); temp by default")
+    parser.add_argument("--users", type=int, default=10, help="concurrent virtual users")
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds")
+    parser.add_argument("--ramp-up", type=float, default=5.0, help="seconds to start all users")
+    parser.add_argument("--think", type=float, default=0.2, help="pause between user actions, seconds")
+    parser.add_argument("--pans", type=int, default=6, help="max map moves per session")
+    parser.add_argument("--login-share", type=float, default=0.3)
+    parser.add_argument("--route-share", type=float, default=0.5)
+    parser.add_argument("--review-share", type=float, default=0.3)
+    parser.add_argument("--poll-interval", type=float, default=0.5, help="route job polling, as in the layout")
+    parser.add_argument("--route-timeout", type=float, default=30.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", help="write the report as JSON")
+    args = parser.parse_args()
+
+    process = None
+    workdir = None
+    base_url = args.url
+    try:
+        if base_url is None:
+            workdir = args.workdir or tempfile.mkdtemp(prefix="shelter-load-")
+            prepare_workdir(workdir)
+            base_url = f"http://127.0.0.1:{args.port}"
+            process = start_server(args.port, args.workers, args.grid, workdir)
+            wait_ready(base_url, process)
+        report = run(base_url, args)
+    finally:
+        if process is not None:
+            process.terminate()
+            try:
+                process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        if workdir is not None and args.workdir is None:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    report['meta'] = {'url': base_url, 'users': args.users, 'duration': args.duration,
+                      'workers': None if args.url else args.workers, 'grid': args.grid or None,
+                      'created_at': time.strftime('%Y-%m-%dT%H:%M:%S')}
+    print_report(report)
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as file:
+            json.dump(report, file, ensure_ascii=False, indent=1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,360 @@
+"""Набір бенчмарків: маршрути, функції застосунку, маркери укриттів і база даних. Працює офлайн.
+
+Запуск: python -m benchmarks.suite --out results.json
+Порівняння з попереднім прогоном: python -m benchmarks.suite --compare baseline.json --threshold 0.25
+(код виходу 1, якщо медіана якогось вимірювання погіршилась більше ніж на threshold).
+Усі дані синтетичні або з репозиторію (shelters_data), геокодер замінено заглушкою,
+а файли кешів пишуться в тимчасову теку.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from benchmarks import bench_dijkstra
+from benchmarks.synthetic import LVIV_CENTER, grid_engine, grid_graph, random_points, write_shelters_csv
+from dash_map import db, find_shelter_algo
+from dash_map.contraction import ContractionHierarchy
+from dash_map.markers import ShelterMarkers
+from dash_map.route_cache import RouteCache
+from dash_map.routing_engine import RoutingEngine
+from dash_map.shelter_store import load_store
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SHELTERS_CSV = os.path.join(REPO_DIR, "shelters_data", "shelters_coords.csv")
+GROUPS = ("routing", "legacy", "app", "markers", "db")
+# Сітка — найгірший випадок для ієрархії скорочень (дуже багато скорочень), тож на великих сітках
+# її побудова триває хвилини; на справжньому графі міста вона значно дешевша
+CH_MAX_NODES = 1600
+
+
+class StubGeocoder:
+    """Геокодер без мережі: заздалегідь відомі адреси -> точки."""
+
+    def __init__(self, points):
+        self.points = points
+
+    def geocode(self, address):
+        return self.points.get(address)
+
+
+# Час кожного виклику fn(*args) у мілісекундах; setup() перед викликом не враховується
+def measure(fn, calls, setup=None, warmup=1):
+    calls = list(calls)
+    for args in calls[:warmup]:
+        if setup:
+            setup()
+        fn(*args)
+    times = []
+    for args in calls:
+        if setup:
+            setup()
+        started = time.perf_counter()
+        fn(*args)
+        times.append((time.perf_counter() - started) * 1000)
+    times.sort()
+    return {'n': len(times), 'ms_mean': statistics.fmean(times), 'ms_p50': statistics.median(times),
+            'ms_p95': times[min(len(times) - 1, int(len(times) * 0.95))], 'ms_min': times[0]}
+
+
+def _result(group, name, params, stats):
+    return {'group': group, 'name': name, 'params': params, **stats}
+
+
+def _once(fn):
+    started = time.perf_counter()
+    value = fn()
+    return value, {'n': 1, 'ms_p50': (time.perf_counter() - started) * 1000}
+
+
+# Маршрути на синтетичних сітках: від адреси (compute_routes з заглушкою геокодера) і окремі етапи.
+# Кожна сітка проганяється двічі: пошук Дейкстрою і через ієрархію скорочень (до CH_MAX_NODES вузлів)
+def bench_routing(sizes, queries, seed=0):
+    results = []
+    for n in sizes:
+        engine = grid_engine(n, seed=seed)
+        span = n * 0.0015 * 0.9
+        shelter_file = write_shelters_csv(os.path.abspath(f"shelters_{n}.csv"), max(n, 20), seed=seed, span_deg=span)
+        points = random_points(queries, seed=seed + 1, span_deg=span)
+        addresses = {f"Тестова {i + 1}": point for i, point in enumerate(points)}
+        find_shelter_algo.set_geocoder(StubGeocoder(addresses))
+        find_shelter_algo._engine = engine
+        find_shelter_algo._route_cache = RouteCache(maxsize=100_000)
+        params = {'nodes': engine.n_nodes, 'shelters': max(n, 20)}
+
+        results.append(_result('routing', 'nearest_node', params, measure(
+            engine.nearest_node, points)))
+        sources = [engine.nearest_node(*point) for point in points]
+        results.append(_result('routing', 'bounded_dijkstra', params, measure(
+            lambda source: engine.shortest_paths(source, limit=2500.0), [(s,) for s in sources])))
+
+        for search in ('dijkstra', 'ch') if engine.n_nodes <= CH_MAX_NODES else ('dijkstra',):
+            if search == 'ch':
+                engine.hierarchy, build = _once(lambda: ContractionHierarchy.build(engine))
+                results.append(_result('routing', 'ch_build', params, build))
+                targets = [int(node) for node in find_shelter_algo.get_shelter_index(shelter_file).graph_nodes(engine)]
+                results.append(_result('routing', 'ch_point_to_point', params, measure(
+                    lambda s, t: engine.hierarchy.query(s, t), zip(sources, targets * queries))))
+            find_shelter_algo._datasets.clear()
+            find_shelter_algo.get_shelter_dataset(shelter_file)
+            cache = find_shelter_algo.get_route_cache()
+            calls = [(address, shelter_file) for address in addresses]
+            results.append(_result('routing', f'compute_routes_{search}_cold', params, measure(
+                find_shelter_algo.compute_routes, calls, setup=cache.clear)))
+            results.append(_result('routing', f'compute_routes_{search}_warm', params, measure(
+                find_shelter_algo.compute_routes, calls)))
+    find_shelter_algo._datasets.clear()
+    find_shelter_algo._engine = None
+    find_shelter_algo._route_cache = None
+    find_shelter_algo.set_geocoder(None)
+    return results
+
+
+# Старий словниковий Дейкстра та A* з benchmarks.bench_dijkstra
+def bench_legacy(sizes, queries, seed=0):
+    return [_result('legacy', f"dijkstra_{row['mode']}", {'nodes': row['nodes']},
+                    {'n': queries, 'ms_mean': row['ms_avg'], 'settled_avg': row['settled_avg']})
+            for row in bench_dijkstra.run(sizes=sizes, queries=queries, seed=seed)]
+
+
+# Функції застосунку як є: build_graph_dict і compute_route (найближче укриття через поле)
+# на невеликому графі-сітці у форматі osmnx
+def bench_app(sizes, queries, seed=0):
+    results = []
+    for n in sizes:
+        G = grid_graph(n, seed=seed)
+        params = {'nodes': G.number_of_nodes(), 'edges': G.number_of_edges()}
+        results.append(_result('app', 'build_graph_dict', params, measure(
+            find_shelter_algo.build_graph_dict, [(G,)] * max(queries // 10, 3))))
+
+        span = n * 0.0015 * 0.9
+        shelter_file = write_shelters_csv(os.path.abspath(f"app_shelters_{n}.csv"), max(n, 20), seed=seed,
+                                          span_deg=span)
+        points = random_points(queries, seed=seed + 1, span_deg=span)
+        addresses = {f"Тестова {i + 1}": point for i, point in enumerate(points)}
+        find_shelter_algo.set_geocoder(StubGeocoder(addresses))
+        find_shelter_algo._engine = RoutingEngine.from_networkx(G)
+        find_shelter_algo._route_cache = RouteCache(maxsize=100_000)
+        find_shelter_algo._datasets.clear()
+        find_shelter_algo.get_shelter_dataset(shelter_file)
+        cache = find_shelter_algo.get_route_cache()
+        calls = [(address, shelter_file) for address in addresses]
+        params = dict(params, shelters=max(n, 20))
+        results.append(_result('app', 'compute_route_cold', params, measure(
+            find_shelter_algo.compute_route, calls, setup=cache.clear)))
+        results.append(_result('app', 'compute_route_warm', params, measure(
+            find_shelter_algo.compute_route, calls)))
+    find_shelter_algo._datasets.clear()
+    find_shelter_algo._engine = None
+    find_shelter_algo._route_cache = None
+    find_shelter_algo.set_geocoder(None)
+
+    return results
+
+
+# Випадкова видима область на заданому зумі (вікно близько 1200 x 800 пікселів)
+def random_viewport(rnd, zoom):
+    width = 360 * 1200 / (256 * 2 ** zoom)
+    height = width * 800 / 1200 * np.cos(np.radians(49.84))
+    lat = LVIV_CENTER[0] + rnd.uniform(-0.06, 0.06)
+    lon = LVIV_CENTER[1] + rnd.uniform(-0.06, 0.06)
+    return {'south': lat - height / 2, 'north': lat + height / 2,
+            'west': lon - width / 2, 'east': lon + width / 2, 'zoom': zoom}
+
+
+# Колишній вибір маркерів через pandas: 500 найбільших укриттів у видимій області.
+# Застосунок його вже не використовує, він лишається як точка порівняння для ShelterMarkers
+def select_top_200(shelters_df: pd.DataFrame, bounds: dict[str, float]) -> pd.DataFrame:
+    if not bounds:
+        bounds = {'south': 49.8, 'west': 23.9, 'north': 49.9, 'east': 24.1}
+    shelters_df = shelters_df[
+        (shelters_df['latitude'] <= bounds['north']) &
+        (shelters_df['latitude'] >= bounds['south']) &
+        (shelters_df['longitude'] <= bounds['east']) &
+        (shelters_df['longitude'] >= bounds['west'])
+    ]
+    return shelters_df.nlargest(500, 'capacity_of_persons')
+
+
+# Маркери для видимої області (колбек update_shelter_markers) на справжніх і синтетичних укриттях,
+# а для справжніх — і колишній вибір через pandas (select_top_200)
+def bench_markers(sizes, queries, seed=0):
+    results = []
+    files = [('shelters_coords', SHELTERS_CSV)] if os.path.exists(SHELTERS_CSV) else []
+    files += [(f'synthetic_{count}', write_shelters_csv(os.path.abspath(f"markers_{count}.csv"), count,
+                                                         seed=seed, span_deg=0.12)) for count in sizes]
+    rnd = random.Random(seed)
+    for name, csv_path in files:
+        store = load_store(csv_path)
+        markers, build = _once(lambda: ShelterMarkers(store))
+        params = {'shelters': len(store), 'source': name}
+        results.append(_result('markers', 'build', params, build))
+        for zoom in (11, 13, 15, 17):
+            viewports = [(random_viewport(rnd, zoom), zoom) for _ in range(queries)]
+            results.append(_result('markers', 'for_viewport', dict(params, zoom=zoom), measure(
+                markers.for_viewport, viewports)))
+        if name == 'shelters_coords':
+            shelters_df = pd.read_csv(csv_path)
+            for zoom in (11, 13, 15, 17):
+                viewports = [(shelters_df, random_viewport(rnd, zoom)) for _ in range(queries)]
+                results.append(_result('markers', 'select_top_200', dict(params, zoom=zoom), measure(
+                    select_top_200, viewports)))
+    return results
+
+
+# Відгуки й авторизація на таблицях різного розміру
+def bench_db(sizes, queries, seed=0):
+    results = []
+    for size in sizes:
+        rnd = random.Random(seed)
+        db_path = os.path.abspath(f"bench_{size}.sqlite")
+        db.init_db(db_path)
+        conn = db.get_connection(db_path)
+        shelters = [f"shelter-{i}" for i in range(max(size // 100, 10))]
+        conn.execute('BEGIN')
+        conn.executemany('INSERT INTO users (username, email, token) VALUES (?, ?, ?)',
+                         ((f"user{i}", f"user{i}@example.com", f"token{i}") for i in range(size)))
+        conn.executemany('INSERT INTO reviews (shelter_id, review_text, username, created_at) VALUES (?, ?, ?, ?)',
+                         ((rnd.choice(shelters), f"Відгук {i}", f"user{i % size}", float(i)) for i in range(size)))
+        conn.execute('COMMIT')
+        params = {'rows': size}
+        users = [rnd.randrange(size) for _ in range(queries)]
+        picked = [rnd.choice(shelters) for _ in range(queries)]
+
+        results.append(_result('db', 'find_user_by_email', params, measure(
+            lambda i: db.find_user_by_email(f"user{i}@example.com", db_path), [(i,) for i in users])))
+        results.append(_result('db', 'resolve_token_uncached', params, measure(
+            lambda i: db.resolve_token(f"token{i}", db_path), [(i,) for i in users], setup=db.token_cache.clear)))
+        results.append(_result('db', 'resolve_token_cached', params, measure(
+            lambda i: db.resolve_token(f"token{i}", db_path), [(users[0],)] * queries)))
+        results.append(_result('db', 'register_user', params, measure(
+            lambda i: db.register_user(f"new{i}", f"new{i}@example.com", f"new-token{i}", db_path),
+            [(i,) for i in range(queries)], warmup=0)))
+        results.append(_result('db', 'reviews_first_page', params, measure(
+            lambda shelter: db.get_reviews_page(shelter, db_path=db_path), [(s,) for s in picked],
+            setup=db.reviews_page_cache.clear)))
+        cursors = [(s, db.get_reviews_page(s, db_path=db_path)[1]) for s in picked]
+        results.append(_result('db', 'reviews_next_page', params, measure(
+            lambda shelter, cursor: db.get_reviews_page(shelter, before=cursor, db_path=db_path),
+            [(s, c) for s, c in cursors if c])))
+        results.append(_result('db', 'review_counts', params, measure(
+            lambda: db.review_counts(db_path), [()] * queries, setup=db.review_counts_cache.clear)))
+        results.append(_result('db', 'add_review', params, measure(
+            lambda shelter: db.add_review(shelter, "Новий відгук", "user0", db_path), [(s,) for s in picked],
+            warmup=0)))
+    return results
+
+
+def result_key(result) -> str:
+    params = ",".join(f"{key}={value}" for key, value in sorted(result['params'].items()))
+    return f"{result['group']}.{result['name']}[{params}]"
+
+
+# Погіршення відносно baseline: медіана (або середнє) більша ніж у (1 + threshold) разів
+# і щонайменше на min_ms мілісекунд, щоб шум дуже коротких вимірювань не давав хибних тривог
+def compare(results, baseline, threshold=0.25, min_ms=0.1):
+    previous = {result_key(result): result for result in baseline['results']}
+    rows = []
+    for result in results:
+        before = previous.get(result_key(result))
+        if before is None:
+            continue
+        metric = 'ms_p50' if 'ms_p50' in result and 'ms_p50' in before else 'ms_mean'
+        old, new = before.get(metric), result.get(metric)
+        if old is None or new is None:
+            continue
+        ratio = new / old if old > 0 else float('inf')
+        regressed = ratio > 1 + threshold and new - old > min_ms
+        rows.append({'key': result_key(result), 'metric': metric, 'before': old, 'after': new,
+                     'ratio': ratio, 'regressed': regressed})
+    return rows
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(groups=GROUPS, quick=False, seed=0):
+    sizes = {
+        'routing': (20, 40) if quick else (20, 40, 80, 160),
+        'legacy': (50, 100) if quick else (50, 100, 200),
+        'app': (20,) if quick else (20, 60),
+        'markers': (20_000,) if quick else (20_000, 100_000),
+        'db': (1_000, 10_000) if quick else (1_000, 10_000, 100_000),
+    }
+    queries = 20 if quick else 100
+    benches = {'routing': bench_routing, 'legacy': bench_legacy, 'app': bench_app, 'markers': bench_markers,
+               'db': bench_db}
+    results = []
+    workdir = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix="shelter-bench-") as tmp_dir:
+        # Кеші, знімки і бази (instance/...) створюються у тимчасовій теці, а не в робочій
+        os.chdir(tmp_dir)
+        try:
+            for group in groups:
+                started = time.perf_counter()
+                results += benches[group](sizes[group], queries, seed)
+                print(f"{group}: {time.perf_counter() - started:.1f} с", file=sys.stderr)
+        finally:
+            os.chdir(workdir)
+    return {
+        'meta': {'commit': _git_commit(), 'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                 'python': platform.python_version(), 'platform': platform.platform(),
+                 'numpy': np.__version__, 'quick': quick, 'seed': seed},
+        'results': results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmarks for routing, app functions, markers "
+                                                 "and the database")
+    parser.add_argument("--out", help="write results as JSON to this file")
+    parser.add_argument("--compare", help="baseline JSON from an earlier run")
+    parser.add_argument("--threshold", type=float, default=0.25, help="allowed slowdown, 0.25 = 25%%")
+    parser.add_argument("--min-ms", type=float, default=0.1, help="ignore slowdowns smaller than this")
+    parser.add_argument("--only", default=",".join(GROUPS), help=f"comma-separated groups: {','.join(GROUPS)}")
+    parser.add_argument("--quick", action="store_true", help="smaller sizes and fewer queries")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    groups = [group for group in args.only.split(",") if group]
+    unknown = set(groups) - set(GROUPS)
+    if unknown:
+        parser.error(f"unknown groups: {', '.join(sorted(unknown))}")
+    report = run(groups, args.quick, args.seed)
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as file:
+            json.dump(report, file, ensure_ascii=False, indent=1)
+
+    for result in report['results']:
+        value = result.get('ms_p50', result.get('ms_mean'))
+        print(f"{result_key(result):<70} {value:>10.3f} ms")
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as file:
+            baseline = json.load(file)
+        rows = compare(report['results'], baseline, args.threshold, args.min_ms)
+        print(f"\nПорівняння з {args.compare} (commit {baseline['meta'].get('commit')}):")
+        for row in rows:
+            mark = "  ПОГІРШЕННЯ" if row['regressed'] else ""
+            print(f"{row['key']:<70} {row['before']:>9.3f} -> {row['after']:>9.3f} ms "
+                  f"({row['ratio']:.2f}x){mark}")
+        if any(row['regressed'] for row in rows):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
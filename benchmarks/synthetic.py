@@ -0,0 +1,84 @@
+"""synthetic"""
+import csv
+import random
+
+from dash_map.find_shelter_algo import haversine_m
+from dash_map.routing_engine import RoutingEngine
+
+LVIV_CENTER = (49.841427, 24.020676)
+SHELTER_COLUMNS = ("type_of_room", "account_number", "capacity_of_persons", "ability_to_publish_information",
+                   "district", "community", "city", "street", "building_number", "latitude", "longitude")
+ROOM_TYPES = ("Найпростіше укриття", "Сховище", "Протирадіаційне укриття")
+
+
+# Синтетична сітка вулиць n x n навколо центру Львову з невеликим шумом у координатах.
+# Повертає граф у форматі build_graph_dict, координати вузлів і випадкові вузли-укриття
+def grid_city(n, shelters=50, seed=0, step_deg=0.0015):
+    rnd = random.Random(seed)
+    lat0 = LVIV_CENTER[0] - n * step_deg / 2
+    lon0 = LVIV_CENTER[1] - n * step_deg / 2
+    coords = {}
+    for i in range(n):
+        for j in range(n):
+            coords[i * n + j] = (lat0 + i * step_deg + rnd.uniform(-1, 1) * step_deg * 0.2,
+                                 lon0 + j * step_deg + rnd.uniform(-1, 1) * step_deg * 0.2)
+    graph = {node: {} for node in coords}
+    for i in range(n):
+        for j in range(n):
+            u = i * n + j
+            for di, dj in ((0, 1), (1, 0), (0, -1), (-1, 0)):
+                a, b = i + di, j + dj
+                if 0 <= a < n and 0 <= b < n:
+                    v = a * n + b
+                    # Вулиці не коротші за пряму, як і в графі OSM
+                    graph[u][v] = haversine_m(coords[u], coords[v]) * rnd.uniform(1.0, 1.3)
+    targets = rnd.sample(sorted(coords), min(shelters, len(coords)))
+    return graph, coords, targets
+
+
+# Та сама сітка у вигляді RoutingEngine (CSR), як граф, що читається зі знімка
+def grid_engine(n, seed=0, step_deg=0.0015) -> RoutingEngine:
+    graph, coords, _ = grid_city(n, shelters=0, seed=seed, step_deg=step_deg)
+    nodes = sorted(coords)
+    indptr, indices, lengths = [0], [], []
+    for u in nodes:
+        for v, length in sorted(graph[u].items()):
+            indices.append(v)
+            lengths.append(length)
+        indptr.append(len(indices))
+    return RoutingEngine(nodes, [coords[u][0] for u in nodes], [coords[u][1] for u in nodes],
+                         indptr, indices, lengths)
+
+
+# Та сама сітка як граф networkx у форматі osmnx (вузли з x/y, ребра з length і назвою вулиці):
+# невеликий детермінований граф міста замість GraphML, який без мережі не завантажити
+def grid_graph(n, seed=0, step_deg=0.0015):
+    import networkx as nx
+    graph, coords, _ = grid_city(n, shelters=0, seed=seed, step_deg=step_deg)
+    G = nx.MultiDiGraph()
+    for node, (lat, lon) in coords.items():
+        G.add_node(node, y=lat, x=lon)
+    for u, neighbours in graph.items():
+        for v, length in neighbours.items():
+            street = f"вулиця {u // n}" if u // n == v // n else f"проспект {u % n}"
+            G.add_edge(u, v, length=length, name=street)
+    return G
+
+
+# Випадкові точки у квадраті span_deg навколо центру Львову
+def random_points(count, seed=0, span_deg=0.1):
+    rnd = random.Random(seed)
+    return [(LVIV_CENTER[0] + rnd.uniform(-0.5, 0.5) * span_deg,
+             LVIV_CENTER[1] + rnd.uniform(-0.5, 0.5) * span_deg) for _ in range(count)]
+
+
+# CSV укриттів у форматі shelters_coords.csv з count випадковими укриттями
+def write_shelters_csv(path, count, seed=0, span_deg=0.1):
+    rnd = random.Random(seed)
+    with open(path, 'w', encoding='utf-8', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(SHELTER_COLUMNS)
+        for i, (lat, lon) in enumerate(random_points(count, seed, span_deg)):
+            writer.writerow([rnd.choice(ROOM_TYPES), '', rnd.randint(10, 500), 'так', 'Львівський', 'Львівська',
+                             'Львів', f"Синтетична {i // 20}", str(i % 20 + 1), lat, lon])
+    return path
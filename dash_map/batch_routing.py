@@ -0,0 +1,176 @@
+"""batch_routing"""
+# Пакетний пошук найближчих укриттів для багатьох адрес або координат.
+# HTTP: POST /api/nearest-shelters з JSON {"items": [{"id": ..., "address": ...} | {"lat": ..., "lon": ...}]}
+# CLI:  python -m dash_map.batch_routing addresses.csv > result.ndjson
+# Результати віддаються по одному JSON на рядок (NDJSON) у порядку вхідних елементів.
+import argparse
+import concurrent.futures
+import csv
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from dash_map import find_shelter_algo
+
+_pool = None
+_pool_pid = None
+
+
+class SharedRateLimiter:
+    """Не більше rate викликів за секунду на всі процеси пулу разом
+    (Nominatim дозволяє один запит за секунду з одного клієнта)."""
+
+    def __init__(self, rate=1.0):
+        self.interval = 1 / rate if rate > 0 else 0
+        self._lock = multiprocessing.Lock()
+        self._next_slot = multiprocessing.Value('d', 0.0, lock=False)
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot.value)
+            self._next_slot.value = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+    def limit(self, geocode):
+        def limited(address):
+            self.wait()
+            return geocode(address)
+        return limited
+
+
+# Ініціалізація процесу пулу: граф і поле укриттів відкриваються через mmap, тож це швидко.
+# Без limiter процеси пулу не звертаються до віддаленого геокодера зовсім, лише до локального кешу
+def _init_worker(shelter_file, offline, limiter=None):
+    geocoder = find_shelter_algo.get_geocoder()
+    if offline or limiter is None:
+        geocoder.fallback = None
+    elif geocoder.fallback is not None:
+        geocoder.fallback = limiter.limit(geocoder.fallback)
+    find_shelter_algo.get_engine()
+    find_shelter_algo.get_shelter_field(shelter_file)
+
+
+# Обробка одного елемента: геокодування (якщо треба) і маршрут, з часом кожного етапу
+def route_item(item, shelter_file=find_shelter_algo.SHELTER_FILE, include_path=False):
+    started = time.perf_counter()
+    result = {'id': item.get('id')}
+    try:
+        if item.get('lat') is not None and item.get('lon') is not None:
+            point = (float(item['lat']), float(item['lon']))
+            geocode_ms = 0.0
+        elif item.get('address'):
+            point = find_shelter_algo.locate_address(str(item['address']))
+            geocode_ms = (time.perf_counter() - started) * 1000
+            if point is None:
+                result.update(status='address_not_found', total_ms=round(geocode_ms, 2))
+                return result
+        else:
+            result.update(status='invalid_item', total_ms=0.0)
+            return result
+        route_started = time.perf_counter()
+        name, minutes, coords = find_shelter_algo.route_from_point(point, shelter_file)
+        route_ms = (time.perf_counter() - route_started) * 1000
+        result.update(lat=point[0], lon=point[1])
+        if name is None:
+            result['status'] = 'no_reachable_shelter'
+        else:
+            result.update(status='ok', shelter=name, minutes=minutes, shelter_lat=coords[-1][0],
+                          shelter_lon=coords[-1][1])
+            if include_path:
+                result['path'] = coords
+        result.update(geocode_ms=round(geocode_ms, 2), route_ms=round(route_ms, 2))
+    except Exception as e:
+        result.update(status='error', error=str(e))
+    result['total_ms'] = round((time.perf_counter() - started) * 1000, 2)
+    return result
+
+
+def _route_packed(args):
+    return route_item(*args)
+
+
+# Пул процесів створюється ліниво один раз на процес (на кожен воркер gunicorn).
+# Воркер уже має фонові потоки (черга завдань, запис відгуків, оновлення укриттів), тож процеси пулу
+# запускаються через forkserver, а не fork: копія процесу з чужими захопленими замками може зависнути.
+# Для HTTP процеси пулу геокодують лише локально: кілька процесів у кожному воркері
+# не мають звертатися до Nominatim паралельно, а відповідь має вкластися в таймаут gunicorn
+def get_pool(workers=None, shelter_file=find_shelter_algo.SHELTER_FILE):
+    global _pool, _pool_pid
+    if _pool is None or _pool_pid != os.getpid():
+        _pool = ProcessPoolExecutor(max_workers=workers or os.cpu_count(), initializer=_init_worker,
+                                    initargs=(shelter_file, True),
+                                    mp_context=multiprocessing.get_context("forkserver"))
+        _pool_pid = os.getpid()
+    return _pool
+
+
+# Розподіляє елементи по пулу процесів і віддає результати у вхідному порядку по мірі готовності.
+# time_budget — скільки секунд може тривати вся пачка: елементи, що не встигли, отримують статус
+# 'timeout' (їх можна надіслати ще раз), а їхні задачі в пулі скасовуються
+def route_batch(items, pool=None, shelter_file=find_shelter_algo.SHELTER_FILE, include_path=False,
+                chunksize=16, time_budget=None):
+    pool = pool or get_pool(shelter_file=shelter_file)
+    results = pool.map(_route_packed, ((item, shelter_file, include_path) for item in items),
+                       timeout=time_budget, chunksize=chunksize)
+    done = 0
+    try:
+        for result in results:
+            result['index'] = done
+            done += 1
+            yield result
+    except concurrent.futures.TimeoutError:
+        for index in range(done, len(items)):
+            yield {'id': items[index].get('id'), 'index': index, 'status': 'timeout'}
+
+
+def to_ndjson(results):
+    for result in results:
+        yield json.dumps(result, ensure_ascii=False) + "\n"
+
+
+# Читаємо вхід CLI: CSV з колонками id/address або id/lat/lon, чи JSON Lines
+def read_items(file):
+    first = file.readline()
+    if first.lstrip().startswith('{'):
+        lines = [first] + list(file)
+        return [json.loads(line) for line in lines if line.strip()]
+    reader = csv.DictReader([first] + list(file))
+    return [{key: (value or None) for key, value in row.items()} for row in reader]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Nearest shelters for a batch of addresses or coordinates")
+    parser.add_argument("input", help="CSV (id,address or id,lat,lon) or JSON Lines; '-' for stdin")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--shelters", default=find_shelter_algo.SHELTER_FILE)
+    parser.add_argument("--offline", action="store_true", help="do not call the remote geocoder")
+    parser.add_argument("--geocode-rate", type=float, default=1.0,
+                        help="max remote geocoder requests per second, shared by all pool processes")
+    parser.add_argument("--include-path", action="store_true")
+    args = parser.parse_args()
+
+    if args.input == '-':
+        items = read_items(sys.stdin)
+    else:
+        with open(args.input, encoding='utf-8', newline='') as file:
+            items = read_items(file)
+
+    # Граф і поле відкриваються до створення пулу, щоб процеси пулу знайшли готові файли на диску
+    find_shelter_algo.get_engine()
+    find_shelter_algo.get_shelter_field(args.shelters)
+    started = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=args.workers, initializer=_init_worker,
+                             initargs=(args.shelters, args.offline, SharedRateLimiter(args.geocode_rate))) as pool:
+        for line in to_ndjson(route_batch(items, pool, args.shelters, args.include_path)):
+            sys.stdout.write(line)
+    elapsed = time.perf_counter() - started
+    print(f"{len(items)} елементів за {elapsed:.1f} с ({len(items) / max(elapsed, 1e-9):.1f}/с)", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
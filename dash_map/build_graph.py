@@ -0,0 +1,47 @@
+"""Офлайн-побудова знімка графу для маршрутів.
+
+Запуск: python -m dash_map.build_graph [--network walk]
+Єдине місце, де потрібен osmnx: сервер читає готовий знімок.
+Разом зі знімком будується ієрархія скорочень для пошуку найближчих укриттів на великому пішохідному графі.
+"""
+import argparse
+import os
+import time
+
+from dash_map.config import GRAPH_NETWORK, MAX_WALK_MINUTES
+from dash_map.contraction import ContractionHierarchy
+from dash_map.find_shelter_algo import GRAPH_SNAPSHOTS, WALK_SPEED_KMH, load_graph
+from dash_map.routing_engine import RoutingEngine
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the routing graph snapshot")
+    parser.add_argument("--network", choices=sorted(GRAPH_SNAPSHOTS), default=GRAPH_NETWORK)
+    parser.add_argument("--out", default=None)
+    parser.add_argument("--no-ch", action="store_true", help="skip the contraction hierarchy")
+    parser.add_argument("--witness-limit", type=int, default=60)
+    args = parser.parse_args()
+    out = args.out or GRAPH_SNAPSHOTS[args.network]
+
+    started = time.perf_counter()
+    G = load_graph(args.network)
+    engine = RoutingEngine.from_networkx(G)
+    engine.save(out)
+    print(f"Знімок графу ({args.network}): {engine.n_nodes} вузлів, {engine.n_edges} ребер, "
+          f"відбиток {engine.fingerprint}, {time.perf_counter() - started:.1f} с -> {out}")
+
+    if not args.no_ch:
+        hierarchy = ContractionHierarchy.build(engine, witness_limit=args.witness_limit,
+                                               log_every=max(engine.n_nodes // 10, 1))
+        print(f"Ієрархія скорочень: {hierarchy.n_shortcuts} скорочень, {hierarchy.build_seconds:.1f} с")
+        # Заміри на цьому ж графі зберігаються з ієрархією: сервер бере її, лише якщо пошук
+        # найближчих укриттів через неї виявився швидшим за Дейкстру
+        timings = hierarchy.calibrate(engine, MAX_WALK_MINUTES / 60 * WALK_SPEED_KMH * 1000)
+        print(f"Найближчі: ієрархія {timings['nearest_ch_ms']} мс, Дейкстра {timings['nearest_dijkstra_ms']} мс"
+              f" -> {'ієрархія' if hierarchy.faster_for_nearest else 'Дейкстра'}")
+        hierarchy.save(os.path.join(out, "ch"))
+        print(f"-> {os.path.join(out, 'ch')}")
+
+
+if __name__ == "__main__":
+    main()
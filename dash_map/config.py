@@ -0,0 +1,34 @@
+"""config"""
+import os
+
+# Режим шару укриттів: 'server' — маркери будує сервер на кожен рух мапи,
+# 'client' — укриття передаються один раз як GeoJSON і фільтруються у браузері
+SHELTER_LAYER_MODE = os.environ.get("SHELTER_LAYER_MODE", "server")
+
+# Кількість процесів пулу пакетного API /api/nearest-shelters у кожному воркері gunicorn.
+# Пул свій у кожного воркера, тож за замовчуванням ядра діляться між WEB_CONCURRENCY воркерами
+BATCH_WORKERS = int(os.environ.get("BATCH_WORKERS", "0")) or \
+    max(1, os.cpu_count() // max(1, int(os.environ.get("WEB_CONCURRENCY", "2"))))
+# Обмеження одного запиту до /api/nearest-shelters: кількість елементів і час (секунди).
+# Відповідь має вкластися в timeout воркера gunicorn (60 с), інакше його вб'ють посеред потоку;
+# елементи, що не встигли за BATCH_TIME_BUDGET, повертаються зі статусом 'timeout'
+BATCH_MAX_ITEMS = int(os.environ.get("BATCH_MAX_ITEMS", "1000"))
+BATCH_TIME_BUDGET = float(os.environ.get("BATCH_TIME_BUDGET", "45"))
+
+# Скільки найближчих укриттів показувати і як далеко їх шукати (хвилин пішки)
+TOP_K_SHELTERS = int(os.environ.get("TOP_K_SHELTERS", "3"))
+MAX_WALK_MINUTES = float(os.environ.get("MAX_WALK_MINUTES", "30"))
+
+# Мережа для маршрутів: 'drive' — дороги, 'walk' — пішохідна мережа OSM (з тротуарами і стежками).
+# Пішохідний граф у кілька разів більший, тому для нього варто зібрати ієрархію скорочень
+GRAPH_NETWORK = os.environ.get("GRAPH_NETWORK", "drive")
+
+# Скільки записів тримає спільний кеш маршрутів (адреси та вузли графу) у instance/route_cache.sqlite
+ROUTE_CACHE_SIZE = int(os.environ.get("ROUTE_CACHE_SIZE", "50000"))
+
+# Фонові завдання маршрутів: кількість потоків у кожному воркері та дедлайн одного запиту (секунди)
+ROUTE_JOB_WORKERS = int(os.environ.get("ROUTE_JOB_WORKERS", "2"))
+ROUTE_JOB_DEADLINE = float(os.environ.get("ROUTE_JOB_DEADLINE", "30"))
+
+# Частка запитів, які профілюються cProfile (0 — вимкнено); профілі пишуться в instance/profiles
+PROFILE_SAMPLE_RATE = float(os.environ.get("PROFILE_SAMPLE_RATE", "0"))
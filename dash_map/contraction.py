@@ -0,0 +1,439 @@
+"""contraction"""
+import heapq
+import json
+import os
+import random
+import shutil
+import time
+
+import numpy as np
+
+CH_FORMAT = 1
+CH_ARRAYS = ("rank", "up_indptr", "up_indices", "up_weights", "up_via",
+             "down_indptr", "down_indices", "down_weights", "down_via")
+BUCKET_ARRAYS = ("indptr", "target", "dist", "parent")
+
+
+# Ребра вузлів у CSR, сусіди кожного вузла відсортовані за індексом
+def _to_csr(edges, n):
+    indptr = np.zeros(n + 1, dtype=np.int64)
+    for node, neighbours in enumerate(edges):
+        indptr[node + 1] = indptr[node] + len(neighbours)
+    indices = np.empty(indptr[-1], dtype=np.int32)
+    weights = np.empty(indptr[-1], dtype=np.float64)
+    via = np.empty(indptr[-1], dtype=np.int32)
+    for node, neighbours in enumerate(edges):
+        start = indptr[node]
+        for offset, neighbour in enumerate(sorted(neighbours)):
+            indices[start + offset] = neighbour
+            weights[start + offset], via[start + offset] = neighbours[neighbour]
+    return indptr, indices, weights, via
+
+
+class ContractionHierarchy:
+    """Ієрархія скорочень (contraction hierarchies) для графу рушія маршрутів.
+    Вузли по черзі «стягуються», а найкоротші шляхи через них замінюються ребрами-скороченнями.
+    Запит — двонаправлений Дейкстра лише вгору по рангах, він торкається кількох сотень вузлів
+    навіть на великому пішохідному графі. Будується офлайн і зберігається поруч зі знімком графу."""
+
+    def __init__(self, rank, up_indptr, up_indices, up_weights, up_via,
+                 down_indptr, down_indices, down_weights, down_via, fingerprint="", timings=None,
+                 build_seconds=None):
+        self.rank = np.asarray(rank, dtype=np.int32)
+        # up: ребра v -> x до вузлів з вищим рангом; down: ребра u -> v від вузлів з вищим рангом,
+        # згруповані за v (для зворотного пошуку від цілі)
+        self.up = (np.asarray(up_indptr, dtype=np.int64), np.asarray(up_indices, dtype=np.int32),
+                   np.asarray(up_weights, dtype=np.float64), np.asarray(up_via, dtype=np.int32))
+        self.down = (np.asarray(down_indptr, dtype=np.int64), np.asarray(down_indices, dtype=np.int32),
+                     np.asarray(down_weights, dtype=np.float64), np.asarray(down_via, dtype=np.int32))
+        self.fingerprint = fingerprint
+        # Заміри запитів на цьому ж графі (calibrate): ієрархія чи Дейкстра, мс на запит
+        self.timings = dict(timings or {})
+        self.build_seconds = build_seconds
+
+    @property
+    def n_shortcuts(self) -> int:
+        return int(np.count_nonzero(self.up[3] >= 0) + np.count_nonzero(self.down[3] >= 0))
+
+    # Сервер бере ієрархію (відра найближчих укриттів), лише якщо на цьому графі вона виміряно
+    # швидша за обмежений Дейкстру. Без замірів (стара ієрархія) вважаємо, що швидша
+    @property
+    def faster_for_nearest(self) -> bool:
+        return self.timings.get("nearest_ch_ms", 0.0) < self.timings.get("nearest_dijkstra_ms", float('inf'))
+
+    # Попередня обробка графу рушія. witness_limit обмежує кількість вузлів у пошуку свідків:
+    # менше — швидша побудова, але більше зайвих скорочень (на правильність не впливає)
+    @classmethod
+    def build(cls, engine, witness_limit=60, log_every=0) -> "ContractionHierarchy":
+        n = engine.n_nodes
+        indptr, indices, lengths = engine.indptr, engine.indices, engine.lengths
+        out_adj = [{} for _ in range(n)]
+        in_adj = [{} for _ in range(n)]
+        for u in range(n):
+            for pos in range(indptr[u], indptr[u + 1]):
+                v = int(indices[pos])
+                if v != u:
+                    out_adj[u][v] = (float(lengths[pos]), -1)
+                    in_adj[v][u] = (float(lengths[pos]), -1)
+
+        # Відстані від u в поточному (ще не стягнутому) графі без вузла skip, не далі max_dist;
+        # пошук зупиняється, щойно встановлено всі цілі
+        def witness(u, skip, max_dist, targets):
+            dist = {u: 0.0}
+            heap = [(0.0, u)]
+            settled = 0
+            remaining = len(targets)
+            while heap and settled < witness_limit and remaining:
+                d, node = heapq.heappop(heap)
+                if d > max_dist:
+                    break
+                if d > dist[node]:
+                    continue
+                settled += 1
+                if node in targets:
+                    remaining -= 1
+                for nbr, (w, _) in out_adj[node].items():
+                    if nbr == skip:
+                        continue
+                    nd = d + w
+                    if nd < dist.get(nbr, float('inf')):
+                        dist[nbr] = nd
+                        heapq.heappush(heap, (nd, nbr))
+            return dist
+
+        # Скорочення, які знадобляться, якщо стягнути вузол v
+        def shortcuts_for(v):
+            outs = list(out_adj[v].items())
+            result = []
+            for u, (wu, _) in in_adj[v].items():
+                targets = [(x, wu + wx) for x, (wx, _) in outs if x != u]
+                if not targets:
+                    continue
+                dist = witness(u, v, max(d for _, d in targets), {x for x, _ in targets})
+                result.extend((u, x, d) for x, d in targets if dist.get(x, float('inf')) > d)
+            return result
+
+        # Пріоритет: різниця ребер (скорочення мінус видалені ребра), кількість уже стягнутих сусідів
+        # і рівень у ієрархії — так стягування рівномірне, а пошук вгору короткий
+        deleted = [0] * n
+        level = [0] * n
+
+        def priority(v, shortcuts):
+            return len(shortcuts) - len(in_adj[v]) - len(out_adj[v]) + deleted[v] + level[v]
+
+        started = time.perf_counter()
+        heap = [(priority(v, shortcuts_for(v)), v) for v in range(n)]
+        heapq.heapify(heap)
+        rank = np.full(n, -1, dtype=np.int32)
+        up_edges = [None] * n
+        down_edges = [None] * n
+        order = 0
+        while heap:
+            _, v = heapq.heappop(heap)
+            if rank[v] >= 0:
+                continue
+            # Ледаче оновлення: якщо пріоритет зріс, повертаємо вузол у чергу.
+            # Інакше стягуємо його тими ж скороченнями, що пораховані для пріоритету
+            shortcuts = shortcuts_for(v)
+            current = priority(v, shortcuts)
+            if heap and current > heap[0][0]:
+                heapq.heappush(heap, (current, v))
+                continue
+            for u, x, d in shortcuts:
+                if d < out_adj[u].get(x, (float('inf'), -1))[0]:
+                    out_adj[u][x] = (d, v)
+                    in_adj[x][u] = (d, v)
+            rank[v] = order
+            order += 1
+            # Всі сусіди ще не стягнуті, отже мають вищий ранг: ці ребра й утворюють граф запитів
+            up_edges[v] = out_adj[v]
+            down_edges[v] = in_adj[v]
+            for x in out_adj[v]:
+                del in_adj[x][v]
+                deleted[x] += 1
+                level[x] = max(level[x], level[v] + 1)
+            for u in in_adj[v]:
+                del out_adj[u][v]
+                deleted[u] += 1
+                level[u] = max(level[u], level[v] + 1)
+            out_adj[v] = {}
+            in_adj[v] = {}
+            if log_every and order % log_every == 0:
+                print(f"  стягнуто {order}/{n} вузлів, {time.perf_counter() - started:.0f} с")
+        return cls(rank, *_to_csr(up_edges, n), *_to_csr(down_edges, n), fingerprint=engine.fingerprint,
+                   build_seconds=round(time.perf_counter() - started, 1))
+
+    # Заміряє середній час пошуку найближчих з n_targets випадкових цілей не далі limit
+    # з samples випадкових вузлів: ієрархією (відрами) і Дейкстрою scipy. Результат — у timings
+    def calibrate(self, engine, limit, samples=30, n_targets=200, k=3, seed=0) -> dict:
+        rnd = random.Random(seed)
+        n = engine.n_nodes
+        sources = [(rnd.randrange(n),) for _ in range(samples)]
+        target_nodes = np.array([rnd.randrange(n) for _ in range(min(n_targets, n))])
+        buckets = TargetBuckets.build(self, target_nodes, limit)
+
+        def mean_ms(fn):
+            started = time.perf_counter()
+            for args in sources:
+                fn(*args)
+            return round((time.perf_counter() - started) * 1000 / len(sources), 3)
+
+        # Так само, як пошук найближчих укриттів без ієрархії у find_shelter_algo
+        def dijkstra_nearest(source):
+            dist, pred = engine.shortest_paths(source, limit)
+            target_dist = dist[target_nodes]
+            reachable = np.flatnonzero(np.isfinite(target_dist))
+            best = reachable[np.argsort(target_dist[reachable], kind='stable')[:k]]
+            return [(int(t), float(target_dist[t]), engine.unwind_path(pred, int(target_nodes[t]))) for t in best]
+
+        self.timings = {
+            "nearest_ch_ms": mean_ms(lambda source: buckets.nearest(self, source, k)),
+            "nearest_dijkstra_ms": mean_ms(dijkstra_nearest),
+        }
+        return self.timings
+
+    # Пошук вгору по рангах від вузла, не далі limit: відстані та попередники
+    @staticmethod
+    def _upward(graph, source, limit=float('inf')):
+        indptr, indices, weights, _ = graph
+        dist = {source: 0.0}
+        parent = {source: -1}
+        heap = [(0.0, source)]
+        while heap:
+            d, node = heapq.heappop(heap)
+            if d > limit:
+                break
+            if d > dist[node]:
+                continue
+            start, end = indptr[node], indptr[node + 1]
+            for nbr, w in zip(indices[start:end].tolist(), weights[start:end].tolist()):
+                nd = d + w
+                if nd < dist.get(nbr, float('inf')):
+                    dist[nbr] = nd
+                    parent[nbr] = node
+                    heapq.heappush(heap, (nd, nbr))
+        return dist, parent
+
+    # Двонаправлений запит: (довжина в метрах, шлях з індексів вузлів) або (inf, None)
+    def query(self, source: int, target: int):
+        if source == target:
+            return 0.0, [int(source)]
+        dists = ({source: 0.0}, {target: 0.0})
+        parents = ({source: -1}, {target: -1})
+        heaps = ([(0.0, source)], [(0.0, target)])
+        graphs = (self.up, self.down)
+        best, meet = float('inf'), -1
+        side = 0
+        while heaps[0] or heaps[1]:
+            if not heaps[side] or (heaps[1 - side] and heaps[1 - side][0][0] < heaps[side][0][0]):
+                side = 1 - side
+            d, node = heapq.heappop(heaps[side])
+            if d >= best:
+                heaps[side].clear()
+                continue
+            dist, parent = dists[side], parents[side]
+            if d > dist[node]:
+                continue
+            other = dists[1 - side].get(node)
+            if other is not None and d + other < best:
+                best, meet = d + other, node
+            indptr, indices, weights, _ = graphs[side]
+            start, end = indptr[node], indptr[node + 1]
+            for nbr, w in zip(indices[start:end].tolist(), weights[start:end].tolist()):
+                nd = d + w
+                if nd < dist.get(nbr, float('inf')):
+                    dist[nbr] = nd
+                    parent[nbr] = node
+                    heapq.heappush(heaps[side], (nd, nbr))
+        if meet < 0:
+            return float('inf'), None
+        return best, self._join(meet, parents[0], parents[1])
+
+    # Шлях у графі запитів від джерела до meet і від meet до цілі, з розгорнутими скороченнями
+    def _join(self, meet, forward_parent, backward_parent):
+        hops = []
+        node = meet
+        while node >= 0:
+            hops.append(node)
+            node = forward_parent[node]
+        hops.reverse()
+        node = backward_parent[meet]
+        while node >= 0:
+            hops.append(node)
+            node = backward_parent[node]
+        path = [int(hops[0])]
+        for a, b in zip(hops, hops[1:]):
+            path.extend(self._unpack(a, b)[1:])
+        return path
+
+    def _edge_via(self, a, b):
+        # Ребро a -> b лежить у up[a], якщо b вище за рангом, інакше у down[b]
+        if self.rank[b] > self.rank[a]:
+            (indptr, indices, _, via), owner, key = self.up, a, b
+        else:
+            (indptr, indices, _, via), owner, key = self.down, b, a
+        start, end = indptr[owner], indptr[owner + 1]
+        return int(via[start + indices[start:end].tolist().index(key)])
+
+    # Розгортання ребра-скорочення у шлях по ребрах вихідного графу
+    def _unpack(self, a, b):
+        path = [int(a)]
+        stack = [(int(a), int(b))]
+        while stack:
+            u, v = stack.pop()
+            middle = self._edge_via(u, v)
+            if middle < 0:
+                path.append(v)
+            else:
+                stack.append((middle, v))
+                stack.append((u, middle))
+        return path
+
+    def save(self, ch_dir):
+        tmp_dir = f"{ch_dir}.tmp-{os.getpid()}"
+        os.makedirs(tmp_dir, exist_ok=True)
+        arrays = dict(zip(CH_ARRAYS, (self.rank, *self.up, *self.down)))
+        for name, array in arrays.items():
+            np.save(os.path.join(tmp_dir, f"{name}.npy"), array)
+        with open(os.path.join(tmp_dir, "meta.json"), 'w', encoding='utf-8') as file:
+            json.dump({"format": CH_FORMAT, "fingerprint": self.fingerprint, "shortcuts": self.n_shortcuts,
+                       "build_seconds": self.build_seconds, "timings": self.timings}, file)
+        if os.path.exists(ch_dir):
+            old_dir = f"{ch_dir}.old-{os.getpid()}"
+            os.rename(ch_dir, old_dir)
+            os.rename(tmp_dir, ch_dir)
+            for name in os.listdir(old_dir):
+                os.remove(os.path.join(old_dir, name))
+            os.rmdir(old_dir)
+        else:
+            os.rename(tmp_dir, ch_dir)
+
+    # Ієрархія з диску (через mmap) або None, якщо її немає чи вона для іншого графу
+    @classmethod
+    def load(cls, ch_dir, fingerprint=None, mmap=True):
+        try:
+            with open(os.path.join(ch_dir, "meta.json"), encoding='utf-8') as file:
+                meta = json.load(file)
+        except FileNotFoundError:
+            return None
+        if meta.get("format") != CH_FORMAT or (fingerprint is not None and meta.get("fingerprint") != fingerprint):
+            return None
+        arrays = [np.load(os.path.join(ch_dir, f"{name}.npy"), mmap_mode='r' if mmap else None)
+                  for name in CH_ARRAYS]
+        return cls(*arrays, fingerprint=meta["fingerprint"], timings=meta.get("timings"),
+                   build_seconds=meta.get("build_seconds"))
+
+
+class TargetBuckets:
+    """Відра для запитів «k найближчих цілей» (наприклад, укриттів) через ієрархію скорочень.
+    Для кожної цілі наперед робиться пошук вниз-вгору (по зворотних ребрах) не далі limit,
+    і кожен досягнутий вузол отримує запис (ціль, відстань, наступний вузол до цілі).
+    Запит — один пошук вгору від користувача і перегляд відер досягнутих вузлів."""
+
+    def __init__(self, indptr, target, dist, parent, limit, fingerprint=""):
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.target = np.asarray(target, dtype=np.int32)
+        self.dist = np.asarray(dist, dtype=np.float64)
+        self.parent = np.asarray(parent, dtype=np.int32)
+        self.limit = float(limit)
+        self.fingerprint = fingerprint
+
+    # target_nodes: вузол графу для кожної цілі (кілька цілей можуть ділити вузол).
+    # searches — готові пошуки {вузол: (відстані, попередники)}, наприклад з searches_by_node
+    @classmethod
+    def build(cls, hierarchy, target_nodes, limit, fingerprint="", searches=None) -> "TargetBuckets":
+        n = len(hierarchy.rank)
+        entries = [[] for _ in range(n)]
+        searches = dict(searches or {})
+        for target, node in enumerate(np.asarray(target_nodes).tolist()):
+            if node not in searches:
+                searches[node] = hierarchy._upward(hierarchy.down, node, limit)
+            dist, parent = searches[node]
+            for reached, d in dist.items():
+                if d <= limit:
+                    entries[reached].append((target, d, parent[reached]))
+        indptr = np.zeros(n + 1, dtype=np.int64)
+        indptr[1:] = np.cumsum([len(row) for row in entries])
+        rows = [entry for row in entries for entry in sorted(row)]
+        return cls(indptr, np.array([e[0] for e in rows], dtype=np.int32),
+                   np.array([e[1] for e in rows], dtype=np.float64),
+                   np.array([e[2] for e in rows], dtype=np.int32), limit, fingerprint)
+
+    # Пошуки, з яких зібрано відра, за вузлами цілей: {вузол: (відстані, попередники)} у межах limit.
+    # target_nodes — вузли цілей, з якими будувались ці відра
+    def searches_by_node(self, target_nodes) -> dict:
+        target_nodes = np.asarray(target_nodes).tolist()
+        first = {}
+        for target, node in enumerate(target_nodes):
+            first.setdefault(node, target)
+        # Цілі на одному вузлі мають однакові записи, беремо першу з них
+        representative = np.zeros(len(target_nodes), dtype=bool)
+        representative[list(first.values())] = True
+        rows = np.repeat(np.arange(len(self.indptr) - 1), np.diff(self.indptr))
+        mask = representative[self.target]
+        searches = {node: ({}, {}) for node in first}
+        for reached, target, d, parent in zip(rows[mask].tolist(), self.target[mask].tolist(),
+                                              self.dist[mask].tolist(), self.parent[mask].tolist()):
+            dist, parents = searches[target_nodes[target]]
+            dist[reached] = d
+            parents[reached] = parent
+        return searches
+
+    # До k найближчих цілей від вузла source, не далі limit: [(ціль, метри, шлях з індексів вузлів)]
+    def nearest(self, hierarchy, source: int, k: int, limit=None):
+        limit = self.limit if limit is None else min(limit, self.limit)
+        forward, forward_parent = hierarchy._upward(hierarchy.up, source, limit)
+        nodes = np.fromiter(forward.keys(), dtype=np.int64, count=len(forward))
+        starts, ends = self.indptr[nodes], self.indptr[nodes + 1]
+        sizes = ends - starts
+        if not sizes.sum():
+            return []
+        # Індекси всіх записів у відрах досягнутих вузлів одним масивом
+        offsets = np.repeat(starts - np.cumsum(sizes) + sizes, sizes) + np.arange(sizes.sum())
+        meet = np.repeat(nodes, sizes)
+        total = np.repeat(np.fromiter(forward.values(), dtype=np.float64, count=len(forward)), sizes) \
+            + self.dist[offsets]
+        targets = self.target[offsets]
+        keep = total <= limit
+        offsets, meet, total, targets = offsets[keep], meet[keep], total[keep], targets[keep]
+        # Найкоротша відстань для кожної цілі, потім k найближчих цілей
+        order = np.lexsort((total, targets))
+        first = order[np.r_[True, targets[order][1:] != targets[order][:-1]]] if len(order) else order
+        best = first[np.argsort(total[first], kind='stable')[:k]]
+        return [(int(targets[i]), float(total[i]),
+                 hierarchy._join(int(meet[i]), forward_parent, self._backward_parents(int(meet[i]), int(targets[i]))))
+                for i in best]
+
+    # Попередники на шляху від meet до цілі, з відер (у вигляді словника, як у _join)
+    def _backward_parents(self, meet, target):
+        parents = {}
+        node = meet
+        while node >= 0:
+            start, end = self.indptr[node], self.indptr[node + 1]
+            pos = start + int(np.searchsorted(self.target[start:end], target))
+            parents[node] = int(self.parent[pos])
+            node = parents[node]
+        return parents
+
+    def save(self, buckets_dir):
+        tmp_dir = f"{buckets_dir}.tmp-{os.getpid()}"
+        os.makedirs(tmp_dir, exist_ok=True)
+        for name in BUCKET_ARRAYS:
+            np.save(os.path.join(tmp_dir, f"{name}.npy"), getattr(self, name))
+        with open(os.path.join(tmp_dir, "meta.json"), 'w', encoding='utf-8') as file:
+            json.dump({"format": CH_FORMAT, "limit": self.limit, "fingerprint": self.fingerprint}, file)
+        try:
+            os.rename(tmp_dir, buckets_dir)
+        except OSError:
+            # Інший воркер уже зберіг ці ж відра
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    @classmethod
+    def load(cls, buckets_dir, mmap=True):
+        with open(os.path.join(buckets_dir, "meta.json"), encoding='utf-8') as file:
+            meta = json.load(file)
+        if meta.get("format") != CH_FORMAT:
+            raise ValueError(f"Непідтримуваний формат відер: {meta.get('format')}")
+        arrays = {name: np.load(os.path.join(buckets_dir, f"{name}.npy"), mmap_mode='r' if mmap else None)
+                  for name in BUCKET_ARRAYS}
+        return cls(**arrays, limit=meta["limit"], fingerprint=meta["fingerprint"])
@@ -0,0 +1,227 @@
+"""db"""
+import os
+import sqlite3
+import threading
+import time
+
+from dash_map import metrics
+from dash_map.cache import TTLCache
+
+DB_FILE = os.path.join("instance", "shelters.sqlite")
+
+_local = threading.local()
+
+# Кеш «токен -> ім'я користувача» для колбеків, що залежать від логіну.
+# Кешуються лише знайдені токени: невідомий токен може щойно зареєструвати інший воркер
+token_cache = TTLCache(maxsize=4096, ttl=300)
+
+# Перша сторінка відгуків для кожного укриття та кількість відгуків по укриттях.
+# Ключі містять лічильники з бази (кількість відгуків укриття, загальна ревізія), які підтримують тригери,
+# тож новий відгук, записаний будь-яким воркером, одразу робить закешоване значення недосяжним
+reviews_page_cache = TTLCache(maxsize=512, ttl=30)
+review_counts_cache = TTLCache(maxsize=4, ttl=30)
+REVIEWS_PAGE_SIZE = 20
+
+# Міграції схеми по порядку (кожна — список запитів); номер застосованої зберігається в PRAGMA user_version
+MIGRATIONS = [
+    [
+        '''CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY,
+            username TEXT UNIQUE NOT NULL,
+            email TEXT UNIQUE NOT NULL,
+            token TEXT UNIQUE NOT NULL
+        )''',
+        '''CREATE TABLE IF NOT EXISTS reviews (
+            shelter_id VARCHAR(128) NOT NULL,
+            review_text VARCHAR(256) NOT NULL,
+            username TEXT NOT NULL
+        )''',
+    ],
+    [
+        'ALTER TABLE reviews ADD COLUMN created_at REAL',
+        'UPDATE reviews SET created_at = 0 WHERE created_at IS NULL',
+        'CREATE INDEX IF NOT EXISTS idx_reviews_shelter_created ON reviews (shelter_id, created_at)',
+    ],
+    # Лічильники відгуків підтримує тригер, тож їх не треба рахувати COUNT(*) для кожного укриття
+    [
+        '''CREATE TABLE IF NOT EXISTS review_counts (
+            shelter_id VARCHAR(128) PRIMARY KEY,
+            count INTEGER NOT NULL
+        )''',
+        'INSERT OR REPLACE INTO review_counts SELECT shelter_id, COUNT(*) FROM reviews GROUP BY shelter_id',
+        '''CREATE TRIGGER IF NOT EXISTS reviews_count_insert AFTER INSERT ON reviews BEGIN
+            INSERT INTO review_counts (shelter_id, count) VALUES (NEW.shelter_id, 1)
+            ON CONFLICT (shelter_id) DO UPDATE SET count = count + 1;
+        END''',
+    ],
+    # Загальна ревізія відгуків: один рядок, який тригер збільшує з кожним новим відгуком
+    [
+        '''CREATE TABLE IF NOT EXISTS reviews_revision (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            revision INTEGER NOT NULL
+        )''',
+        'INSERT OR IGNORE INTO reviews_revision (id, revision) SELECT 1, COUNT(*) FROM reviews',
+        '''CREATE TRIGGER IF NOT EXISTS reviews_revision_insert AFTER INSERT ON reviews BEGIN
+            UPDATE reviews_revision SET revision = revision + 1 WHERE id = 1;
+        END''',
+    ],
+]
+
+
+def _connect(db_path):
+    conn = sqlite3.connect(db_path, timeout=10, isolation_level=None, check_same_thread=False,
+                           factory=metrics.TimedConnection)
+    conn.row_factory = sqlite3.Row
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute('PRAGMA busy_timeout=10000')
+    return conn
+
+
+# Одне з'єднання на потік (і на процес — після fork у gunicorn відкриваємо нове)
+def get_connection(db_path=DB_FILE) -> sqlite3.Connection:
+    pool = getattr(_local, 'pool', None)
+    if pool is None or _local.pid != os.getpid():
+        pool = _local.pool = {}
+        _local.pid = os.getpid()
+    conn = pool.get(db_path)
+    if conn is None:
+        conn = pool[db_path] = _connect(db_path)
+    return conn
+
+
+# Створює базу, якщо її ще немає, і застосовує нові міграції
+def init_db(db_path=DB_FILE):
+    if os.path.dirname(db_path):
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+    conn = get_connection(db_path)
+    # BEGIN IMMEDIATE, щоб кілька воркерів не мігрували одночасно
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        version = conn.execute('PRAGMA user_version').fetchone()[0]
+        for number, statements in enumerate(MIGRATIONS[version:], start=version + 1):
+            for statement in statements:
+                conn.execute(statement)
+            conn.execute(f'PRAGMA user_version = {number}')
+        conn.execute('COMMIT')
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+
+
+def find_user_by_email(email, db_path=DB_FILE):
+    return get_connection(db_path).execute(
+        'SELECT username, email, token FROM users WHERE email = ?', (email,)).fetchone()
+
+
+def find_username_by_token(token, db_path=DB_FILE):
+    row = get_connection(db_path).execute(
+        'SELECT username FROM users WHERE token = ?', (token,)).fetchone()
+    return row['username'] if row else None
+
+
+# Ім'я користувача за токеном через кеш; запит до бази лише при промаху.
+# Невідомий токен не кешується, тож після реєстрації в будь-якому воркері він одразу дійсний
+def resolve_token(token, db_path=DB_FILE):
+    if not token:
+        return None
+    username = token_cache.get((db_path, token))
+    if username is None:
+        username = find_username_by_token(token, db_path)
+        if username is not None:
+            token_cache.set((db_path, token), username)
+    return username
+
+
+def invalidate_token(token, db_path=DB_FILE):
+    token_cache.invalidate((db_path, token))
+
+
+# Реєстрація: одним запитом перевіряємо, чи зайняті email, username або токен.
+# Повертає назву зайнятого поля або None, якщо користувача створено
+def register_user(username, email, token, db_path=DB_FILE):
+    conn = get_connection(db_path)
+    row = conn.execute(
+        '''SELECT MAX(email = :email) AS email, MAX(username = :username) AS username,
+                  MAX(token = :token) AS token
+           FROM users WHERE email = :email OR username = :username OR token = :token''',
+        {'email': email, 'username': username, 'token': token}).fetchone()
+    for field in ('email', 'username', 'token'):
+        if row[field]:
+            return field
+    try:
+        conn.execute('INSERT INTO users (username, email, token) VALUES (?, ?, ?)', (username, email, token))
+    except sqlite3.IntegrityError as e:
+        # Хтось встиг зареєструватись між перевіркою і вставкою
+        message = str(e)
+        return next((field for field in ('email', 'username', 'token') if f'users.{field}' in message), 'email')
+    return None
+
+
+def get_reviews(shelter_id, db_path=DB_FILE):
+    return get_connection(db_path).execute(
+        'SELECT username, review_text, created_at FROM reviews WHERE shelter_id = ? ORDER BY created_at',
+        (shelter_id,)).fetchall()
+
+
+# Сторінка відгуків від найновіших. before — курсор (created_at, rowid) останнього показаного відгуку.
+# Повертає (відгуки, курсор наступної сторінки або None).
+# Перша сторінка кешується під кількістю відгуків укриття: перевірка — один запит за первинним ключем
+def get_reviews_page(shelter_id, before=None, limit=REVIEWS_PAGE_SIZE, db_path=DB_FILE):
+    if before is None:
+        key = (db_path, shelter_id, limit, review_count(shelter_id, db_path))
+        return reviews_page_cache.get_or_load(key, lambda key: _load_reviews_page(shelter_id, None, limit, db_path))
+    return _load_reviews_page(shelter_id, before, limit, db_path)
+
+
+def _load_reviews_page(shelter_id, before, limit, db_path):
+    conn = get_connection(db_path)
+    if before is None:
+        rows = conn.execute(
+            '''SELECT rowid, username, review_text, created_at FROM reviews WHERE shelter_id = ?
+               ORDER BY created_at DESC, rowid DESC LIMIT ?''', (shelter_id, limit + 1)).fetchall()
+    else:
+        rows = conn.execute(
+            '''SELECT rowid, username, review_text, created_at FROM reviews
+               WHERE shelter_id = ? AND (created_at, rowid) < (?, ?)
+               ORDER BY created_at DESC, rowid DESC LIMIT ?''',
+            (shelter_id, before[0], before[1], limit + 1)).fetchall()
+    reviews = [dict(row) for row in rows[:limit]]
+    cursor = [reviews[-1]['created_at'], reviews[-1]['rowid']] if len(rows) > limit else None
+    return reviews, cursor
+
+
+# Ревізія відгуків, що зростає з кожним новим відгуком, записаним будь-яким процесом
+def reviews_revision(db_path=DB_FILE) -> int:
+    row = get_connection(db_path).execute('SELECT revision FROM reviews_revision WHERE id = 1').fetchone()
+    return row[0] if row else 0
+
+
+# Кількість відгуків для всіх укриттів одним запитом (для маркерів), закешована під поточною ревізією
+def review_counts(db_path=DB_FILE) -> dict:
+    return review_counts_cache.get_or_load((db_path, reviews_revision(db_path)), lambda key: dict(
+        get_connection(db_path).execute('SELECT shelter_id, count FROM review_counts').fetchall()))
+
+
+def review_count(shelter_id, db_path=DB_FILE) -> int:
+    row = get_connection(db_path).execute('SELECT count FROM review_counts WHERE shelter_id = ?',
+                                          (shelter_id,)).fetchone()
+    return row[0] if row else 0
+
+
+def add_review(shelter_id, review_text, username, db_path=DB_FILE):
+    get_connection(db_path).execute(
+        'INSERT INTO reviews (shelter_id, review_text, username, created_at) VALUES (?, ?, ?, ?)',
+        (shelter_id, review_text, username, time.time()))
+    invalidate_reviews(shelter_id, db_path)
+
+
+# Ключі кешів містять лічильники з бази, тож після нових відгуків застарілі значення вже не читаються;
+# тут лише звільняємо пам'ять у процесі, що записав відгуки
+def invalidate_reviews(shelter_id, db_path=DB_FILE):
+    for key in reviews_page_cache.keys():
+        if key[:2] == (db_path, shelter_id):
+            reviews_page_cache.invalidate(key)
+    for key in review_counts_cache.keys():
+        if key[0] == db_path:
+            review_counts_cache.invalidate(key)
@@ -0,0 +1,190 @@
+"""evacuation"""
+# Офлайн-розподіл населення по укриттях з урахуванням місткості.
+# Запуск: python -m dash_map.evacuation будинки.csv --max-minutes 20 --out-dir instance/evacuation
+# Вхід: CSV з колонками id, lat, lon, population. Вихід: призначення для кожного будинку,
+# завантаженість кожного укриття і кількість людей, яким не вистачило місця.
+import argparse
+import csv
+import json
+import os
+import time
+
+import numpy as np
+from scipy.optimize import linprog
+from scipy.sparse import coo_matrix, csr_matrix
+from scipy.sparse.csgraph import dijkstra as csgraph_dijkstra
+
+from dash_map import find_shelter_algo
+from dash_map.find_shelter_algo import WALK_SPEED_KMH, walking_minutes
+
+CHUNK = 64
+
+
+# Матриця вартостей (метри пішки) між вузлами-джерелами і вузлами-цілями, лише в межах limit.
+# Дейкстра запускається пачками з меншої множини: з будинків по графу або з укриттів по оберненому
+def cost_matrix(engine, origin_nodes, shelter_nodes, limit) -> csr_matrix:
+    if len(origin_nodes) <= len(shelter_nodes):
+        matrix, sources, targets, transpose = engine.matrix, origin_nodes, shelter_nodes, False
+    else:
+        matrix, sources, targets, transpose = engine.matrix.T.tocsr(), shelter_nodes, origin_nodes, True
+    rows, cols, values = [], [], []
+    for start in range(0, len(sources), CHUNK):
+        dist = csgraph_dijkstra(matrix, directed=True, indices=sources[start:start + CHUNK], limit=limit)
+        dist = np.atleast_2d(dist)[:, targets]
+        row, col = np.nonzero(np.isfinite(dist))
+        rows.append(row + start)
+        cols.append(col)
+        values.append(dist[row, col])
+    rows, cols, values = (np.concatenate(parts) if parts else np.empty(0) for parts in (rows, cols, values))
+    if transpose:
+        rows, cols = cols, rows
+    return coo_matrix((values, (rows, cols)), shape=(len(origin_nodes), len(shelter_nodes))).tocsr()
+
+
+# Кандидати для кожного будинку: до k найближчих укриттів (origin, shelter, метри).
+# Кілька укриттів на одному вузлі графу розгортаються в окремих кандидатів
+def candidate_edges(engine, origin_lat, origin_lon, shelter_index, limit, k):
+    origin_nodes = engine.nearest_nodes(origin_lat, origin_lon)
+    shelter_nodes = shelter_index.graph_nodes(engine)
+    unique_origins, origin_slot = np.unique(origin_nodes, return_inverse=True)
+    unique_shelters, shelter_slot = np.unique(shelter_nodes, return_inverse=True)
+    costs = cost_matrix(engine, unique_origins, unique_shelters, limit)
+
+    shelters_at = [[] for _ in unique_shelters]
+    for shelter, slot in enumerate(shelter_slot):
+        if shelter_index.capacity[shelter] > 0:
+            shelters_at[slot].append(shelter)
+
+    best = {}
+    for slot in range(len(unique_origins)):
+        start, end = costs.indptr[slot], costs.indptr[slot + 1]
+        pairs = []
+        for node_slot, dist in sorted(zip(costs.indices[start:end], costs.data[start:end]), key=lambda p: p[1]):
+            pairs.extend((shelter, float(dist)) for shelter in shelters_at[node_slot])
+            if len(pairs) >= k:
+                break
+        best[slot] = pairs[:k]
+
+    origins, shelters, dists = [], [], []
+    for origin, slot in enumerate(origin_slot):
+        for shelter, dist in best[slot]:
+            origins.append(origin)
+            shelters.append(shelter)
+            dists.append(dist)
+    return np.array(origins, dtype=np.int64), np.array(shelters, dtype=np.int64), np.array(dists)
+
+
+# Мінімальна сумарна відстань при обмеженні місткості — задача потоку мінімальної вартості,
+# записана як транспортна задача і розв'язана HiGHS. Матриця обмежень тотально унімодулярна,
+# тож оптимальна вершина цілочисельна. Для кожного будинку є змінна «не розміщено» з великим штрафом
+def solve_flow(population, capacity, origins, shelters, dists, penalty):
+    n_origins, n_edges = len(population), len(origins)
+    cost = np.concatenate([dists, np.full(n_origins, penalty)])
+    edge_ids = np.arange(n_edges)
+    a_eq = coo_matrix((np.ones(n_edges + n_origins),
+                       (np.concatenate([origins, np.arange(n_origins)]),
+                        np.concatenate([edge_ids, n_edges + np.arange(n_origins)]))),
+                      shape=(n_origins, n_edges + n_origins)).tocsr()
+    a_ub = coo_matrix((np.ones(n_edges), (shelters, edge_ids)),
+                      shape=(len(capacity), n_edges + n_origins)).tocsr()
+    result = linprog(cost, A_ub=a_ub, b_ub=capacity, A_eq=a_eq, b_eq=population,
+                     bounds=(0, None), method="highs")
+    if result.status != 0:
+        raise RuntimeError(f"Розв'язувач не знайшов розподілу: {result.message}")
+    return np.round(result.x[:n_edges]).astype(np.int64)
+
+
+# Жадібний розподіл: пари (будинок, укриття) від найкоротшої, поки є місце.
+# Швидкий, але може бути гіршим за оптимальний; корисний для порівняння
+def solve_greedy(population, capacity, origins, shelters, dists):
+    left = np.asarray(population, dtype=np.int64).copy()
+    free = np.asarray(capacity, dtype=np.int64).copy()
+    flow = np.zeros(len(origins), dtype=np.int64)
+    for edge in np.argsort(dists, kind='stable'):
+        amount = min(left[origins[edge]], free[shelters[edge]])
+        if amount > 0:
+            flow[edge] = amount
+            left[origins[edge]] -= amount
+            free[shelters[edge]] -= amount
+    return flow
+
+
+# Розподіл населення: повертає призначення, завантаженість укриттів і нерозміщених
+def assign(origin_ids, origin_lat, origin_lon, population, shelter_file=find_shelter_algo.SHELTER_FILE,
+           max_minutes=20.0, candidates=10, method="flow"):
+    engine = find_shelter_algo.get_engine()
+    index = find_shelter_algo.get_shelter_index(shelter_file)
+    population = np.asarray(population, dtype=np.int64)
+    limit = max_minutes / 60 * WALK_SPEED_KMH * 1000
+    origins, shelters, dists = candidate_edges(engine, np.asarray(origin_lat, dtype=np.float64),
+                                               np.asarray(origin_lon, dtype=np.float64), index, limit, candidates)
+    if method == "flow":
+        flow = solve_flow(population, index.capacity, origins, shelters, dists, penalty=limit * 10)
+    else:
+        flow = solve_greedy(population, index.capacity, origins, shelters, dists)
+
+    used = np.flatnonzero(flow)
+    assignments = [{'id': origin_ids[origins[e]], 'shelter': index.names[shelters[e]], 'persons': int(flow[e]),
+                    'minutes': walking_minutes(float(dists[e]))} for e in used]
+    load = np.bincount(shelters[used], weights=flow[used], minlength=len(index)).astype(np.int64)
+    served = np.bincount(origins[used], weights=flow[used], minlength=len(population)).astype(np.int64)
+    unserved = population - served
+    return {
+        'assignments': assignments,
+        'shelter_load': [{'shelter': index.names[s], 'lat': float(index.lat[s]), 'lon': float(index.lon[s]),
+                          'capacity': int(index.capacity[s]), 'load': int(load[s])}
+                         for s in range(len(index))],
+        'unserved': [{'id': origin_ids[o], 'persons': int(unserved[o])} for o in np.flatnonzero(unserved)],
+        'summary': {
+            'method': method,
+            'origins': len(population),
+            'population': int(population.sum()),
+            'served': int(served.sum()),
+            'unserved': int(unserved.sum()),
+            'person_minutes': round(float(sum(a['persons'] * a['minutes'] for a in assignments)), 1),
+            'shelters_used': int(np.count_nonzero(load)),
+            'shelters_full': int(np.count_nonzero((load >= index.capacity) & (index.capacity > 0))),
+        },
+    }
+
+
+def write_csv(path, rows, fields):
+    with open(path, 'w', encoding='utf-8', newline='') as file:
+        writer = csv.DictWriter(file, fieldnames=fields)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Capacity-aware assignment of population points to shelters")
+    parser.add_argument("origins", help="CSV with columns id, lat, lon, population")
+    parser.add_argument("--shelters", default=find_shelter_algo.SHELTER_FILE)
+    parser.add_argument("--max-minutes", type=float, default=20.0)
+    parser.add_argument("--candidates", type=int, default=10, help="nearest shelters considered per origin")
+    parser.add_argument("--method", choices=("flow", "greedy"), default="flow")
+    parser.add_argument("--out-dir", default=os.path.join("instance", "evacuation"))
+    args = parser.parse_args()
+
+    ids, lats, lons, population = [], [], [], []
+    with open(args.origins, encoding='utf-8', newline='') as file:
+        for row in csv.DictReader(file):
+            ids.append(row.get('id') or str(len(ids)))
+            lats.append(float(row['lat']))
+            lons.append(float(row['lon']))
+            population.append(int(float(row['population'])))
+
+    started = time.perf_counter()
+    result = assign(ids, lats, lons, population, args.shelters, args.max_minutes, args.candidates, args.method)
+    result['summary']['seconds'] = round(time.perf_counter() - started, 2)
+
+    os.makedirs(args.out_dir, exist_ok=True)
+    write_csv(os.path.join(args.out_dir, "assignments.csv"), result['assignments'],
+              ['id', 'shelter', 'persons', 'minutes'])
+    write_csv(os.path.join(args.out_dir, "shelter_load.csv"), result['shelter_load'],
+              ['shelter', 'lat', 'lon', 'capacity', 'load'])
+    write_csv(os.path.join(args.out_dir, "unserved.csv"), result['unserved'], ['id', 'persons'])
+    print(json.dumps(result['summary'], ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
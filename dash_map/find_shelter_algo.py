@@ -1,42 +1,160 @@
+import math
+import numpy as np
 import os
-import osmnx as ox
-from geopy.geocoders import Nominatim
 from geopy.distance import geodesic
 import heapq
+import logging
+import threading
 
-GRAPH_FILE = os.path.join("dash_map", "lviv_graph.graphml")
+from dash_map import metrics
+from dash_map.config import GRAPH_NETWORK, MAX_WALK_MINUTES, ROUTE_CACHE_SIZE, TOP_K_SHELTERS
+from dash_map.contraction import ContractionHierarchy
+from dash_map.geocoder import LocalGeocoder
+from dash_map.route_cache import RouteCache, address_key
+from dash_map.routing_engine import EARTH_RADIUS_M, RoutingEngine
+from dash_map.shelter_dataset import ShelterDataset, ShelterSnapshot
+from dash_map.shelter_index import ShelterIndex
+from dash_map.shelter_store import ShelterStore
 
-# Завантаження графу Львову
-def load_graph():
-    if os.path.exists(GRAPH_FILE):
-        return ox.load_graphml(GRAPH_FILE)
-    G = ox.graph_from_place("Lviv, Ukraine", network_type="drive", simplify=True)
-    G = ox.simplify_graph(G)
-    ox.save_graphml(G, GRAPH_FILE)
+logger = logging.getLogger(__name__)
+
+GRAPH_FILES = {"drive": os.path.join("dash_map", "lviv_graph.graphml"),
+               "walk": os.path.join("dash_map", "lviv_walk_graph.graphml")}
+GRAPH_SNAPSHOTS = {"drive": os.path.join("dash_map", "lviv_graph_snapshot"),
+                   "walk": os.path.join("dash_map", "lviv_walk_graph_snapshot")}
+GRAPH_FILE = GRAPH_FILES[GRAPH_NETWORK]
+GRAPH_SNAPSHOT = GRAPH_SNAPSHOTS[GRAPH_NETWORK]
+SHELTER_FILE = os.path.join("shelters_data", "shelters_coords.csv")
+WALK_SPEED_KMH = 5
+# Версія записів "адреса -> точка" у кеші маршрутів; змінюється разом з нормалізацією адрес чи геокодером
+GEOCODE_VERSION = "geocode-1"
+
+_engine = None
+_engine_lock = threading.RLock()
+_datasets = {}
+_geocoder = None
+_route_cache = None
+
+# Завантаження графу Львову для мережі network (потрібен osmnx, тому імпортуємо його лише тут)
+def load_graph(network=GRAPH_NETWORK):
+    import osmnx as ox
+    graph_file = GRAPH_FILES[network]
+    if os.path.exists(graph_file):
+        return ox.load_graphml(graph_file)
+    G = ox.graph_from_place("Lviv, Ukraine", network_type=network, simplify=True)
+    ox.save_graphml(G, graph_file)
     return G
 
+# Рушій маршрутів створюється один раз на процес і далі перевикористовується.
+# Зазвичай він читається зі знімка графу (python -m dash_map.build_graph), без osmnx;
+# якщо знімка ще немає, граф будується з GraphML і знімок зберігається на наступний раз
+def get_engine() -> RoutingEngine:
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                if os.path.exists(os.path.join(GRAPH_SNAPSHOT, "meta.json")):
+                    engine = RoutingEngine.load(GRAPH_SNAPSHOT)
+                else:
+                    engine = RoutingEngine.from_networkx(load_graph())
+                    engine.save(GRAPH_SNAPSHOT)
+                # Ієрархія скорочень лежить поруч зі знімком, якщо її зібрано для цього ж графу.
+                # Вона потрібна лише для відер найближчих укриттів, тож якщо під час збірки
+                # вона виявилась повільнішою за Дейкстру, не тримаємо її зовсім
+                hierarchy = ContractionHierarchy.load(os.path.join(GRAPH_SNAPSHOT, "ch"), engine.fingerprint)
+                if hierarchy is not None:
+                    logger.info("Ієрархія скорочень: заміри %s, найближчі укриття через %s",
+                                hierarchy.timings or "відсутні",
+                                "ієрархію" if hierarchy.faster_for_nearest else "Дейкстру")
+                    engine.hierarchy = hierarchy if hierarchy.faster_for_nearest else None
+                geocoder = get_geocoder()
+                if not geocoder.has_streets():
+                    geocoder.seed_streets(engine.street_points)
+                _engine = engine
+    return _engine
+
+# Дані укриттів з файлу: сховище, індекс, поле і відра одним узгодженим знімком.
+# Коли файл змінюється, новий знімок будується у фоні, а запити до того часу бачать попередній
+def get_shelter_dataset(shelter_file=SHELTER_FILE) -> ShelterDataset:
+    dataset = _datasets.get(shelter_file)
+    if dataset is None:
+        with _engine_lock:
+            dataset = _datasets.get(shelter_file)
+            if dataset is None:
+                limit = MAX_WALK_MINUTES / 60 * WALK_SPEED_KMH * 1000
+                dataset = _datasets[shelter_file] = ShelterDataset(shelter_file, get_engine(), limit)
+    return dataset
+
+def get_shelter_snapshot(shelter_file=SHELTER_FILE) -> ShelterSnapshot:
+    return get_shelter_dataset(shelter_file).current()
+
+# Колонкове сховище укриттів (mmap), спільне для мапи і маршрутів
+def get_shelter_store(shelter_file=SHELTER_FILE) -> ShelterStore:
+    return get_shelter_snapshot(shelter_file).store
+
+# Просторовий індекс укриттів з файлу
+def get_shelter_index(shelter_file) -> ShelterIndex:
+    return get_shelter_snapshot(shelter_file).index
+
+# Таблиця найближчих укриттів
+def get_shelter_field(shelter_file):
+    return get_shelter_snapshot(shelter_file).field
+
+# Відра укриттів для k найближчих через ієрархію скорочень (None, якщо ієрархії немає)
+def get_shelter_buckets(shelter_file):
+    return get_shelter_snapshot(shelter_file).buckets
+
+# Локальний геокодер з постійним кешем; при першому запуску засівається адресами укриттів
+def get_geocoder() -> LocalGeocoder:
+    global _geocoder
+    if _geocoder is None:
+        with _engine_lock:
+            if _geocoder is None:
+                geocoder = LocalGeocoder()
+                if geocoder.is_empty() and os.path.exists(SHELTER_FILE):
+                    geocoder.seed_from_shelters(SHELTER_FILE)
+                _geocoder = geocoder
+    return _geocoder
+
+# Дозволяє підмінити геокодер (наприклад, локальною заглушкою без мережі)
+def set_geocoder(geocoder):
+    global _geocoder
+    _geocoder = geocoder
+
 # Шукаєм поточне місцезнаходження користувача у координатах широти та довготи
 def find_user_location(address, city="Львів", country="Україна"):
-    geolocator = Nominatim(user_agent="shelter_finder", timeout=10)
-    full_address = f"{address}, {city}, {country}"
-    location = geolocator.geocode(full_address)
-    if location is None:
-        return None
-    return (location.latitude, location.longitude)
-
-# Берем до уваги тільки укриття які не дальше ніж 1 км від нас
-def parse_shelters(file_path, user_point):
-    shelters = {}
-    with open(file_path, 'r', encoding='utf-8') as file:
-        next(file)
-        for line in file:
-            data = line.strip().split(',')
-            if len(data) >= 10 and data[-2] and data[-1]:
-                shelter_coords = (float(data[-2]), float(data[-1]))
-                if geodesic(user_point, shelter_coords).km <= 1:
-                    shelters[f"{data[7]} {data[8]}"] = shelter_coords
-    return shelters
+    return get_geocoder().geocode(address)
+
+# Спільний для воркерів кеш маршрутів (SQLite у instance/)
+def get_route_cache() -> RouteCache:
+    global _route_cache
+    if _route_cache is None:
+        with _engine_lock:
+            if _route_cache is None:
+                _route_cache = RouteCache(maxsize=ROUTE_CACHE_SIZE)
+    return _route_cache
 
+# Місцезнаходження за адресою через кеш: однакові адреси від багатьох людей геокодуються один раз.
+# Точка адреси не залежить ні від графу, ні від укриттів, тож ці записи мають власну версію.
+# Кешуються лише справжні збіги: центр вулиці геокодер віддає, поки будинку немає в його кеші
+# чи віддалений геокодер недоступний, і наступний запит має спробувати знову
+def locate_address(address):
+    cache = get_route_cache()
+    key, version = address_key(address), GEOCODE_VERSION
+    with metrics.ROUTE_PHASES.time(phase='geocode_cache'):
+        point = cache.get('address', key, version)
+    if point is not None:
+        return tuple(point)
+    geocoder = get_geocoder()
+    with metrics.ROUTE_PHASES.time(phase='geocode'):
+        # Підмінені геокодери (заглушки) можуть не мати locate; їхні точки вважаємо точними
+        if hasattr(geocoder, 'locate'):
+            point, source = geocoder.locate(address)
+        else:
+            point, source = geocoder.geocode(address), 'exact'
+    if point is not None and source != 'street':
+        cache.set('address', key, version, list(point))
+    return point
 
 # Будуємо граф
 def build_graph_dict(G):
@@ -46,11 +164,14 @@ def build_graph_dict(G):
         graph_dict[u][v] = length
     return graph_dict
 
-# Реалізація алгоритму Дейкстри
-def dijkstra(graph, start_point):
-    shortest_paths = {node: float('inf') for node in graph}
-    pre = {node: None for node in graph}
-    shortest_paths[start_point] = 0
+# Реалізація алгоритму Дейкстри.
+# Якщо задано targets, пошук зупиняється, щойно буде встановлено перше укриття з цієї множини.
+# Словники відстаней заповнюються ліниво: вузлів, яких пошук не торкнувся, у них немає,
+# тому читати їх треба через .get(node, float('inf'))
+def dijkstra(graph, start_point, targets=None, stats=None):
+    targets = set(targets) if targets is not None else None
+    shortest_paths = {start_point: 0}
+    pre = {start_point: None}
     heap = [(0, start_point)]
     visited = set()
     while heap:
@@ -58,77 +179,202 @@ def dijkstra(graph, start_point):
         if current in visited:
             continue
         visited.add(current)
+        if targets is not None and current in targets:
+            break
         for neighbor, weight in graph[current].items():
             if neighbor not in visited:
                 new_distance = current_distance + weight
-                if new_distance < shortest_paths[neighbor]:
+                if new_distance < shortest_paths.get(neighbor, float('inf')):
                     shortest_paths[neighbor] = new_distance
                     pre[neighbor] = current
                     heapq.heappush(heap, (new_distance, neighbor))
+    if stats is not None:
+        stats['settled'] = len(visited)
+    return shortest_paths, pre
+
+
+# Відстань по великому колу в метрах між точками (широта, довгота)
+def haversine_m(point_a, point_b):
+    lat1, lon1 = math.radians(point_a[0]), math.radians(point_a[1])
+    lat2, lon2 = math.radians(point_b[0]), math.radians(point_b[1])
+    h = (math.sin((lat2 - lat1) / 2) ** 2
+         + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_M * math.asin(math.sqrt(min(1.0, h)))
+
+
+# A* до найближчого з укриттів targets. Евристика — відстань по прямій до найближчого
+# кандидата, вона не перевищує довжину пішого шляху, тож маршрут лишається найкоротшим.
+# coords: вузол -> (широта, довгота)
+def astar(graph, start_point, targets, coords, stats=None):
+    targets = set(targets)
+    target_points = [coords[t] for t in targets]
+    heuristic = {}
+
+    def h(node):
+        if node not in heuristic:
+            point = coords[node]
+            heuristic[node] = min((haversine_m(point, t) for t in target_points), default=0)
+        return heuristic[node]
+
+    shortest_paths = {start_point: 0}
+    pre = {start_point: None}
+    heap = [(h(start_point), start_point)]
+    visited = set()
+    while heap:
+        _, current = heapq.heappop(heap)
+        if current in visited:
+            continue
+        visited.add(current)
+        if current in targets:
+            break
+        current_distance = shortest_paths[current]
+        for neighbor, weight in graph[current].items():
+            if neighbor not in visited:
+                new_distance = current_distance + weight
+                if new_distance < shortest_paths.get(neighbor, float('inf')):
+                    shortest_paths[neighbor] = new_distance
+                    pre[neighbor] = current
+                    heapq.heappush(heap, (new_distance + h(neighbor), neighbor))
+    if stats is not None:
+        stats['settled'] = len(visited)
     return shortest_paths, pre
 
 
 # Шукаєм найкоротший шлях
 def compute_route(address, shelter_file):
-    G = load_graph()
-    user_point = find_user_location(address)
+    user_point = locate_address(address)
     if user_point is None:
         return None, None, None
+    return route_from_point(user_point, shelter_file)
+
+
+# Маршрут до найближчого укриття від точки (широта, довгота).
+# snapshot — знімок даних укриттів, якщо викликач уже його взяв
+def route_from_point(user_point, shelter_file=SHELTER_FILE, snapshot=None):
+    engine = get_engine()
+    field = (snapshot or get_shelter_snapshot(shelter_file)).field
     try:
-        user_node = ox.distance.nearest_nodes(G, user_point[1], user_point[0])
-    except Exception as e:
-        print("Помилка при визначенні вузла для користувача:", e)
+        with metrics.ROUTE_PHASES.time(phase='snap'):
+            user_node = engine.nearest_node(*user_point)
+    except Exception:
+        logger.exception("Помилка при визначенні вузла для користувача")
         return None, None, None
-    
-    shelters = parse_shelters(shelter_file, user_point)
-    if not shelters:
+
+    # Шлях до найближчого укриття вже пораховано наперед, лише проходимо next_hop
+    with metrics.ROUTE_PHASES.time(phase='search_field'):
+        path = field.route_from(user_node)
+    if path is None:
         return None, None, None
 
-    shelter_nodes = {}
-    node_to_shelter_name = {}
-    for name, coords in shelters.items():
-        try:
-            node = ox.distance.nearest_nodes(G, coords[1], coords[0])
-            shelter_nodes[name] = node
-            node_to_shelter_name[node] = name
-        except Exception:
-            continue
+    shelter = int(field.nearest_shelter[user_node])
+    closest_name = field.names[shelter]
+    with metrics.ROUTE_PHASES.time(phase='path'):
+        route_coords = engine.path_coords(path)
+
+    # Якщо маршрут має лише одну точку — будуємо пряму лінію
+    if len(route_coords) < 2:
+        shelter_coords = (float(field.shelter_lat[shelter]), float(field.shelter_lon[shelter]))
+        route_coords = [tuple(user_point), shelter_coords]
+        distance_m = geodesic(user_point, shelter_coords).meters
+        return closest_name + " (дуже близько)", walking_minutes(distance_m), route_coords
+
+    time_minutes = walking_minutes(float(field.distance[user_node]))
+
+    return closest_name, time_minutes, route_coords
+
+
+# Час пішки у хвилинах для відстані в метрах
+def walking_minutes(distance_m):
+    return round((distance_m / 1000) / WALK_SPEED_KMH * 60, 1)
+
+
+# k найближчих досяжних укриттів за адресою; None, якщо адресу не знайдено
+def compute_routes(address, shelter_file, k=TOP_K_SHELTERS, max_minutes=MAX_WALK_MINUTES):
+    user_point = locate_address(address)
+    if user_point is None:
+        return None
+    return routes_from_point(user_point, shelter_file, k, max_minutes)
+
+
+# Фонове завдання маршруту (dash_map.jobs): progress позначає етап і перериває скасоване завдання
+def route_job(payload, progress):
+    shelter_file = payload.get('shelter_file', SHELTER_FILE)
+    progress('geocoding')
+    user_point = locate_address(payload['address'])
+    if user_point is None:
+        return {'routes': None}
+    progress('routing')
+    return {'routes': routes_from_point(user_point, shelter_file)}
+
+
+# k найближчих укриттів від точки з маршрутами, часом і місткістю, не далі ніж max_minutes пішки.
+# Список відсортовано від найближчого. Якщо в цих межах укриттів немає,
+# повертаємо лише найближче з наперед порахованого поля
+def routes_from_point(user_point, shelter_file=SHELTER_FILE, k=TOP_K_SHELTERS, max_minutes=MAX_WALK_MINUTES):
+    engine = get_engine()
+    # Один знімок на весь запит: індекс, відра і поле належать одній версії файлу укриттів
+    snapshot = get_shelter_snapshot(shelter_file)
+    index = snapshot.index
+    try:
+        with metrics.ROUTE_PHASES.time(phase='snap'):
+            user_node = engine.nearest_node(*user_point)
+    except Exception:
+        logger.exception("Помилка при визначенні вузла для користувача")
+        return []
+
+    limit = max_minutes / 60 * WALK_SPEED_KMH * 1000
+    # Результат пошуку залежить лише від вузла, тож сусідні точки, що прив'язались до того ж вузла,
+    # беруть його з кешу
+    cache, version = get_route_cache(), snapshot.version
+    key = f"{user_node}:{k}:{limit:.0f}"
+    with metrics.ROUTE_PHASES.time(phase='node_cache'):
+        nearest = cache.get('node', key, version)
+    if nearest is None:
+        buckets = snapshot.buckets
+        if buckets is not None and limit <= buckets.limit:
+            with metrics.ROUTE_PHASES.time(phase='search_ch'):
+                nearest = buckets.nearest(engine.hierarchy, user_node, k, limit)
+        else:
+            with metrics.ROUTE_PHASES.time(phase='search_dijkstra'):
+                nearest = _nearest_by_dijkstra(engine, index, user_node, k, limit)
+        cache.set('node', key, version, nearest)
+
+    routes = []
+    for shelter, distance_m, path in nearest:
+        shelter_coords = (float(index.lat[shelter]), float(index.lon[shelter]))
+        with metrics.ROUTE_PHASES.time(phase='path'):
+            coords = engine.path_coords(path)
+        route = {'name': index.names[shelter], 'capacity': int(index.capacity[shelter]),
+                 'lat': shelter_coords[0], 'lon': shelter_coords[1],
+                 'distance_m': distance_m, 'coords': coords}
+        # Укриття на тому ж вузлі, що й користувач — пряма лінія
+        if len(route['coords']) < 2:
+            route['coords'] = [tuple(user_point), shelter_coords]
+            route['distance_m'] = geodesic(user_point, shelter_coords).meters
+            route['name'] += " (дуже близько)"
+        route['minutes'] = walking_minutes(route['distance_m'])
+        routes.append(route)
+    # Пряма лінія для дуже близьких укриттів змінює відстань, тож впорядковуємо ще раз
+    routes.sort(key=lambda route: route['distance_m'])
+
+    if not routes:
+        field = snapshot.field
+        path = field.route_from(user_node)
+        if path is not None:
+            name, minutes, coords = route_from_point(user_point, shelter_file, snapshot)
+            shelter = int(field.nearest_shelter[user_node])
+            routes.append({'name': name, 'capacity': int(index.capacity[shelter]),
+                           'lat': float(index.lat[shelter]), 'lon': float(index.lon[shelter]),
+                           'distance_m': float(field.distance[user_node]), 'minutes': minutes,
+                           'coords': coords})
+    return routes
+
 
-    graph_dict = build_graph_dict(G)
-    distances, prev_nodes = dijkstra(graph_dict, user_node)
-
-    reachable_shelters = {
-        name: node for name, node in shelter_nodes.items()
-        if distances.get(node, float('inf')) != float('inf')
-    }
-
-    if reachable_shelters:
-        closest_name, closest_node = min(
-            reachable_shelters.items(), key=lambda item: distances[item[1]]
-        )
-        path = []
-        current = closest_node
-        while current is not None:
-            path.append(current)
-            current = prev_nodes.get(current)
-        path = path[::-1]
-
-        route_coords = [(G.nodes[n]["y"], G.nodes[n]["x"]) for n in path]
-
-        # Якщо маршрут має лише одну точку — будуємо пряму лінію
-        if len(route_coords) < 2:
-            # Знаходимо shelter з мінімальною геодезичною відстанню
-            closest_name, shelter_coords = min(
-                shelters.items(),
-                key=lambda item: geodesic(user_point, item[1]).meters
-            )
-            route_coords = [user_point, shelter_coords]
-            distance_m = geodesic(user_point, shelter_coords).meters
-            time_minutes = round((distance_m / 1000) / 5 * 60, 1)
-            return closest_name + " (дуже близько)", time_minutes, route_coords
-
-
-        length = sum(graph_dict[path[i]][path[i+1]] for i in range(len(path)-1))
-        time_minutes = round((length / 1000) / 5 * 60, 1)
-
-        return closest_name, time_minutes, route_coords
+# Один пошук Дейкстри від вузла користувача, обмежений відстанню limit: [(укриття, метри, шлях)]
+def _nearest_by_dijkstra(engine, index, user_node, k, limit):
+    dist, pred = engine.shortest_paths(user_node, limit=limit)
+    shelter_nodes = index.graph_nodes(engine)
+    shelter_dist = dist[shelter_nodes]
+    reachable = np.flatnonzero(np.isfinite(shelter_dist))
+    nearest = reachable[np.argsort(shelter_dist[reachable], kind='stable')[:k]]
+    return [(int(s), float(shelter_dist[s]), engine.unwind_path(pred, int(shelter_nodes[s]))) for s in nearest]
@@ -0,0 +1,200 @@
+"""geocoder"""
+import csv
+import difflib
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+
+from dash_map import metrics
+
+logger = logging.getLogger(__name__)
+
+CACHE_FILE = os.path.join("instance", "geocode_cache.sqlite")
+
+# Слова, що позначають тип вулиці; у даних укриттів їх немає, а користувачі часто пишуть
+STREET_TYPES = {
+    "вулиця", "вул", "провулок", "пров", "проспект", "просп", "пр", "площа", "пл",
+    "бульвар", "бульв", "б-р", "узвіз", "шосе", "майдан", "тупик",
+}
+ADDRESS_RE = re.compile(r"^(?P<street>.*?)[\s,]+(?P<house>\d+[\w/\-]*)$")
+
+
+# Нормалізуємо назву вулиці: нижній регістр, єдиний апостроф, без типу вулиці й розділових знаків
+def normalize_street(street: str) -> str:
+    street = street.lower().replace("’", "'").replace("ʼ", "'").replace("`", "'")
+    street = re.sub(r"[.,;«»\"]", " ", street)
+    words = [word for word in street.split() if word not in STREET_TYPES]
+    return " ".join(words)
+
+
+def normalize_house(house: str) -> str:
+    return re.sub(r"\s+", "", str(house).lower())
+
+
+# Розбиваємо адресу на (вулиця, будинок); будинку може не бути
+def split_address(address: str):
+    address = re.sub(r",?\s*(львів|львівська область|україна)\s*$", "", address.strip(), flags=re.I)
+    address = re.sub(r"(\d)\s+([а-яіїєґa-z])$", r"\1\2", address, flags=re.I)
+    match = ADDRESS_RE.match(address)
+    if match:
+        return normalize_street(match.group("street")), normalize_house(match.group("house"))
+    return normalize_street(address), ""
+
+
+# Звичайний віддалений геокодер Nominatim, використовується лише при промаху кешу
+def nominatim_geocode(address, city="Львів", country="Україна"):
+    from geopy.geocoders import Nominatim
+    geolocator = Nominatim(user_agent="shelter_finder", timeout=10)
+    location = geolocator.geocode(f"{address}, {city}, {country}")
+    if location is None:
+        return None
+    return (location.latitude, location.longitude)
+
+
+class LocalGeocoder:
+    """Локальний геокодер: постійний SQLite-кеш «нормалізована адреса -> координати»
+    з нечітким пошуком вулиць. Віддалений геокодер (fallback) викликається лише при промаху,
+    і його можна підмінити будь-якою функцією address -> (lat, lon) | None.
+    Адреси, яких не знайшов і віддалений геокодер, запам'ятовуються на miss_ttl секунд,
+    щоб повторні запити тієї ж адреси не йшли в мережу; помилки геокодера не запам'ятовуються."""
+
+    def __init__(self, db_path=CACHE_FILE, fallback=nominatim_geocode, fuzzy_cutoff=0.85, miss_ttl=600.0):
+        self.db_path = db_path
+        self.fallback = fallback
+        self.fuzzy_cutoff = fuzzy_cutoff
+        self.miss_ttl = miss_ttl
+        self._local = threading.local()
+        self._streets = None
+        if os.path.dirname(db_path):
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        conn = self._conn()
+        conn.execute('''CREATE TABLE IF NOT EXISTS addresses (
+            street TEXT NOT NULL,
+            house TEXT NOT NULL,
+            latitude REAL NOT NULL,
+            longitude REAL NOT NULL,
+            source TEXT NOT NULL,
+            PRIMARY KEY (street, house)
+        )''')
+        conn.execute('''CREATE TABLE IF NOT EXISTS streets (
+            street TEXT PRIMARY KEY,
+            latitude REAL NOT NULL,
+            longitude REAL NOT NULL
+        )''')
+        conn.execute('''CREATE TABLE IF NOT EXISTS misses (
+            street TEXT NOT NULL,
+            house TEXT NOT NULL,
+            expires_at REAL NOT NULL,
+            PRIMARY KEY (street, house)
+        )''')
+        conn.commit()
+
+    # З'єднання на потік; після fork (воркери gunicorn, пул процесів) відкриваємо нове
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.db_path, timeout=10, factory=metrics.TimedConnection)
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _known_streets(self):
+        if self._streets is None:
+            conn = self._conn()
+            rows = conn.execute('SELECT street FROM addresses UNION SELECT street FROM streets').fetchall()
+            self._streets = sorted(row[0] for row in rows)
+        return self._streets
+
+    def is_empty(self) -> bool:
+        return self._conn().execute('SELECT 1 FROM addresses LIMIT 1').fetchone() is None
+
+    # Записуємо пачку адрес (street, house, lat, lon) у кеш
+    def add_addresses(self, rows, source):
+        conn = self._conn()
+        conn.executemany('INSERT OR IGNORE INTO addresses VALUES (?, ?, ?, ?, ?)',
+                         [(normalize_street(s), normalize_house(h), lat, lon, source) for s, h, lat, lon in rows])
+        conn.commit()
+        self._streets = None
+
+    # Засіваємо кеш вже геокодованими укриттями зі shelters_coords.csv
+    def seed_from_shelters(self, file_path, city="Львів"):
+        rows = []
+        with open(file_path, 'r', encoding='utf-8', newline='') as file:
+            for row in csv.DictReader(file):
+                if row.get('city') == city and row.get('latitude') and row.get('longitude'):
+                    rows.append((row['street'], row['building_number'],
+                                 float(row['latitude']), float(row['longitude'])))
+        self.add_addresses(rows, "shelters")
+
+    # Засіваємо центри вулиць (назва -> (широта, довгота)), щоб розпізнавати вулиці без укриттів
+    def seed_streets(self, street_points):
+        conn = self._conn()
+        conn.executemany('INSERT OR REPLACE INTO streets VALUES (?, ?, ?)', [
+            (street, point[0], point[1]) for street, point in street_points.items()
+        ])
+        conn.commit()
+        self._streets = None
+
+    def has_streets(self) -> bool:
+        return self._conn().execute('SELECT 1 FROM streets LIMIT 1').fetchone() is not None
+
+    def _lookup(self, street, house):
+        row = self._conn().execute('SELECT latitude, longitude FROM addresses WHERE street = ? AND house = ?',
+                                   (street, house)).fetchone()
+        return (row[0], row[1]) if row else None
+
+    def _is_recent_miss(self, street, house) -> bool:
+        return self._conn().execute('SELECT 1 FROM misses WHERE street = ? AND house = ? AND expires_at > ?',
+                                    (street, house, time.time())).fetchone() is not None
+
+    def _remember_miss(self, street, house):
+        now = time.time()
+        conn = self._conn()
+        conn.execute('DELETE FROM misses WHERE expires_at <= ?', (now,))
+        conn.execute('INSERT OR REPLACE INTO misses VALUES (?, ?, ?)', (street, house, now + self.miss_ttl))
+        conn.commit()
+
+    def _match_street(self, street):
+        streets = self._known_streets()
+        matches = difflib.get_close_matches(street, streets, n=1, cutoff=self.fuzzy_cutoff)
+        return matches[0] if matches else None
+
+    # Координати адреси: кеш, потім нечіткий збіг вулиці, потім віддалений геокодер,
+    # і лише в крайньому разі — центр відомої вулиці
+    def geocode(self, address):
+        return self.locate(address)[0]
+
+    # Те саме разом із джерелом точки: 'exact', 'fuzzy', 'remote', 'street' (центр вулиці) або None.
+    # Центр вулиці — тимчасова відповідь (будинку ще немає в кеші або віддалений геокодер недоступний),
+    # тож його не варто запам'ятовувати надовго
+    def locate(self, address):
+        street, house = split_address(address)
+        if not street:
+            return None, None
+        point = self._lookup(street, house)
+        if point is not None:
+            return point, 'exact'
+        matched = self._match_street(street)
+        if matched is not None and matched != street:
+            point = self._lookup(matched, house)
+            if point is not None:
+                return point, 'fuzzy'
+        if self.fallback is not None and not self._is_recent_miss(street, house):
+            try:
+                point = self.fallback(address)
+            except Exception:
+                logger.exception("Помилка віддаленого геокодера")
+            else:
+                if point is not None:
+                    self.add_addresses([(street, house, point[0], point[1])], "remote")
+                    return point, 'remote'
+                self._remember_miss(street, house)
+        if matched is not None:
+            row = self._conn().execute('SELECT latitude, longitude FROM streets WHERE street = ?',
+                                       (matched,)).fetchone()
+            if row:
+                return (row[0], row[1]), 'street'
+        return None, None
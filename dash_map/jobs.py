@@ -0,0 +1,182 @@
+"""jobs"""
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+
+from dash_map import db, metrics
+
+logger = logging.getLogger(__name__)
+
+JOBS_FILE = os.path.join("instance", "jobs.sqlite")
+
+# Стани завдання; завершені стани вже не змінюються
+QUEUED, RUNNING, DONE, FAILED, CANCELLED, EXPIRED = "queued", "running", "done", "failed", "cancelled", "expired"
+FINISHED = (DONE, FAILED, CANCELLED, EXPIRED)
+
+
+class JobStopped(Exception):
+    """Завдання скасовано або минув його дедлайн — обробник має припинити роботу."""
+
+
+class JobQueue:
+    """Локальна черга фонових завдань у SQLite, спільна для всіх воркерів gunicorn.
+    Колбек лише ставить завдання в чергу і одразу повертається, а пул потоків у кожному процесі
+    забирає завдання і виконує handler(payload, progress). Стан і результат читаються опитуванням.
+    Кожне завдання має дедлайн; progress(stage) між етапами перевіряє скасування та дедлайн."""
+
+    def __init__(self, handler, db_path=JOBS_FILE, workers=2, deadline=30.0, keep_finished=3600.0,
+                 poll_interval=0.2, max_poll_interval=2.0):
+        self.handler = handler
+        self.db_path = db_path
+        self.workers = workers
+        self.deadline = deadline
+        self.keep_finished = keep_finished
+        self.poll_interval = poll_interval
+        self.max_poll_interval = max_poll_interval
+        self._threads = []
+        self._pid = None
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        if os.path.dirname(db_path):
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        conn = db.get_connection(db_path)
+        conn.execute('''CREATE TABLE IF NOT EXISTS jobs (
+            id TEXT PRIMARY KEY,
+            payload TEXT NOT NULL,
+            status TEXT NOT NULL,
+            stage TEXT,
+            result TEXT,
+            error TEXT,
+            created_at REAL NOT NULL,
+            started_at REAL,
+            finished_at REAL,
+            deadline REAL NOT NULL
+        )''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_jobs_status_created ON jobs (status, created_at)')
+
+    # Потоки стартують ліниво і заново після fork у воркері gunicorn
+    def _ensure_started(self):
+        if self._pid == os.getpid() and all(thread.is_alive() for thread in self._threads):
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                self._threads = []
+                self._pid = os.getpid()
+            self._threads = [thread for thread in self._threads if thread.is_alive()]
+            while len(self._threads) < self.workers:
+                thread = threading.Thread(target=self._run, name=f"job-worker-{len(self._threads)}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    # Ставить завдання в чергу і повертає його id. replaces — id попереднього завдання того ж
+    # користувача: його буде скасовано, щоб не рахувати маршрут, який вже нікому не потрібен
+    def submit(self, payload, replaces=None, deadline=None) -> str:
+        self._ensure_started()
+        now = time.time()
+        job_id = uuid.uuid4().hex
+        conn = db.get_connection(self.db_path)
+        if replaces:
+            self.cancel(replaces)
+        conn.execute('INSERT INTO jobs (id, payload, status, created_at, deadline) VALUES (?, ?, ?, ?, ?)',
+                     (job_id, json.dumps(payload, ensure_ascii=False), QUEUED, now, now + (deadline or self.deadline)))
+        conn.execute('DELETE FROM jobs WHERE finished_at < ?', (now - self.keep_finished,))
+        self._wakeup.set()
+        return job_id
+
+    def cancel(self, job_id):
+        db.get_connection(self.db_path).execute(
+            'UPDATE jobs SET status = ?, finished_at = ? WHERE id = ? AND status IN (?, ?)',
+            (CANCELLED, time.time(), job_id, QUEUED, RUNNING))
+
+    # Стан завдання: status, stage, position (місце в черзі), result, error; None, якщо завдання немає.
+    # Завдання з минулим дедлайном позначається як expired, навіть якщо його процес завис чи загинув
+    def status(self, job_id):
+        conn = db.get_connection(self.db_path)
+        row = conn.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        if job['status'] in (QUEUED, RUNNING) and time.time() > job['deadline']:
+            self._finish(job_id, EXPIRED, error="Час очікування вичерпано")
+            job.update(status=EXPIRED, error="Час очікування вичерпано")
+        if job['status'] == QUEUED:
+            job['position'] = conn.execute('SELECT COUNT(*) FROM jobs WHERE status = ? AND created_at < ?',
+                                           (QUEUED, job['created_at'])).fetchone()[0]
+        job['result'] = json.loads(job['result']) if job['result'] else None
+        job['payload'] = json.loads(job['payload'])
+        return job
+
+    # Кількість завдань за станами (для метрик)
+    def counts(self) -> dict:
+        rows = db.get_connection(self.db_path).execute('SELECT status, COUNT(*) FROM jobs GROUP BY status').fetchall()
+        return {status: count for status, count in rows}
+
+    # Атомарно забирає найстаріше завдання з черги; прострочені одразу позначаються expired
+    def _claim(self):
+        conn = db.get_connection(self.db_path)
+        # Дешева перевірка без блокування на запис: здебільшого черга порожня
+        if conn.execute('SELECT 1 FROM jobs WHERE status = ? LIMIT 1', (QUEUED,)).fetchone() is None:
+            return None
+        now = time.time()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute('UPDATE jobs SET status = ?, finished_at = ?, error = ? WHERE status = ? AND deadline < ?',
+                         (EXPIRED, now, "Час очікування вичерпано", QUEUED, now))
+            row = conn.execute('SELECT id, payload FROM jobs WHERE status = ? ORDER BY created_at LIMIT 1',
+                               (QUEUED,)).fetchone()
+            if row is not None:
+                conn.execute('UPDATE jobs SET status = ?, started_at = ? WHERE id = ?', (RUNNING, now, row['id']))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return (row['id'], json.loads(row['payload'])) if row else None
+
+    def _finish(self, job_id, status, result=None, error=None):
+        # Завершений стан (наприклад, скасування) не перезаписуємо
+        db.get_connection(self.db_path).execute(
+            f'UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ? '
+            f'WHERE id = ? AND status NOT IN ({",".join("?" * len(FINISHED))})',
+            (status, json.dumps(result, ensure_ascii=False) if result is not None else None, error,
+             time.time(), job_id, *FINISHED))
+
+    # Позначає етап виконання і перериває завдання, якщо його скасовано або минув дедлайн
+    def _progress(self, job_id, stage):
+        conn = db.get_connection(self.db_path)
+        row = conn.execute('SELECT status, deadline FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        if row is None or row['status'] != RUNNING:
+            raise JobStopped(job_id)
+        if time.time() > row['deadline']:
+            self._finish(job_id, EXPIRED, error="Час очікування вичерпано")
+            raise JobStopped(job_id)
+        conn.execute('UPDATE jobs SET stage = ? WHERE id = ?', (stage, job_id))
+
+    # Без роботи потік чекає на _wakeup: submit у цьому процесі будить його одразу, а завдання
+    # з інших воркерів підхоплюються опитуванням, інтервал якого подвоюється до max_poll_interval
+    def _run(self):
+        idle = self.poll_interval
+        while True:
+            self._wakeup.clear()
+            job = self._claim()
+            if job is None:
+                if self._wakeup.wait(idle):
+                    idle = self.poll_interval
+                else:
+                    idle = min(idle * 2, self.max_poll_interval)
+                continue
+            idle = self.poll_interval
+            job_id, payload = job
+            try:
+                with metrics.JOB_SECONDS.time():
+                    result = self.handler(payload, lambda stage: self._progress(job_id, stage))
+                self._finish(job_id, DONE, result=result)
+                metrics.JOBS.inc(status=DONE)
+            except JobStopped:
+                metrics.JOBS.inc(status='stopped')
+            except Exception as e:
+                logger.exception("Помилка фонового завдання %s", job_id)
+                self._finish(job_id, FAILED, error=str(e))
+                metrics.JOBS.inc(status=FAILED)
@@ -1,18 +1,24 @@
 from dash import dcc, html
 import dash_leaflet as dl
-import pandas as pd
+from dash_extensions.javascript import Namespace
 
-def select_top_200(shelters_df: pd.DataFrame, bounds: dict[str, float]) -> pd.DataFrame:
-    if bounds is None:
-        bounds = {'south': 49.8, 'west': 23.9, 'north': 49.9, 'east': 24.1}
-        bounds = [[49.8, 23.9], [49.9, 24.1]]
-    shelters_df = shelters_df[
-        (shelters_df['latitude'] <= bounds['north']) &
-        (shelters_df['latitude'] >= bounds['south']) &
-        (shelters_df['longitude'] <= bounds['east']) &
-        (shelters_df['longitude'] >= bounds['west'])
-    ]
-    return shelters_df.nlargest(500, 'capacity_of_persons')
+from dash_map.config import SHELTER_LAYER_MODE
+from dash_map.markers import MAX_MARKERS
+
+shelters_ns = Namespace("shelters", "layer")
+
+# Шар укриттів: звичайна група маркерів від сервера або клієнтський GeoJSON з кластеризацією
+if SHELTER_LAYER_MODE == 'client':
+    shelter_layer = dl.GeoJSON(id="shelter-geojson", cluster=True, zoomToBoundsOnClick=True,
+                               superClusterOptions={'radius': 60, 'maxZoom': 14},
+                               pointToLayer=shelters_ns("pointToLayer"))
+    # Версія (ETag) GeoJSON і кількість відгуків раз на хвилину звіряються з сервером:
+    # якщо укриття оновились, браузер завантажить їх знову
+    shelter_refresh = [dcc.Store(id='shelters-version'), dcc.Store(id='review-counts'),
+                       dcc.Interval(id='shelters-refresh', interval=60_000)]
+else:
+    shelter_layer = dl.LayerGroup(id="shelter-layer")
+    shelter_refresh = []
 
 
 # Головна сторінка
@@ -34,7 +40,8 @@ index_page = html.Div([
             html.Button('Знайти укриття', id='find-route-btn-main', n_clicks=0, className='search-button'),
         ], style={'display': 'flex', 'gap': '10px'}),  # Новий підконтейнер тільки для поля і кнопки
 
-        html.Div(id='route-message', className='status-message')  # Помилка окремо, піде вниз
+        html.Div(id='route-message', className='status-message'),  # Помилка окремо, піде вниз
+        html.Div(id='route-alternatives', className='route-alternatives')  # Найближчі укриття з часом і місткістю
     ], className='search-container'),
 
     html.Div(id='auth-section', className='button-container'),
@@ -45,7 +52,7 @@ index_page = html.Div([
         zoom=12,
         children=[
             dl.TileLayer(),
-            dl.LayerGroup(id="shelter-layer"),
+            shelter_layer,
             dl.LayerGroup(id="route")
         ],
         bounds=[[49.8, 23.9], [49.9, 24.1]],
@@ -53,6 +60,10 @@ index_page = html.Div([
     ),
 
     dcc.Store(id='bounds-store'),
+    dcc.Store(id='shelter-max-markers', data=MAX_MARKERS),
+    dcc.Store(id='route-job'),
+    dcc.Interval(id='route-job-poll', interval=500, disabled=True),
+    *shelter_refresh,
 ])
 
 
@@ -74,7 +85,12 @@ login_layout = html.Div([
 review_layout = html.Div([
     dcc.Store(id='user-token', storage_type='local'),
     html.H1("Відгуки про укриття"),
+    html.Div(id='my-new-reviews'),  # Щойно залишені відгуки, показуються одразу
     html.Div(id='reviews-container'),  # Тут будуть відображатись відгуки
+    html.Div(id='reviews-more'),  # Наступні сторінки відгуків
+    dcc.Store(id='reviews-cursor'),
+    html.Button('Показати ще', id='load-more-reviews', n_clicks=0, className='submit-button',
+                style={'display': 'none'}),
 
     # Форма для додавання відгуку
     html.Div(id='review-input-section'),  # Покажемо форму лише якщо користувач залогінений
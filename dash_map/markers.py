@@ -0,0 +1,154 @@
+"""markers"""
+import gzip
+import hashlib
+import html as html_escape
+import json
+import math
+import numpy as np
+from dash import html
+import dash_leaflet as dl
+
+# Починаючи з цього зуму показуємо окремі укриття, а не кластери
+INDIVIDUAL_ZOOM = 15
+# Приблизний розмір клітинки кластера на екрані, в пікселях
+CLUSTER_CELL_PX = 60
+MAX_MARKERS = 500
+DEFAULT_BOUNDS = {'south': 49.8, 'west': 23.9, 'north': 49.9, 'east': 24.1}
+
+
+def marker_radius(capacity) -> float:
+    return max(2.0, 3 * math.log(max(capacity, 1) / 20))
+
+
+# Ідентифікатор укриття на сторінці відгуків
+def review_shelter_id(row) -> str:
+    return f"{row.street}_{row.building_number}"
+
+
+def shelter_marker(row, colour='blue', reviews=0) -> dl.CircleMarker:
+    return dl.CircleMarker(center=[row.latitude, row.longitude],
+                           radius=marker_radius(row.capacity_of_persons),
+                           color=colour,
+                           fillOpacity=0.6,
+                           children=[
+                               dl.Tooltip(f"{row.type_of_room}, "
+                                          f"{row.street} {row.building_number}, "
+                                          f"місткість: {row.capacity_of_persons}"),
+                               # Кількість відгуків і лінк для переходу на сторінку відгуків
+                               dl.Popup([
+                                   html.Div(f"Відгуків: {reviews}"),
+                                   html.A("Перейти до відгуків",
+                                          href=f"/review?shelter_id={review_shelter_id(row)}")
+                               ])
+                           ])
+
+
+def cluster_marker(lat, lon, count, capacity, colour) -> dl.CircleMarker:
+    return dl.CircleMarker(center=[lat, lon],
+                           radius=marker_radius(capacity) + 2 * math.log10(count) + 4,
+                           color=colour,
+                           fillOpacity=0.4,
+                           children=[dl.Tooltip(f"Укриттів: {count}, загальна місткість: {capacity}. "
+                                                f"Наблизьте мапу, щоб побачити окремі укриття")])
+
+
+class ShelterMarkers:
+    """Маркери укриттів, пораховані один раз при завантаженні.
+    Для кожного рівня зуму до INDIVIDUAL_ZOOM укриття заздалегідь згруповані у сітку кластерів
+    з сумарною місткістю, тож колбек лише відбирає готові маркери у межах видимої області.
+    previous — маркери попередньої версії даних: маркери незмінених укриттів беруться з них.
+    Заготовлені маркери показують нуль відгуків; укриттям з відгуками for_viewport підставляє
+    маркер з їхньою кількістю (він перебудовується, лише коли кількість змінилась)."""
+
+    def __init__(self, store, colour='blue', previous=None):
+        order = np.argsort(-np.asarray(store.capacity), kind='stable')
+        self.lat = np.asarray(store.latitude)[order]
+        self.lon = np.asarray(store.longitude)[order]
+        self.capacity = np.asarray(store.capacity, dtype=np.int64)[order]
+        self.colour = colour
+        known = previous._by_row if previous is not None and previous.colour == colour else {}
+        self.rows = list(store.rows(order))
+        self.review_ids = [review_shelter_id(row) for row in self.rows]
+        self.shelter_markers = [known.get(row) or shelter_marker(row, colour) for row in self.rows]
+        self._by_row = dict(zip(self.rows, self.shelter_markers))
+        self._reviewed = {}
+        self.clusters = {zoom: self._build_level(zoom, colour) for zoom in range(INDIVIDUAL_ZOOM)}
+
+    # Групуємо укриття в сітку, клітинка якої має близько CLUSTER_CELL_PX пікселів на цьому зумі
+    def _build_level(self, zoom, colour):
+        cell_lon = 360 * CLUSTER_CELL_PX / (256 * 2 ** zoom)
+        cell_lat = cell_lon * math.cos(math.radians(float(np.mean(self.lat)) if len(self.lat) else 0))
+        keys = np.column_stack([np.floor(self.lat / cell_lat), np.floor(self.lon / cell_lon)])
+        _, groups = np.unique(keys, axis=0, return_inverse=True)
+        groups = groups.ravel()
+        n_groups = int(groups.max()) + 1 if len(groups) else 0
+        count = np.bincount(groups, minlength=n_groups)
+        capacity = np.bincount(groups, weights=self.capacity, minlength=n_groups).astype(np.int64)
+        lat = np.bincount(groups, weights=self.lat, minlength=n_groups) / np.maximum(count, 1)
+        lon = np.bincount(groups, weights=self.lon, minlength=n_groups) / np.maximum(count, 1)
+        # Укриття відсортовані за місткістю, тож перше входження — найбільше в кластері
+        first = np.full(n_groups, len(groups), dtype=np.int64)
+        np.minimum.at(first, groups, np.arange(len(groups)))
+
+        markers = [
+            self.shelter_markers[first[g]] if count[g] == 1
+            else cluster_marker(float(lat[g]), float(lon[g]), int(count[g]), int(capacity[g]), colour)
+            for g in range(n_groups)
+        ]
+        # Номер укриття для кластерів з одного укриття, -1 для справжніх кластерів
+        shelters = np.where(count == 1, first, -1)
+        order = np.argsort(-capacity, kind='stable')
+        return lat[order], lon[order], [markers[g] for g in order], shelters[order]
+
+    # Маркер укриття з кількістю відгуків; перебудовується лише після нових відгуків
+    def _marker_with_reviews(self, i, reviews):
+        cached = self._reviewed.get(i)
+        if cached is None or cached[0] != reviews:
+            cached = self._reviewed[i] = (reviews, shelter_marker(self.rows[i], self.colour, reviews))
+        return cached[1]
+
+    # Маркери для видимої області: кластери на малому зумі, окремі укриття на великому.
+    # review_counts — {ідентифікатор укриття: кількість відгуків} для спливаючих вікон
+    def for_viewport(self, bounds, zoom=None, limit=MAX_MARKERS, review_counts=None):
+        if not bounds:
+            bounds = DEFAULT_BOUNDS
+        if zoom is not None and zoom < INDIVIDUAL_ZOOM:
+            lat, lon, markers, shelters = self.clusters[max(0, int(zoom))]
+        else:
+            lat, lon, markers = self.lat, self.lon, self.shelter_markers
+            shelters = np.arange(len(markers))
+        mask = ((lat <= bounds['north']) & (lat >= bounds['south']) &
+                (lon <= bounds['east']) & (lon >= bounds['west']))
+        selected = np.flatnonzero(mask)[:limit]
+        if not review_counts:
+            return [markers[i] for i in selected]
+        result = []
+        for i in selected:
+            shelter = int(shelters[i])
+            reviews = review_counts.get(self.review_ids[shelter], 0) if shelter >= 0 else 0
+            result.append(self._marker_with_reviews(shelter, reviews) if reviews else markers[i])
+        return result
+
+
+# Усі укриття одним GeoJSON для клієнтського шару, від найбільших до найменших.
+# Повертає тіло, його gzip-версію та ETag, щоб віддавати файл без перерахунку
+def shelters_geojson(store, colour='blue'):
+    order = np.argsort(-np.asarray(store.capacity), kind='stable')
+    features = [{
+        'type': 'Feature',
+        'geometry': {'type': 'Point', 'coordinates': [row.longitude, row.latitude]},
+        'properties': {
+            'capacity': int(row.capacity_of_persons),
+            'radius': round(marker_radius(row.capacity_of_persons), 2),
+            'colour': colour,
+            'tooltip': f"{row.type_of_room}, {row.street} {row.building_number}, "
+                       f"місткість: {row.capacity_of_persons}",
+            'shelter_id': review_shelter_id(row),
+            'popup': '<a href="/review?shelter_id={}">Перейти до відгуків</a>'.format(
+                html_escape.escape(review_shelter_id(row))),
+        },
+    } for row in store.rows(order)]
+    body = json.dumps({'type': 'FeatureCollection', 'features': features},
+                      ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    etag = hashlib.sha256(body).hexdigest()[:32]
+    return body, gzip.compress(body, compresslevel=9, mtime=0), etag
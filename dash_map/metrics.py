@@ -0,0 +1,314 @@
+"""metrics"""
+import cProfile
+import glob
+import json
+import logging
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+METRICS_DIR = os.path.join("instance", "metrics")
+PROFILE_DIR = os.path.join("instance", "profiles")
+TIME_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+
+def _label_key(labels) -> str:
+    return json.dumps(labels, sort_keys=True, ensure_ascii=False)
+
+
+def _format_labels(labels) -> str:
+    if not labels:
+        return ""
+    escaped = (name + '="' + str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"'
+               for name, value in sorted(labels.items()))
+    return "{" + ",".join(escaped) + "}"
+
+
+class Histogram:
+    """Гістограма у форматі Prometheus: лічильники по кошиках, сума і кількість для кожного набору міток."""
+
+    def __init__(self, registry, name, help, buckets=TIME_BUCKETS):
+        self.registry = registry
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self.series = {}
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        with self.registry.lock:
+            self.registry.check_fork()
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = {'buckets': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series['buckets'][i] += 1
+            series['sum'] += value
+            series['count'] += 1
+        self.registry.maybe_dump()
+
+    # Вимірює час блоку в секундах: with histogram.time(phase='geocode'): ...
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def snapshot(self):
+        return {'type': 'histogram', 'help': self.help, 'buckets': list(self.buckets),
+                'series': {key: dict(value, buckets=list(value['buckets'])) for key, value in self.series.items()}}
+
+
+class Counter:
+    """Лічильник, що лише зростає (наприклад, кількість помилок)."""
+
+    def __init__(self, registry, name, help):
+        self.registry = registry
+        self.name = name
+        self.help = help
+        self.series = {}
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with self.registry.lock:
+            self.registry.check_fork()
+            self.series[key] = self.series.get(key, 0) + amount
+        self.registry.maybe_dump()
+
+    def snapshot(self):
+        return {'type': 'counter', 'help': self.help, 'series': dict(self.series)}
+
+
+class Registry:
+    """Метрики процесу та їх об'єднання між воркерами gunicorn.
+    Кожен процес не частіше ніж раз на dump_interval записує свої гістограми й лічильники
+    у METRICS_DIR/<pid>.json, а /metrics у будь-якому воркері підсумовує знімки всіх живих процесів.
+    Gauge-метрики (пам'ять, розміри кешів, черга завдань) рахуються функціями-колекторами лише під час
+    запиту /metrics; мітку pid мають тільки ті, що описують сам процес."""
+
+    def __init__(self, directory=METRICS_DIR, dump_interval=1.0):
+        self.directory = directory
+        self.dump_interval = dump_interval
+        self.metrics = {}
+        self.collectors = {}
+        self.lock = threading.RLock()
+        self._dump_lock = threading.Lock()
+        self._pid = os.getpid()
+        self._dumped_at = 0.0
+
+    def histogram(self, name, help, buckets=TIME_BUCKETS) -> Histogram:
+        return self.metrics.setdefault(name, Histogram(self, name, help, buckets))
+
+    def counter(self, name, help) -> Counter:
+        return self.metrics.setdefault(name, Counter(self, name, help))
+
+    # collect() повертає {мітки (dict у вигляді кортежу пар): значення} або число.
+    # per_process: значення стосується лише цього процесу (пам'ять), а не спільних даних (кеш у SQLite)
+    def gauge(self, name, help, collect, per_process=False):
+        self.collectors[name] = (help, collect, per_process)
+
+    # Після fork воркер починає з нуля: значення майстра лишаються у файлі майстра
+    def check_fork(self):
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._dumped_at = 0.0
+            self._dump_lock = threading.Lock()
+            for metric in self.metrics.values():
+                metric.series = {}
+
+    def _gauges(self):
+        gauges = {}
+        for name, (help, collect, per_process) in self.collectors.items():
+            try:
+                values = collect()
+            except Exception:
+                logger.exception("Помилка метрики %s", name)
+                continue
+            if not isinstance(values, dict):
+                values = {(): values}
+            extra = {'pid': os.getpid()} if per_process else {}
+            gauges[name] = {'type': 'gauge', 'help': help, 'series': {
+                _label_key(dict(labels, **extra)): value for labels, value in values.items()}}
+        return gauges
+
+    # Гістограми й лічильники цього процесу
+    def snapshot(self) -> dict:
+        with self.lock:
+            self.check_fork()
+            return {name: metric.snapshot() for name, metric in self.metrics.items()}
+
+    # Викликається з observe/inc на шляху запиту: скидає знімок не частіше ніж раз на dump_interval,
+    # лише одним потоком (інші не чекають), а помилки запису лише логуються
+    def maybe_dump(self):
+        if time.monotonic() - self._dumped_at < self.dump_interval:
+            return
+        dump_lock = self._dump_lock
+        if not dump_lock.acquire(blocking=False):
+            return
+        try:
+            if time.monotonic() - self._dumped_at >= self.dump_interval:
+                self.dump()
+        except Exception:
+            logger.exception("Не вдалося записати метрики у %s", self.directory)
+        finally:
+            dump_lock.release()
+
+    def dump(self):
+        self._dumped_at = time.monotonic()
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f"{os.getpid()}.json")
+        fd, tmp_path = tempfile.mkstemp(prefix=f"{os.getpid()}.", suffix=".tmp", dir=self.directory)
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as file:
+                json.dump(self.snapshot(), file, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except FileNotFoundError:
+                pass
+            raise
+
+    # Знімки всіх живих процесів (свій — актуальний, з пам'яті); файли завершених процесів видаляються
+    def _collect_all(self):
+        snapshots = [self.snapshot()]
+        for path in glob.glob(os.path.join(self.directory, "*.json")):
+            pid = int(os.path.basename(path).split(".")[0])
+            if pid == os.getpid():
+                continue
+            try:
+                os.kill(pid, 0)
+            except ProcessLookupError:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                continue
+            except PermissionError:
+                pass
+            try:
+                with open(path, encoding='utf-8') as file:
+                    snapshots.append(json.load(file))
+            except (OSError, ValueError):
+                continue
+        return snapshots
+
+    # Текстовий формат Prometheus з підсумками по всіх процесах
+    def render(self) -> str:
+        merged = {}
+        for snapshot in self._collect_all() + [self._gauges()]:
+            for name, metric in snapshot.items():
+                target = merged.setdefault(name, {key: value for key, value in metric.items() if key != 'series'})
+                series = target.setdefault('series', {})
+                for key, value in metric['series'].items():
+                    if metric['type'] == 'histogram':
+                        current = series.setdefault(key, {'buckets': [0] * len(metric['buckets']), 'sum': 0.0, 'count': 0})
+                        current['buckets'] = [a + b for a, b in zip(current['buckets'], value['buckets'])]
+                        current['sum'] += value['sum']
+                        current['count'] += value['count']
+                    elif metric['type'] == 'counter':
+                        series[key] = series.get(key, 0) + value
+                    else:
+                        series[key] = value
+
+        lines = []
+        for name in sorted(merged):
+            metric = merged[name]
+            lines.append(f"# HELP {name} {metric['help']}")
+            lines.append(f"# TYPE {name} {metric['type']}")
+            for key, value in sorted(metric['series'].items()):
+                labels = json.loads(key)
+                if metric['type'] != 'histogram':
+                    lines.append(f"{name}{_format_labels(labels)} {value}")
+                    continue
+                # Кошики вже накопичувальні: observe додає значення до всіх кошиків з межею >= value
+                for bound, count in zip(metric['buckets'], value['buckets']):
+                    lines.append(f"{name}_bucket{_format_labels(dict(labels, le=bound))} {count}")
+                lines.append(f"{name}_bucket{_format_labels(dict(labels, le='+Inf'))} {value['count']}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {value['sum']}")
+                lines.append(f"{name}_count{_format_labels(labels)} {value['count']}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+ROUTE_PHASES = registry.histogram("shelter_route_phase_seconds", "Duration of routing phases")
+CALLBACK_LATENCY = registry.histogram("dash_callback_seconds", "Dash callback and HTTP route latency")
+CALLBACK_REQUEST_BYTES = registry.histogram("dash_callback_request_bytes", "Callback request payload size",
+                                            SIZE_BUCKETS)
+CALLBACK_RESPONSE_BYTES = registry.histogram("dash_callback_response_bytes", "Callback response payload size",
+                                             SIZE_BUCKETS)
+CALLBACK_ERRORS = registry.counter("dash_callback_errors_total", "Callbacks and routes that returned 5xx")
+SQL_QUERIES = registry.histogram("sqlite_query_seconds", "SQLite statement execution time")
+JOB_SECONDS = registry.histogram("background_job_seconds", "Background job handler duration")
+JOBS = registry.counter("background_jobs_total", "Background jobs by outcome")
+
+
+class TimedConnection(sqlite3.Connection):
+    """З'єднання SQLite, що рахує кількість і час запитів за базою та типом запиту (SELECT, INSERT, ...).
+    Час — це виконання execute; дочитування рядків через fetchall сюди не входить."""
+
+    def __init__(self, database, *args, **kwargs):
+        super().__init__(database, *args, **kwargs)
+        self.db_name = os.path.basename(str(database))
+
+    def execute(self, sql, parameters=()):
+        with SQL_QUERIES.time(db=self.db_name, op=sql.lstrip().split(None, 1)[0].upper()):
+            return super().execute(sql, parameters)
+
+    def executemany(self, sql, parameters):
+        with SQL_QUERIES.time(db=self.db_name, op=sql.lstrip().split(None, 1)[0].upper()):
+            return super().executemany(sql, parameters)
+
+
+# Мітка запиту: для колбеків Dash — їхні виходи, для решти — шаблон маршруту Flask
+def _request_label(request):
+    if request.path.endswith('/_dash-update-component'):
+        body = request.get_json(silent=True) or {}
+        return body.get('output', 'unknown')
+    return request.url_rule.rule if request.url_rule is not None else 'not_found'
+
+
+# Час, розміри запиту й відповіді та помилки для кожного запиту до Flask-сервера Dash.
+# profile_rate > 0 вмикає cProfile для такої частки запитів; профілі пишуться у profile_dir
+def instrument_flask(server, profile_rate=0.0, profile_dir=PROFILE_DIR):
+    from flask import g, request
+
+    @server.before_request
+    def _start_timer():
+        g.metrics_started = time.perf_counter()
+        g.metrics_profile = None
+        if profile_rate > 0 and random.random() < profile_rate:
+            g.metrics_profile = cProfile.Profile()
+            g.metrics_profile.enable()
+
+    @server.after_request
+    def _record(response):
+        started = g.pop('metrics_started', None)
+        if started is None:
+            return response
+        label = _request_label(request)
+        CALLBACK_LATENCY.observe(time.perf_counter() - started, callback=label)
+        if request.path.endswith('/_dash-update-component'):
+            CALLBACK_REQUEST_BYTES.observe(request.content_length or 0, callback=label)
+            if not response.is_streamed:
+                CALLBACK_RESPONSE_BYTES.observe(response.calculate_content_length() or 0, callback=label)
+        if response.status_code >= 500:
+            CALLBACK_ERRORS.inc(callback=label, status=response.status_code)
+        profile = g.pop('metrics_profile', None)
+        if profile is not None:
+            profile.disable()
+            os.makedirs(profile_dir, exist_ok=True)
+            name = "".join(ch if ch.isalnum() else "_" for ch in label)[:80]
+            profile.dump_stats(os.path.join(profile_dir, f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{name}.prof"))
+        return response
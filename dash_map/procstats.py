@@ -0,0 +1,28 @@
+"""procstats"""
+import os
+
+
+# Пам'ять поточного процесу в байтах: rss, pss (частка спільних сторінок) та shared.
+# Дані з /proc, тож на інших ОС повертаємо лише те, що вдалося прочитати
+def memory_usage() -> dict:
+    usage = {'pid': os.getpid()}
+    fields = {'Rss:': 'rss', 'Pss:': 'pss', 'Shared_Clean:': 'shared_clean', 'Shared_Dirty:': 'shared_dirty'}
+    try:
+        with open('/proc/self/smaps_rollup') as file:
+            for line in file:
+                parts = line.split()
+                if parts and parts[0] in fields:
+                    usage[fields[parts[0]]] = int(parts[1]) * 1024
+    except OSError:
+        try:
+            import resource
+            usage['rss'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+        except (ImportError, OSError):
+            pass
+    if 'shared_clean' in usage:
+        usage['shared'] = usage.pop('shared_clean') + usage.pop('shared_dirty', 0)
+    return usage
+
+
+def format_memory(usage: dict) -> str:
+    return ", ".join(f"{key}={value / 2 ** 20:.1f} MiB" for key, value in usage.items() if key != 'pid')
@@ -0,0 +1,161 @@
+"""review_writer"""
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+
+from dash_map import db
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class ReviewWriter:
+    """Відкладений запис відгуків: колбек лише кладе відгук у обмежену чергу,
+    а фоновий потік пачками вставляє їх в одній транзакції.
+    Пачку, яку не вдалося записати (наприклад, база зайнята), потік повторює з паузою, що зростає,
+    а після retries невдач записує відгуки по одному, щоб один поганий відгук не тягнув за собою інших.
+    Відгук, що не записався й так, потрапляє в журнал і рахується у failed.
+
+    Поки відгук не записано, pending_reviews показує його лише в цьому процесі (інший воркер gunicorn
+    його не бачить). Гарантію "автор одразу бачить свій відгук" дає клієнтське сховище my-new-reviews."""
+
+    def __init__(self, db_path=db.DB_FILE, maxsize=1000, batch_size=100, put_timeout=2.0,
+                 retries=5, retry_delay=0.1, max_retry_delay=5.0):
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self.put_timeout = put_timeout
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.written = 0
+        self.failed = 0
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        atexit.register(self.close)
+
+    # Фоновий потік стартує ліниво і заново після fork у воркері gunicorn
+    def _ensure_started(self):
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive() or self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, name="review-writer", daemon=True)
+                self._thread.start()
+
+    # Ставить відгук у чергу. Якщо черга переповнена довше за put_timeout,
+    # записуємо синхронно, щоб не втратити відгук; помилка такого запису доходить до колбека
+    def submit(self, shelter_id, review_text, username):
+        review = {'rowid': None, 'username': username, 'review_text': review_text,
+                  'created_at': time.time(), 'shelter_id': shelter_id}
+        with self._lock:
+            self._pending.setdefault(shelter_id, []).append(review)
+        self._ensure_started()
+        try:
+            self._queue.put(review, timeout=self.put_timeout)
+        except queue.Full:
+            try:
+                self._write([review])
+            except Exception:
+                self._forget([review])
+                raise
+
+    def pending_reviews(self, shelter_id):
+        with self._lock:
+            return sorted(self._pending.get(shelter_id, ()), key=lambda r: r['created_at'], reverse=True)
+
+    def pending_count(self) -> int:
+        with self._lock:
+            return sum(len(reviews) for reviews in self._pending.values())
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            batch = [] if item is _STOP else [item]
+            stop = item is _STOP
+            while not stop and len(batch) < self.batch_size:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stop = True
+                else:
+                    batch.append(item)
+            try:
+                if batch:
+                    self._write_with_retries(batch)
+            finally:
+                for _ in range(len(batch) + (1 if stop else 0)):
+                    self._queue.task_done()
+            if stop:
+                return
+
+    # Повторює запис пачки з паузою, що подвоюється; далі — по одному відгуку.
+    # Відгук лишається в _pending, доки його не записано або не визнано втраченим
+    def _write_with_retries(self, batch):
+        delay = self.retry_delay
+        for attempt in range(self.retries + 1):
+            try:
+                self._write(batch)
+                return
+            except Exception:
+                if attempt == self.retries:
+                    logger.exception("Не вдалося записати пачку з %d відгуків", len(batch))
+                    break
+                logger.warning("Помилка запису відгуків, повтор через %.1f с", delay, exc_info=True)
+                time.sleep(delay)
+                delay = min(delay * 2, self.max_retry_delay)
+        for review in batch:
+            try:
+                self._write([review])
+            except Exception:
+                logger.exception("Відгук до укриття %s від %s втрачено", review['shelter_id'], review['username'])
+                self._forget([review])
+                with self._lock:
+                    self.failed += 1
+
+    def _write(self, batch):
+        conn = db.get_connection(self.db_path)
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.executemany(
+                'INSERT INTO reviews (shelter_id, review_text, username, created_at) VALUES (?, ?, ?, ?)',
+                [(r['shelter_id'], r['review_text'], r['username'], r['created_at']) for r in batch])
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        self._forget(batch)
+        with self._lock:
+            self.written += len(batch)
+        for shelter_id in {r['shelter_id'] for r in batch}:
+            db.invalidate_reviews(shelter_id, self.db_path)
+
+    # Прибирає відгуки з _pending (після COMMIT або коли відгук остаточно не записався)
+    def _forget(self, batch):
+        with self._lock:
+            for review in batch:
+                pending = [r for r in self._pending.get(review['shelter_id'], []) if r is not review]
+                if pending:
+                    self._pending[review['shelter_id']] = pending
+                else:
+                    self._pending.pop(review['shelter_id'], None)
+
+    # Чекає, доки всі відгуки з черги буде записано
+    def flush(self):
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.join()
+
+    # Дописує чергу і зупиняє потік (викликається також при завершенні процесу)
+    def close(self):
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            self._queue.put(_STOP)
+            self._thread.join()
@@ -0,0 +1,98 @@
+"""route_cache"""
+import json
+import os
+import threading
+import time
+
+from dash_map import db
+from dash_map.geocoder import split_address
+
+CACHE_FILE = os.path.join("instance", "route_cache.sqlite")
+
+# Частота оновлення часу використання запису: не частіше, ніж раз на TOUCH_INTERVAL секунд
+TOUCH_INTERVAL = 60.0
+
+
+# Ключ адреси: нормалізовані вулиця і будинок, тож "вул. Зелена 20а" і "Зелена 20 А" збігаються
+def address_key(address) -> str:
+    street, house = split_address(address)
+    return f"{street}|{house}"
+
+
+class RouteCache:
+    """Спільний для всіх воркерів кеш маршрутів у SQLite з обмеженням розміру (LRU).
+    Два види записів: 'address' — адреса -> точка користувача, 'node' — вузол графу ->
+    найближчі укриття з шляхами. Кожен запис має версію: для вузлів — граф і файл укриттів,
+    для адрес — версія геокодування, тож зміна укриттів адрес не зачіпає.
+    Записи інших версій просто не читаються і, не оновлюючи used_at, першими йдуть під LRU-витіснення;
+    явно їх не видаляємо, бо воркери під час оновлення даних деякий час працюють з різними версіями."""
+
+    def __init__(self, db_path=CACHE_FILE, maxsize=50_000, evict_every=100):
+        self.db_path = db_path
+        self.maxsize = maxsize
+        self.evict_every = evict_every
+        self.hits = {}
+        self.misses = {}
+        self._writes = 0
+        self._lock = threading.Lock()
+        if os.path.dirname(db_path):
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        conn = db.get_connection(db_path)
+        conn.execute('''CREATE TABLE IF NOT EXISTS route_cache (
+            kind TEXT NOT NULL,
+            key TEXT NOT NULL,
+            version TEXT NOT NULL,
+            value TEXT NOT NULL,
+            used_at REAL NOT NULL,
+            PRIMARY KEY (kind, key, version)
+        )''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_route_cache_used ON route_cache (used_at)')
+
+    def _count(self, counters, kind):
+        with self._lock:
+            counters[kind] = counters.get(kind, 0) + 1
+
+    def get(self, kind, key, version):
+        conn = db.get_connection(self.db_path)
+        row = conn.execute('SELECT value, used_at FROM route_cache WHERE kind = ? AND key = ? AND version = ?',
+                           (kind, key, version)).fetchone()
+        if row is None:
+            self._count(self.misses, kind)
+            return None
+        self._count(self.hits, kind)
+        now = time.time()
+        if now - row['used_at'] > TOUCH_INTERVAL:
+            conn.execute('UPDATE route_cache SET used_at = ? WHERE kind = ? AND key = ? AND version = ?',
+                         (now, kind, key, version))
+        return json.loads(row['value'])
+
+    def set(self, kind, key, version, value):
+        db.get_connection(self.db_path).execute(
+            'INSERT OR REPLACE INTO route_cache (kind, key, version, value, used_at) VALUES (?, ?, ?, ?, ?)',
+            (kind, key, version, json.dumps(value), time.time()))
+        with self._lock:
+            self._writes += 1
+            evict = self._writes % self.evict_every == 0
+        if evict:
+            self.evict()
+
+    # Видаляє найдавніше використані записи понад maxsize
+    def evict(self):
+        db.get_connection(self.db_path).execute(
+            '''DELETE FROM route_cache WHERE rowid IN (
+                   SELECT rowid FROM route_cache ORDER BY used_at
+                   LIMIT MAX((SELECT COUNT(*) FROM route_cache) - ?, 0))''', (self.maxsize,))
+
+    def clear(self):
+        db.get_connection(self.db_path).execute('DELETE FROM route_cache')
+
+    # Влучання і промахи цього процесу за видами записів та розмір спільного кешу
+    def stats(self) -> dict:
+        size = db.get_connection(self.db_path).execute('SELECT COUNT(*) FROM route_cache').fetchone()[0]
+        with self._lock:
+            stats = {'size': size}
+            for kind in sorted(set(self.hits) | set(self.misses)):
+                hits, misses = self.hits.get(kind, 0), self.misses.get(kind, 0)
+                stats[kind] = {'hits': hits, 'misses': misses,
+                               'hit_rate': round(hits / (hits + misses), 3) if hits + misses else 0.0}
+            return stats
@@ -0,0 +1,190 @@
+"""routing_engine"""
+import hashlib
+import json
+import os
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import dijkstra as csgraph_dijkstra
+from sklearn.neighbors import BallTree
+
+EARTH_RADIUS_M = 6_371_008.8
+SNAPSHOT_FORMAT = 2
+SNAPSHOT_ARRAYS = ("node_ids", "lat", "lon", "indptr", "indices", "lengths")
+
+
+# Центри вулиць з назв ребер графу OSM: нормалізована назва -> (широта, довгота)
+def street_centroids(G) -> dict:
+    from dash_map.geocoder import normalize_street
+    points = {}
+    for u, v, data in G.edges(data=True):
+        names = data.get("name")
+        if not names:
+            continue
+        for name in names if isinstance(names, list) else [names]:
+            street = normalize_street(name)
+            for node in (u, v):
+                points.setdefault(street, []).append((G.nodes[node]["y"], G.nodes[node]["x"]))
+    return {street: (sum(p[0] for p in pts) / len(pts), sum(p[1] for p in pts) / len(pts))
+            for street, pts in points.items()}
+
+
+class RoutingEngine:
+    """Граф Львова у компактному CSR-вигляді (масиви вузлів, ребер і координат).
+    Будується один раз на процес і обслуговує всі запити на маршрут."""
+
+    def __init__(self, node_ids, lat, lon, indptr, indices, lengths, street_points=None):
+        # Типи збігаються з тими, що використовує scipy (int32 індекси, float64 ваги),
+        # тож масиви зі знімка, відкриті через mmap, не копіюються і спільні для всіх воркерів
+        self.node_ids = np.asarray(node_ids, dtype=np.int64)
+        self.lat = np.asarray(lat, dtype=np.float64)
+        self.lon = np.asarray(lon, dtype=np.float64)
+        self.indptr = np.asarray(indptr, dtype=np.int32)
+        self.indices = np.asarray(indices, dtype=np.int32)
+        self.lengths = np.asarray(lengths, dtype=np.float64)
+        n = len(self.node_ids)
+        self.matrix = csr_matrix((self.lengths, self.indices, self.indptr), shape=(n, n))
+        self._node_order = None
+        self._node_tree = None
+        self._fingerprint = None
+        # Центри вулиць з назв ребер OSM, потрібні геокодеру: назва -> (широта, довгота)
+        self.street_points = street_points or {}
+        # Ієрархія скорочень (dash_map.contraction) для пошуку найближчих укриттів, якщо її зібрано
+        # для цього графу і на ньому вона швидша за Дейкстру
+        self.hierarchy = None
+
+    @property
+    def n_nodes(self) -> int:
+        return len(self.node_ids)
+
+    @property
+    def n_edges(self) -> int:
+        return len(self.indices)
+
+    # Відбиток графу, щоб знати, коли похідні таблиці на диску застаріли
+    @property
+    def fingerprint(self) -> str:
+        if self._fingerprint is None:
+            digest = hashlib.sha256()
+            for array in (self.node_ids, self.indptr, self.indices, self.lengths):
+                digest.update(np.ascontiguousarray(array).tobytes())
+            self._fingerprint = digest.hexdigest()[:16]
+        return self._fingerprint
+
+    # Перетворюємо граф networkx/osmnx у CSR, з паралельних ребер лишаємо найкоротше
+    @classmethod
+    def from_networkx(cls, G) -> "RoutingEngine":
+        node_ids = np.fromiter(G.nodes(), dtype=np.int64, count=G.number_of_nodes())
+        node_index = {int(node): i for i, node in enumerate(node_ids)}
+        lat = np.array([G.nodes[n]["y"] for n in node_ids], dtype=np.float64)
+        lon = np.array([G.nodes[n]["x"] for n in node_ids], dtype=np.float64)
+
+        best = {}
+        for u, v, data in G.edges(data=True):
+            key = (node_index[int(u)], node_index[int(v)])
+            length = float(data.get("length", float("inf")))
+            if length < best.get(key, float("inf")):
+                best[key] = length
+
+        if best:
+            pairs = np.array(list(best.keys()), dtype=np.int64)
+            weights = np.fromiter(best.values(), dtype=np.float64, count=len(best))
+        else:
+            pairs = np.empty((0, 2), dtype=np.int64)
+            weights = np.empty(0, dtype=np.float64)
+        order = np.lexsort((pairs[:, 1], pairs[:, 0]))
+        pairs, weights = pairs[order], weights[order]
+        indptr = np.zeros(len(node_ids) + 1, dtype=np.int32)
+        np.add.at(indptr, pairs[:, 0] + 1, 1)
+        indptr = np.cumsum(indptr, dtype=np.int32)
+        return cls(node_ids, lat, lon, indptr, pairs[:, 1], weights, street_centroids(G))
+
+    # Знімок графу: .npy-масиви та meta.json з версією формату і відбитком графу
+    def save(self, snapshot_dir):
+        os.makedirs(snapshot_dir, exist_ok=True)
+        version = self.fingerprint
+        files = {}
+        for name in SNAPSHOT_ARRAYS:
+            files[name] = f"{name}-{version}.npy"
+            np.save(os.path.join(snapshot_dir, files[name]), np.ascontiguousarray(getattr(self, name)))
+        meta = {"format": SNAPSHOT_FORMAT, "fingerprint": version, "files": files,
+                "nodes": self.n_nodes, "edges": self.n_edges, "streets": self.street_points}
+        tmp_meta = os.path.join(snapshot_dir, f"meta-{os.getpid()}.json.tmp")
+        with open(tmp_meta, "w", encoding="utf-8") as file:
+            json.dump(meta, file, ensure_ascii=False)
+        os.replace(tmp_meta, os.path.join(snapshot_dir, "meta.json"))
+        for name in os.listdir(snapshot_dir):
+            if name.endswith(".npy") and name not in files.values():
+                try:
+                    os.remove(os.path.join(snapshot_dir, name))
+                except FileNotFoundError:
+                    pass
+
+    # Завантаження знімка без osmnx. mmap=True відкриває масиви через mmap,
+    # verify=True перераховує відбиток і порівнює з записаним
+    @classmethod
+    def load(cls, snapshot_dir, mmap=True, verify=False) -> "RoutingEngine":
+        with open(os.path.join(snapshot_dir, "meta.json"), encoding="utf-8") as file:
+            meta = json.load(file)
+        if meta.get("format") != SNAPSHOT_FORMAT:
+            raise ValueError(f"Непідтримуваний формат знімка графу: {meta.get('format')}")
+        arrays = {name: np.load(os.path.join(snapshot_dir, meta["files"][name]),
+                                mmap_mode="r" if mmap else None)
+                  for name in SNAPSHOT_ARRAYS}
+        engine = cls(**arrays, street_points={k: tuple(v) for k, v in meta.get("streets", {}).items()})
+        if verify:
+            if engine.fingerprint != meta["fingerprint"]:
+                raise ValueError("Відбиток знімка графу не збігається з даними")
+        else:
+            engine._fingerprint = meta["fingerprint"]
+        return engine
+
+    # Індекс вузла за його OSM id (бінарний пошук замість словника на весь граф у кожному воркері)
+    def index_of(self, node_id: int) -> int:
+        if self._node_order is None:
+            self._node_order = np.argsort(self.node_ids, kind="stable")
+        pos = np.searchsorted(self.node_ids, node_id, sorter=self._node_order)
+        if pos >= len(self.node_ids) or self.node_ids[self._node_order[pos]] != node_id:
+            raise KeyError(node_id)
+        return int(self._node_order[pos])
+
+    # Будуємо дерево пошуку вузлів заздалегідь, наприклад до fork у gunicorn,
+    # щоб воркери ділили його сторінки, а не будували кожен свою копію
+    def prepare(self):
+        self._tree()
+        return self
+
+    def _tree(self) -> BallTree:
+        if self._node_tree is None:
+            self._node_tree = BallTree(np.radians(np.column_stack([self.lat, self.lon])),
+                                       metric="haversine")
+        return self._node_tree
+
+    # Найближчий вузол графу до точки (широта, довгота), повертає індекс вузла
+    def nearest_node(self, lat: float, lon: float) -> int:
+        return int(self.nearest_nodes([lat], [lon])[0])
+
+    # Векторизований пошук найближчих вузлів для багатьох точок одразу
+    def nearest_nodes(self, lats, lons) -> np.ndarray:
+        points = np.radians(np.column_stack([np.asarray(lats, dtype=np.float64),
+                                             np.asarray(lons, dtype=np.float64)]))
+        _, idx = self._tree().query(points, k=1)
+        return idx[:, 0]
+
+    # Дейкстра з одного вузла: відстані та попередники; з limit (метри) пошук обмежено цим радіусом
+    def shortest_paths(self, source: int, limit: float = np.inf):
+        dist, pred = csgraph_dijkstra(self.matrix, directed=True, indices=source,
+                                      return_predecessors=True, limit=limit)
+        return dist, pred
+
+    # Відновлюємо шлях від джерела до цілі за масивом попередників
+    @staticmethod
+    def unwind_path(pred, target: int) -> list[int]:
+        path = []
+        current = target
+        while current >= 0:
+            path.append(int(current))
+            current = pred[current]
+        return path[::-1]
+
+    def path_coords(self, path) -> list[tuple[float, float]]:
+        return [(float(self.lat[i]), float(self.lon[i])) for i in path]
@@ -0,0 +1,131 @@
+"""shelter_dataset"""
+import logging
+import os
+import threading
+import time
+
+from dash_map.shelter_field import file_digest, load_or_build_buckets, load_or_build_field
+from dash_map.shelter_index import ShelterIndex
+from dash_map.shelter_store import load_store
+
+logger = logging.getLogger(__name__)
+
+
+def _file_stamp(file_path):
+    stat = os.stat(file_path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+class ShelterSnapshot:
+    """Одна версія даних укриттів і все, що з неї пораховано: сховище, просторовий індекс,
+    поле найближчих укриттів, відра для ієрархії скорочень і представлення (маркери, GeoJSON).
+    Після створення не змінюється, тож запит, що взяв знімок, до кінця бачить узгоджені дані."""
+
+    def __init__(self, digest, stamp, store, index, field, buckets, views):
+        self.digest = digest
+        self.stamp = stamp
+        self.store = store
+        self.index = index
+        self.field = field
+        self.buckets = buckets
+        self.views = views
+
+    @property
+    def version(self) -> str:
+        return self.field.version
+
+
+class ShelterDataset:
+    """Файл укриттів, що може оновлюватись без перезапуску воркерів.
+    current() повертає поточний знімок і не частіше ніж раз на check_interval секунд перевіряє файл.
+    Якщо файл змінився, новий знімок будується у фоновому потоці з попереднього (перераховується
+    лише те, що стосується змінених укриттів), а тоді підміняється одним присвоєнням.
+    Доки він будується, запити обслуговує старий знімок."""
+
+    def __init__(self, shelter_file, engine, bucket_limit=None, check_interval=5.0):
+        self.shelter_file = shelter_file
+        self.engine = engine
+        self.bucket_limit = bucket_limit
+        self.check_interval = check_interval
+        self._builders = {}
+        self._lock = threading.Lock()
+        self._building = False
+        self._pid = os.getpid()
+        self._checked_at = time.monotonic()
+        self._snapshot = self._build(None)
+
+    # Представлення, похідне від сховища: build(store, previous) повертає нове значення,
+    # previous — значення з попереднього знімка (або None), щоб перебудовувати лише змінене
+    def add_view(self, name, build):
+        with self._lock:
+            self._builders[name] = build
+            self._snapshot.views[name] = build(self._snapshot.store, None)
+
+    def current(self) -> ShelterSnapshot:
+        if time.monotonic() - self._checked_at >= self.check_interval:
+            self._checked_at = time.monotonic()
+            self._maybe_reload()
+        return self._snapshot
+
+    # Запускає фонову перебудову, якщо файл змінився і перебудова ще не йде
+    def _maybe_reload(self):
+        try:
+            if _file_stamp(self.shelter_file) == self._snapshot.stamp:
+                return
+        except OSError:
+            return
+        with self._lock:
+            # Після fork прапорець міг лишитись від потоку батьківського процесу
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._building = False
+            if self._building:
+                return
+            self._building = True
+        threading.Thread(target=self._reload_in_background, name="shelter-reload", daemon=True).start()
+
+    def _reload_in_background(self):
+        try:
+            self.reload()
+        except Exception:
+            logger.exception("Помилка оновлення укриттів")
+        finally:
+            self._building = False
+
+    # Перебудовує знімок, якщо файл змінився; повертає True, якщо знімок підмінено
+    def reload(self) -> bool:
+        previous = self._snapshot
+        stamp = _file_stamp(self.shelter_file)
+        if stamp == previous.stamp:
+            return False
+        if file_digest(self.shelter_file) == previous.digest:
+            # Файл лише торкнули (наприклад, скопіювали той самий), дані не змінились
+            self._snapshot = ShelterSnapshot(previous.digest, stamp, previous.store, previous.index,
+                                             previous.field, previous.buckets, previous.views)
+            return False
+        snapshot = self._build(previous)
+        # Файл змінився ще раз, поки будували: цю версію не показуємо, наступна перевірка почне заново
+        if _file_stamp(self.shelter_file) != snapshot.stamp:
+            return False
+        self._snapshot = snapshot
+        logger.info("Укриття оновлено: %d укриттів, версія %s", len(snapshot.index), snapshot.version)
+        return True
+
+    def _build(self, previous) -> ShelterSnapshot:
+        stamp = _file_stamp(self.shelter_file)
+        digest = file_digest(self.shelter_file)
+        store = load_store(self.shelter_file)
+        index = ShelterIndex.from_store(store)
+        index.reuse_graph_nodes(previous.index if previous else None, self.engine)
+        field = load_or_build_field(self.engine, self.shelter_file, index,
+                                    previous=previous.field if previous else None)
+        buckets = None
+        if self.engine.hierarchy is not None and self.bucket_limit is not None:
+            buckets = load_or_build_buckets(self.engine, self.shelter_file, index, self.bucket_limit,
+                                            previous=previous.buckets if previous else None,
+                                            previous_index=previous.index if previous else None)
+        with self._lock:
+            builders = dict(self._builders)
+        views = {name: build(store, previous.views.get(name) if previous else None)
+                 for name, build in builders.items()}
+        return ShelterSnapshot(digest, stamp, store, index, field, buckets, views)
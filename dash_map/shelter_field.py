@@ -0,0 +1,170 @@
+"""shelter_field"""
+import glob
+import hashlib
+import json
+import os
+import shutil
+import numpy as np
+from scipy.sparse.csgraph import dijkstra as csgraph_dijkstra
+
+from dash_map.contraction import TargetBuckets
+from dash_map.shelter_index import ShelterIndex
+
+FIELD_DIR = "instance"
+FIELD_ARRAYS = ("shelter_lat", "shelter_lon", "shelter_nodes", "nearest_shelter", "distance", "next_hop")
+
+
+def file_digest(file_path) -> str:
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()[:16]
+
+
+class ShelterField:
+    """Для кожного вузла графу: найближче укриття, відстань до нього і наступний крок.
+    Рахується одним багатоджерельним Дейкстрою від усіх укриттів по оберненому графу,
+    тому запит на маршрут — це лише прохід ланцюжком next_hop."""
+
+    def __init__(self, names, shelter_lat, shelter_lon, shelter_nodes,
+                 nearest_shelter, distance, next_hop, version=""):
+        self.names = list(names)
+        self.shelter_lat = np.asarray(shelter_lat, dtype=np.float64)
+        self.shelter_lon = np.asarray(shelter_lon, dtype=np.float64)
+        self.shelter_nodes = np.asarray(shelter_nodes, dtype=np.int64)
+        self.nearest_shelter = np.asarray(nearest_shelter, dtype=np.int32)
+        self.distance = np.asarray(distance, dtype=np.float64)
+        self.next_hop = np.asarray(next_hop, dtype=np.int32)
+        self.version = version
+
+    # Будуємо поле для рушія маршрутів та індексу укриттів
+    @classmethod
+    def build(cls, engine, shelter_index, version=""):
+        shelter_nodes = shelter_index.graph_nodes(engine)
+        # На вузол може потрапити кілька укриттів, джерелом беремо перше з них
+        node_to_shelter = {}
+        for i, node in enumerate(shelter_nodes):
+            node_to_shelter.setdefault(int(node), i)
+        sources = np.fromiter(node_to_shelter.keys(), dtype=np.int64, count=len(node_to_shelter))
+
+        if len(sources):
+            distance, pred, origin = csgraph_dijkstra(
+                engine.matrix.T.tocsr(), directed=True, indices=sources,
+                return_predecessors=True, min_only=True)
+        else:
+            distance = np.full(engine.n_nodes, np.inf)
+            pred = np.full(engine.n_nodes, -9999)
+            origin = np.full(engine.n_nodes, -9999)
+
+        lookup = np.full(engine.n_nodes, -1, dtype=np.int32)
+        for node, shelter in node_to_shelter.items():
+            lookup[node] = shelter
+        nearest_shelter = np.where(origin >= 0, lookup[np.maximum(origin, 0)], -1)
+        next_hop = np.where(pred >= 0, pred, -1)
+        return cls(shelter_index.names, shelter_index.lat, shelter_index.lon, shelter_nodes,
+                   nearest_shelter, distance, next_hop, version)
+
+    # Поле для нового набору укриттів з поля previous. Якщо жодне вузлове укриття не зникло,
+    # старі відстані лишаються правильними: Дейкстра рахується лише від нових вузлів і береться мінімум
+    # (коли змінились тільки назви чи місткість, пошуку немає зовсім). Інакше — повна перебудова
+    @classmethod
+    def update(cls, previous, engine, shelter_index, version=""):
+        if previous is None or len(previous.distance) != engine.n_nodes:
+            return cls.build(engine, shelter_index, version)
+        shelter_nodes = shelter_index.graph_nodes(engine)
+        node_to_shelter = {}
+        for i, node in enumerate(shelter_nodes.tolist()):
+            node_to_shelter.setdefault(node, i)
+        old_nodes = set(previous.shelter_nodes.tolist())
+        if not old_nodes <= node_to_shelter.keys():
+            return cls.build(engine, shelter_index, version)
+
+        lookup = np.full(engine.n_nodes, -1, dtype=np.int32)
+        for node, shelter in node_to_shelter.items():
+            lookup[node] = shelter
+        # Старе укриття -> його вузол -> нове укриття на цьому вузлі
+        origin = np.where(previous.nearest_shelter >= 0,
+                          previous.shelter_nodes[np.maximum(previous.nearest_shelter, 0)], -1)
+        nearest_shelter = np.where(origin >= 0, lookup[np.maximum(origin, 0)], -1)
+        distance = np.array(previous.distance)
+        next_hop = np.array(previous.next_hop)
+        added = np.array(sorted(node_to_shelter.keys() - old_nodes), dtype=np.int64)
+        if len(added):
+            added_distance, pred, added_origin = csgraph_dijkstra(
+                engine.matrix.T.tocsr(), directed=True, indices=added,
+                return_predecessors=True, min_only=True)
+            better = added_distance < distance
+            distance[better] = added_distance[better]
+            next_hop[better] = np.where(pred[better] >= 0, pred[better], -1)
+            nearest_shelter[better] = lookup[added_origin[better]]
+        return cls(shelter_index.names, shelter_index.lat, shelter_index.lon, shelter_nodes,
+                   nearest_shelter, distance, next_hop, version)
+
+    # Шлях від вузла до найближчого укриття (індекси вузлів) або None, якщо недосяжно
+    def route_from(self, node: int):
+        if self.nearest_shelter[node] < 0:
+            return None
+        path = [int(node)]
+        while self.next_hop[path[-1]] >= 0:
+            path.append(int(self.next_hop[path[-1]]))
+        return path
+
+    # Поле зберігається як .npy-масиви та meta.json, щоб воркери відкривали його через mmap
+    def save(self, field_dir):
+        tmp_dir = f"{field_dir}.tmp-{os.getpid()}"
+        os.makedirs(tmp_dir, exist_ok=True)
+        for name in FIELD_ARRAYS:
+            np.save(os.path.join(tmp_dir, f"{name}.npy"), getattr(self, name))
+        with open(os.path.join(tmp_dir, "meta.json"), 'w', encoding='utf-8') as file:
+            json.dump({'version': self.version, 'names': self.names}, file, ensure_ascii=False)
+        try:
+            os.rename(tmp_dir, field_dir)
+        except OSError:
+            # Інший воркер уже зберіг це саме поле
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    @classmethod
+    def load(cls, field_dir, mmap=True):
+        with open(os.path.join(field_dir, "meta.json"), encoding='utf-8') as file:
+            meta = json.load(file)
+        arrays = {name: np.load(os.path.join(field_dir, f"{name}.npy"), mmap_mode='r' if mmap else None)
+                  for name in FIELD_ARRAYS}
+        return cls(meta['names'], **arrays, version=meta['version'])
+
+
+# Поле для конкретного файлу укриттів: беремо з диску, якщо версія збігається, інакше перебудовуємо
+# (з поля previous попередньої версії файлу, якщо воно є)
+def load_or_build_field(engine, shelter_file, shelter_index=None, field_dir=FIELD_DIR, previous=None):
+    version = f"{engine.fingerprint}-{file_digest(shelter_file)}"
+    return _load_or_build(os.path.join(field_dir, f"shelter_field_{version}"), ShelterField.load,
+                          lambda: ShelterField.update(previous, engine,
+                                                      shelter_index or ShelterIndex.from_csv(shelter_file), version))
+
+
+# Відра укриттів для запитів через ієрархію скорочень; залежать від графу, файлу укриттів і limit (метри).
+# previous і previous_index — відра та індекс попередньої версії файлу: пошуки для вузлів, що вже були
+# цілями, беруться з них
+def load_or_build_buckets(engine, shelter_file, shelter_index, limit, field_dir=FIELD_DIR,
+                          previous=None, previous_index=None):
+    version = f"{engine.hierarchy.fingerprint}-{file_digest(shelter_file)}-{int(limit)}"
+    reuse = previous.searches_by_node(previous_index.graph_nodes(engine)) \
+        if previous is not None and previous.limit == float(limit) else None
+    return _load_or_build(os.path.join(field_dir, f"shelter_buckets_{version}"), TargetBuckets.load,
+                          lambda: TargetBuckets.build(engine.hierarchy, shelter_index.graph_nodes(engine),
+                                                      limit, version, reuse))
+
+
+# Беремо готові дані з диску, якщо версія збігається, інакше будуємо, зберігаємо і прибираємо старі версії
+def _load_or_build(path, load, build):
+    if os.path.exists(os.path.join(path, "meta.json")):
+        try:
+            return load(path)
+        except (OSError, ValueError, KeyError):
+            shutil.rmtree(path, ignore_errors=True)
+    build().save(path)
+    prefix = os.path.basename(path).split("_")[:2]
+    for stale_path in glob.glob(os.path.join(os.path.dirname(path), "_".join(prefix) + "_*")):
+        if stale_path != path and ".tmp-" not in stale_path:
+            shutil.rmtree(stale_path, ignore_errors=True)
+    return load(path)
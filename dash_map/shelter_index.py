@@ -0,0 +1,85 @@
+"""shelter_index"""
+import csv
+import numpy as np
+from sklearn.neighbors import BallTree
+
+from dash_map.routing_engine import EARTH_RADIUS_M
+
+
+class ShelterIndex:
+    """Просторовий індекс укриттів (BallTree з метрикою haversine).
+    Будується один раз і відповідає на запити «всі в радіусі» та «k найближчих»."""
+
+    def __init__(self, names, lat, lon, capacity=None):
+        self.names = list(names)
+        self.lat = np.asarray(lat, dtype=np.float64)
+        self.lon = np.asarray(lon, dtype=np.float64)
+        if capacity is None:
+            capacity = np.zeros(len(self.names), dtype=np.int32)
+        self.capacity = np.asarray(capacity, dtype=np.int32)
+        self._tree = BallTree(np.radians(np.column_stack([self.lat, self.lon])), metric="haversine") \
+            if len(self.names) else None
+        self._nodes = {}
+
+    def __len__(self):
+        return len(self.names)
+
+    # Зчитуємо CSV через модуль csv, а не розбиттям рядка по комах
+    @classmethod
+    def from_csv(cls, file_path) -> "ShelterIndex":
+        names, lats, lons, capacity = [], [], [], []
+        with open(file_path, 'r', encoding='utf-8', newline='') as file:
+            for row in csv.DictReader(file):
+                if not row.get('latitude') or not row.get('longitude'):
+                    continue
+                names.append(f"{row['street']} {row['building_number']}")
+                lats.append(float(row['latitude']))
+                lons.append(float(row['longitude']))
+                capacity.append(int(float(row.get('capacity_of_persons') or 0)))
+        return cls(names, lats, lons, capacity)
+
+    def _query_point(self, point):
+        return np.radians(np.array([[point[0], point[1]]], dtype=np.float64))
+
+    # Індекс з колонкового сховища укриттів (без повторного розбору CSV)
+    @classmethod
+    def from_store(cls, store) -> "ShelterIndex":
+        return cls(store.names(), store.latitude, store.longitude, store.capacity)
+
+    # Індекси та відстані (в метрах) до укриттів у радіусі radius_km, від найближчого
+    def within_radius(self, point, radius_km: float):
+        if self._tree is None:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        idx, dist = self._tree.query_radius(self._query_point(point), r=radius_km * 1000 / EARTH_RADIUS_M,
+                                            return_distance=True, sort_results=True)
+        return idx[0], dist[0] * EARTH_RADIUS_M
+
+    # Індекси та відстані (в метрах) до k найближчих укриттів
+    def nearest(self, point, k: int = 1):
+        if self._tree is None:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        k = min(k, len(self.names))
+        dist, idx = self._tree.query(self._query_point(point), k=k)
+        return idx[0], dist[0] * EARTH_RADIUS_M
+
+    # Вузли графу для всіх укриттів; рахується один раз векторизовано для кожного рушія
+    def graph_nodes(self, engine) -> np.ndarray:
+        key = engine.fingerprint
+        if key not in self._nodes:
+            self._nodes[key] = engine.nearest_nodes(self.lat, self.lon).astype(np.int64)
+        return self._nodes[key]
+
+    # Вузли графу після оновлення файлу: укриття з тими самими координатами, що й у previous,
+    # беруть вже знайдений вузол, і лише нові чи переміщені укриття прив'язуються до графу наново
+    def reuse_graph_nodes(self, previous, engine) -> np.ndarray:
+        key = engine.fingerprint
+        if previous is None or key not in previous._nodes:
+            return self.graph_nodes(engine)
+        known = dict(zip(zip(previous.lat.tolist(), previous.lon.tolist()), previous._nodes[key].tolist()))
+        nodes = np.array([known.get(point, -1) for point in zip(self.lat.tolist(), self.lon.tolist())],
+                         dtype=np.int64)
+        missing = np.flatnonzero(nodes < 0)
+        if len(missing):
+            nodes[missing] = engine.nearest_nodes(self.lat[missing], self.lon[missing])
+        self._nodes[key] = nodes
+        return nodes
@@ -0,0 +1,193 @@
+"""shelter_store"""
+import argparse
+import csv
+import json
+import fcntl
+import os
+import shutil
+import tempfile
+from collections import namedtuple
+from contextlib import contextmanager
+
+import numpy as np
+
+STORE_DIR = os.path.join("instance", "shelter_store")
+FORMAT_VERSION = 2
+
+# Колонки з повторюваними рядками зберігаються як коди категорій
+CATEGORY_COLUMNS = ("type_of_room", "street", "building_number")
+ShelterRow = namedtuple("ShelterRow", ["latitude", "longitude", "capacity_of_persons",
+                                       "type_of_room", "street", "building_number"])
+
+
+# Окрема тека сховища для кожного CSV
+def store_dir_for(csv_path) -> str:
+    return os.path.join(STORE_DIR, os.path.splitext(os.path.basename(csv_path))[0])
+
+
+def _source_stamp(csv_path):
+    stat = os.stat(csv_path)
+    return {"source": os.path.abspath(csv_path), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+# Поки процес тримає цей замок (fcntl), інші процеси не будують і не чистять сховище в цій теці
+@contextmanager
+def _build_lock(store_dir):
+    os.makedirs(store_dir, exist_ok=True)
+    with open(os.path.join(store_dir, ".lock"), 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        yield
+
+
+def _read_meta(store_dir):
+    try:
+        with open(os.path.join(store_dir, "meta.json"), encoding='utf-8') as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+
+# Теки версій, на які посилається meta
+def _versions_of(meta):
+    if not meta:
+        return set()
+    return {os.path.dirname(path) for path in meta.get("files", {}).values()}
+
+
+# Перетворює CSV укриттів у колонковий формат: .npy-масиви (координати, місткість, коди категорій)
+# та meta.json з таблицями категорій. Масиви відкриваються через mmap, тож воркери ділять одну копію.
+# Кожна збірка пишеться в нову теку версії, а публікується однією атомарною заміною meta.json.
+# Будує лише один процес за раз; з only_if_stale процес, що дочекався замка, бере вже готове сховище
+def build_store(csv_path, store_dir=None, only_if_stale=False):
+    store_dir = store_dir or store_dir_for(csv_path)
+    with _build_lock(store_dir):
+        previous = _read_meta(store_dir)
+        if only_if_stale and previous is not None and _meta_is_fresh(previous, csv_path):
+            return previous
+
+        lat, lon, capacity = [], [], []
+        categories = {name: {} for name in CATEGORY_COLUMNS}
+        codes = {name: [] for name in CATEGORY_COLUMNS}
+        stamp = _source_stamp(csv_path)
+        with open(csv_path, 'r', encoding='utf-8', newline='') as file:
+            for row in csv.DictReader(file):
+                if not row.get('latitude') or not row.get('longitude'):
+                    continue
+                lat.append(float(row['latitude']))
+                lon.append(float(row['longitude']))
+                capacity.append(int(float(row.get('capacity_of_persons') or 0)))
+                for name in CATEGORY_COLUMNS:
+                    codes[name].append(categories[name].setdefault(row[name], len(categories[name])))
+
+        version_dir = tempfile.mkdtemp(prefix="v-", dir=store_dir)
+        version = os.path.basename(version_dir)
+        arrays = {
+            "latitude": np.array(lat, dtype=np.float64),
+            "longitude": np.array(lon, dtype=np.float64),
+            "capacity_of_persons": np.array(capacity, dtype=np.int32),
+        }
+        for name in CATEGORY_COLUMNS:
+            arrays[name] = np.array(codes[name], dtype=np.int32)
+        files = {}
+        for name, array in arrays.items():
+            files[name] = os.path.join(version, f"{name}.npy")
+            np.save(os.path.join(store_dir, files[name]), array)
+
+        meta = {
+            "format": FORMAT_VERSION,
+            **stamp,
+            "rows": len(lat),
+            "files": files,
+            "categories": {name: list(values) for name, values in categories.items()},
+        }
+        # meta.json пишемо останнім і атомарно: читачі бачать або стару, або нову версію повністю
+        tmp_meta = os.path.join(version_dir, "meta.json.tmp")
+        with open(tmp_meta, 'w', encoding='utf-8') as file:
+            json.dump(meta, file, ensure_ascii=False)
+        os.replace(tmp_meta, os.path.join(store_dir, "meta.json"))
+
+        # Попередню версію лишаємо: її meta могли щойно прочитати інші процеси.
+        # Старіші версії і файли старого формату прямо в теці сховища видаляємо
+        keep = _versions_of(meta) | _versions_of(previous)
+        for name in os.listdir(store_dir):
+            path = os.path.join(store_dir, name)
+            if name.startswith("v-") and name not in keep:
+                shutil.rmtree(path, ignore_errors=True)
+            elif name.endswith((".npy", ".json.tmp")):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+    return meta
+
+
+def _meta_is_fresh(meta, csv_path) -> bool:
+    return meta.get("format") == FORMAT_VERSION and \
+        all(meta.get(key) == value for key, value in _source_stamp(csv_path).items())
+
+
+class ShelterStore:
+    """Колонкове сховище укриттів: масиви NumPy, відкриті через mmap, і таблиці категорій.
+    Замінює DataFrame укриттів у кожному воркері."""
+
+    def __init__(self, store_dir):
+        with open(os.path.join(store_dir, "meta.json"), encoding='utf-8') as file:
+            self.meta = json.load(file)
+        columns = {name: np.load(os.path.join(store_dir, path), mmap_mode='r')
+                   for name, path in self.meta["files"].items()}
+        self.latitude = columns["latitude"]
+        self.longitude = columns["longitude"]
+        self.capacity = columns["capacity_of_persons"]
+        self.codes = {name: columns[name] for name in CATEGORY_COLUMNS}
+        self.categories = {name: self.meta["categories"][name] for name in CATEGORY_COLUMNS}
+
+    def __len__(self):
+        return self.meta["rows"]
+
+    # Чи відповідає сховище поточній версії CSV
+    def is_fresh_for(self, csv_path) -> bool:
+        return _meta_is_fresh(self.meta, csv_path)
+
+    def column(self, name) -> list[str]:
+        values = self.categories[name]
+        return [values[code] for code in self.codes[name]]
+
+    # Назви укриттів у форматі "вулиця будинок"
+    def names(self) -> list[str]:
+        return [f"{street} {building}" for street, building in zip(self.column("street"),
+                                                                  self.column("building_number"))]
+
+    def rows(self, order=None):
+        if order is None:
+            order = range(len(self))
+        types, streets, buildings = (self.categories[name] for name in CATEGORY_COLUMNS)
+        type_codes, street_codes, building_codes = (self.codes[name] for name in CATEGORY_COLUMNS)
+        for i in order:
+            yield ShelterRow(float(self.latitude[i]), float(self.longitude[i]), int(self.capacity[i]),
+                             types[type_codes[i]], streets[street_codes[i]], buildings[building_codes[i]])
+
+
+# Відкриває сховище для CSV, перебудовуючи його, якщо CSV змінився.
+# Інший процес може саме опублікувати нову версію, тож і після збірки читання повторюється
+def load_store(csv_path, store_dir=None, attempts=3) -> ShelterStore:
+    store_dir = store_dir or store_dir_for(csv_path)
+    for attempt in range(attempts):
+        try:
+            store = ShelterStore(store_dir)
+            if store.is_fresh_for(csv_path):
+                return store
+        except (OSError, ValueError, KeyError):
+            if attempt == attempts - 1:
+                raise
+        build_store(csv_path, store_dir, only_if_stale=True)
+    return ShelterStore(store_dir)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the memory-mapped shelter store from CSV")
+    parser.add_argument("csv", nargs="?", default=os.path.join("shelters_data", "shelters_coords.csv"))
+    parser.add_argument("--out", default=None)
+    args = parser.parse_args()
+    out = args.out or store_dir_for(args.csv)
+    meta = build_store(args.csv, out)
+    print(f"Збережено {meta['rows']} укриттів у {out}")
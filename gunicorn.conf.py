@@ -0,0 +1,24 @@
+"""Налаштування gunicorn (читаються автоматично командою з Procfile)."""
+import os
+
+from dash_map.procstats import format_memory, memory_usage
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+workers = int(os.environ.get("WEB_CONCURRENCY", "2"))
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", "60"))
+
+# Застосунок (граф, поле укриттів, маркери) завантажується один раз у майстер-процесі до fork:
+# масиви відкриті через mmap або лишаються спільними copy-on-write сторінками для всіх воркерів
+preload_app = True
+
+
+def when_ready(server):
+    server.log.info("Майстер %s: %s", os.getpid(), format_memory(memory_usage()))
+
+
+def post_worker_init(worker):
+    worker.log.info("Воркер %s: %s", worker.pid, format_memory(memory_usage()))
+
+
+def worker_exit(server, worker):
+    server.log.info("Воркер %s завершується", worker.pid)
@@ -1,43 +1,227 @@
 """shelters_coords"""
+import argparse
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable
+
 import pandas as pd
 from geopy.geocoders import Nominatim
-from geopy.exc import GeocoderTimedOut
+from geopy.exc import GeocoderServiceError, GeocoderTimedOut
+
+Geocoder = Callable[[str], tuple[float | None, float | None]]
+
+# Тимчасові помилки (таймаут, 5xx, обмеження частоти): такі адреси повторюються, а не вважаються ненайденими
+TRANSIENT_ERRORS = (GeocoderTimedOut, GeocoderServiceError, OSError)
+
+_geolocator = None
 
 
 # Приймає адресу і повертає її широту та довготу
-def get_coordinates(address) -> tuple[int, int] | None:
-    """Gets the latitude and longitude from the address"""
-    geolocator = Nominatim(user_agent="shelter_locator")
-    try:
-        location = geolocator.geocode(address, timeout=10)
-        if location:
-            return location.latitude, location.longitude
-    except GeocoderTimedOut:
-        return None, None
+def get_coordinates(address) -> tuple[float, float] | tuple[None, None]:
+    """Gets the latitude and longitude from the address.
+
+    Returns (None, None) when the address is not found; timeouts and
+    service errors are raised so the caller can retry them"""
+    global _geolocator
+    if _geolocator is None:
+        _geolocator = Nominatim(user_agent="shelter_locator")
+    location = _geolocator.geocode(address, timeout=10)
+    if location:
+        return location.latitude, location.longitude
     return None, None
 
+
+class RateLimiter:
+    """Lets at most `rate` calls per second through, shared between worker threads"""
+
+    def __init__(self, rate: float):
+        self.interval = 1 / rate if rate > 0 else 0
+        self._lock = threading.Lock()
+        self._next_slot = time.monotonic()
+
+    def wait(self) -> None:
+        """Blocks until the caller may make the next call"""
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+# Адреса укриття у форматі, який розуміє геокодер
+def build_address(row) -> str:
+    """Builds the geocoder query for a shelter row"""
+    return f"{row['street']} {row['building_number']}, \
+Львів, {row['district']}, Львівська область, Україна"
+
+
+# Читає вже готові координати з чекпоінту (по одному JSON на рядок)
+def load_checkpoint(checkpoint_file: str) -> dict[str, tuple[float | None, float | None]]:
+    """Loads geocoded addresses saved by a previous, possibly interrupted run"""
+    done = {}
+    if not os.path.exists(checkpoint_file):
+        return done
+    with open(checkpoint_file, encoding="utf-8") as file:
+        for line in file:
+            try:
+                item = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # недописаний рядок після аварійної зупинки
+            done[item["address"]] = (item["latitude"], item["longitude"])
+    return done
+
+
+# Файл з адресами, які не вдалося геокодувати через тимчасові помилки
+def failed_file_for(output_file: str) -> str:
+    return output_file + ".failed.txt"
+
+
+def load_failed(failed_file: str) -> set[str]:
+    """Reads addresses that failed with a transient error in an earlier run"""
+    if not os.path.exists(failed_file):
+        return set()
+    with open(failed_file, encoding="utf-8") as file:
+        return {line.rstrip("\n") for line in file if line.strip()}
+
+
+# Координати з попереднього результату, щоб не геокодувати незмінені рядки вдруге.
+# Адреси, що впали з тимчасовою помилкою, повторюються завжди, ненайдені — лише з retry_missing
+def load_previous(previous_file: str, retry_missing: bool = False) -> dict[str, tuple[float | None, float | None]]:
+    """Maps addresses from an earlier output file to their coordinates"""
+    known = {}
+    if not previous_file or not os.path.exists(previous_file):
+        return known
+    failed = load_failed(failed_file_for(previous_file))
+    df = pd.read_csv(previous_file)
+    for _, row in df[df["city"] == "Львів"].iterrows():
+        address = build_address(row)
+        lat, lon = row.get("latitude"), row.get("longitude")
+        if pd.isna(lat) or pd.isna(lon):
+            if retry_missing or address in failed:
+                continue
+            lat, lon = None, None
+        known[address] = (lat, lon)
+    return known
+
+
+def geocode_addresses(addresses: list[str], geocoder: Geocoder = get_coordinates,
+                      workers: int = 2, rate: float = 1.0,
+                      checkpoint_file: str | None = None,
+                      report_every: int = 50, retries: int = 2,
+                      retry_delay: float = 5.0) -> dict[str, tuple[float | None, float | None]]:
+    """Geocodes unique addresses with a bounded worker pool behind a rate limiter,
+    appending every result to the checkpoint file so an interrupted run can resume.
+
+    Addresses that fail with a transient error are retried up to `retries` more
+    times with a growing pause; those that still fail are left out of the result
+    (and out of the checkpoint), so they are not mistaken for addresses that were not found"""
+    done = load_checkpoint(checkpoint_file) if checkpoint_file else {}
+    pending = [address for address in dict.fromkeys(addresses) if address not in done]
+    print(f"Адрес до геокодування: {len(pending)} (з чекпоінту: {len(done)})")
+    if not pending:
+        return done
+
+    limiter = RateLimiter(rate)
+    lock = threading.Lock()
+    checkpoint = open(checkpoint_file, "a", encoding="utf-8") if checkpoint_file else None
+
+    def task(address):
+        limiter.wait()
+        try:
+            return address, geocoder(address)
+        except TRANSIENT_ERRORS as e:
+            return address, e
+
+    try:
+        for attempt in range(retries + 1):
+            if attempt:
+                print(f"Повтор {attempt}/{retries} для {len(pending)} адрес після тимчасових помилок")
+                time.sleep(retry_delay * 2 ** (attempt - 1))
+            failed = []
+            started = time.monotonic()
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                futures = [pool.submit(task, address) for address in pending]
+                for i, future in enumerate(as_completed(futures), start=1):
+                    address, result = future.result()
+                    if isinstance(result, Exception):
+                        failed.append(address)
+                    else:
+                        lat, lon = result
+                        with lock:
+                            done[address] = (lat, lon)
+                            if checkpoint:
+                                checkpoint.write(json.dumps({"address": address, "latitude": lat,
+                                                             "longitude": lon}, ensure_ascii=False) + "\n")
+                                checkpoint.flush()
+                    if i % report_every == 0 or i == len(pending):
+                        elapsed = time.monotonic() - started
+                        print(f"{i}/{len(pending)} адрес, {i / elapsed:.2f} адрес/с")
+            pending = failed
+            if not pending:
+                break
+    finally:
+        if checkpoint:
+            checkpoint.close()
+    if pending:
+        print(f"Не вдалося геокодувати через тимчасові помилки: {len(pending)} адрес")
+    return done
+
+
 # Створює файл з укриттями вже з їхніми координатами широти та довготи
-def add_coordinates_to_file(input_file:str, output_file:str) -> None:
-    """Creates a new file with coordinates of every shelter"""
+def add_coordinates_to_file(input_file: str, output_file: str, geocoder: Geocoder = get_coordinates,
+                            workers: int = 2, rate: float = 1.0, checkpoint_file: str | None = None,
+                            previous_file: str | None = None, retry_missing: bool = False) -> None:
+    """Creates a new file with coordinates of every shelter.
+
+    Addresses are deduplicated, rows already present in `previous_file`
+    (the old output by default) are reused, and only new or changed
+    addresses are sent to `geocoder`."""
     df = pd.read_csv(input_file)
+    if previous_file is None:
+        previous_file = output_file
+    if checkpoint_file is None:
+        checkpoint_file = output_file + ".checkpoint.jsonl"
 
-    df["latitude"] = None
-    df["longitude"] = None
-    i = 1
-    for index, row in df.iterrows():
-        print(i)
-        i += 1
-        if row["city"] != "Львів":
-            continue
-        address = f"{row['street']} {row['building_number']}, \
-Львів, {row['district']}, Львівська область, Україна"
-        lat, lon = get_coordinates(address)
-        df.at[index, "latitude"] = lat
-        df.at[index, "longitude"] = lon
+    lviv = df["city"] == "Львів"
+    addresses = df.loc[lviv].apply(build_address, axis=1)
+    known = load_previous(previous_file, retry_missing)
+    to_geocode = [address for address in addresses.unique() if address not in known]
+    print(f"Укриттів у Львові: {lviv.sum()}, унікальних адрес: {addresses.nunique()}, нових: {len(to_geocode)}")
 
+    known.update(geocode_addresses(to_geocode, geocoder, workers, rate, checkpoint_file))
 
+    # Адреси з тимчасовими помилками записуємо окремо: наступний запуск повторить їх і без --retry-missing
+    failed = sorted(address for address in to_geocode if address not in known)
+    failed_file = failed_file_for(output_file)
+    if failed:
+        with open(failed_file, "w", encoding="utf-8") as file:
+            file.writelines(address + "\n" for address in failed)
+    elif os.path.exists(failed_file):
+        os.remove(failed_file)
+
+    coords = addresses.map(lambda address: known.get(address, (None, None)))
+    df["latitude"] = None
+    df["longitude"] = None
+    df.loc[lviv, "latitude"] = coords.map(lambda point: point[0])
+    df.loc[lviv, "longitude"] = coords.map(lambda point: point[1])
     df.to_csv(output_file, index=False)
+    if os.path.exists(checkpoint_file):
+        os.remove(checkpoint_file)
+
 
-# Якщо запустити то почне перезаписувати файл. Займає багато часу
-# if __name__ == "__main__":
-    # add_coordinates_to_file("ukrittya_lviv_obl.csv", "shelters_coords.csv")
+# Якщо запустити то геокодує лише нові адреси, переривання можна продовжити з чекпоінту
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Geocode shelters into shelters_coords.csv")
+    parser.add_argument("--input", default="ukrittya_lviv_obl.csv")
+    parser.add_argument("--output", default="shelters_coords.csv")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--rate", type=float, default=1.0, help="max requests per second")
+    parser.add_argument("--retry-missing", action="store_true",
+                        help="also retry addresses the geocoder did not find (transient failures are always retried)")
+    args = parser.parse_args()
+    add_coordinates_to_file(args.input, args.output, workers=args.workers, rate=args.rate,
+                            retry_missing=args.retry_missing)
@@ -0,0 +1,8 @@
+import pytest
+
+
+# Кеші, метрики й бази за замовчуванням пишуться в instance/ поточної теки, тож кожен тест
+# працює у власній тимчасовій теці, а не в робочій копії
+@pytest.fixture(autouse=True)
+def _workdir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
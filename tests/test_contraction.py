@@ -0,0 +1,124 @@
+"""Ієрархія скорочень має давати ті самі відстані, що й Дейкстра scipy по вихідному графу."""
+import random
+
+import numpy as np
+import pytest
+
+from dash_map.contraction import ContractionHierarchy, TargetBuckets
+from dash_map.routing_engine import RoutingEngine
+
+
+# Сітка n x n з випадковими довжинами, частиною вулиць з одностороннім рухом, діагоналями
+# і кількома вилученими ребрами, тож частина пар вузлів недосяжна
+def random_city(n, seed):
+    rnd = random.Random(seed)
+    edges = {}
+
+    def connect(u, v, length, one_way=False):
+        edges[(u, v)] = min(length, edges.get((u, v), float('inf')))
+        if not one_way:
+            edges[(v, u)] = min(length, edges.get((v, u), float('inf')))
+
+    for i in range(n):
+        for j in range(n):
+            u = i * n + j
+            if j + 1 < n and rnd.random() > 0.05:
+                connect(u, u + 1, rnd.uniform(50, 150), one_way=rnd.random() < 0.15)
+            if i + 1 < n and rnd.random() > 0.05:
+                connect(u, u + n, rnd.uniform(50, 150), one_way=rnd.random() < 0.15)
+            if i + 1 < n and j + 1 < n and rnd.random() < 0.2:
+                connect(u, u + n + 1, rnd.uniform(70, 220))
+    pairs = sorted(edges)
+    indptr = np.zeros(n * n + 1, dtype=np.int32)
+    for u, _ in pairs:
+        indptr[u + 1] += 1
+    indptr = np.cumsum(indptr)
+    lat = [49.8 + (node // n) * 0.001 for node in range(n * n)]
+    lon = [24.0 + (node % n) * 0.001 for node in range(n * n)]
+    return RoutingEngine(list(range(n * n)), lat, lon, indptr,
+                         [v for _, v in pairs], [edges[pair] for pair in pairs])
+
+
+def path_length(engine, path):
+    total = 0.0
+    for u, v in zip(path, path[1:]):
+        start, end = engine.indptr[u], engine.indptr[u + 1]
+        lengths = engine.lengths[start:end][engine.indices[start:end] == v]
+        assert len(lengths), f"ребра {u} -> {v} немає у графі"
+        total += float(lengths.min())
+    return total
+
+
+@pytest.fixture(scope="module", params=[(12, 1), (20, 2)], ids=["12x12", "20x20"])
+def city(request):
+    engine = random_city(*request.param)
+    return engine, ContractionHierarchy.build(engine)
+
+
+def test_query_matches_dijkstra(city):
+    engine, hierarchy = city
+    rnd = random.Random(0)
+    for _ in range(60):
+        source, target = rnd.randrange(engine.n_nodes), rnd.randrange(engine.n_nodes)
+        expected = engine.shortest_paths(source)[0][target]
+        distance, path = hierarchy.query(source, target)
+        if not np.isfinite(expected):
+            assert distance == float('inf') and path is None
+            continue
+        assert distance == pytest.approx(expected)
+        assert path[0] == source and path[-1] == target
+        assert path_length(engine, path) == pytest.approx(expected)
+
+
+def test_query_same_node(city):
+    _, hierarchy = city
+    assert hierarchy.query(5, 5) == (0.0, [5])
+
+
+@pytest.mark.parametrize("limit", [400.0, 1500.0])
+def test_nearest_targets_match_dijkstra(city, limit):
+    engine, hierarchy = city
+    rnd = random.Random(1)
+    target_nodes = rnd.sample(range(engine.n_nodes), 15)
+    target_nodes.append(target_nodes[0])  # дві цілі на одному вузлі
+    buckets = TargetBuckets.build(hierarchy, target_nodes, limit)
+    for source in rnd.sample(range(engine.n_nodes), 25):
+        dist = engine.shortest_paths(source)[0][target_nodes]
+        expected = sorted(d for d in dist if d <= limit)[:3]
+        nearest = buckets.nearest(hierarchy, source, 3)
+        assert [d for _, d, _ in nearest] == pytest.approx(expected)
+        for target, distance, path in nearest:
+            assert distance == pytest.approx(dist[target])
+            assert path[0] == source and path[-1] == target_nodes[target]
+            assert path_length(engine, path) == pytest.approx(distance)
+
+
+def test_nearest_respects_smaller_limit(city):
+    engine, hierarchy = city
+    target_nodes = list(range(0, engine.n_nodes, 7))
+    buckets = TargetBuckets.build(hierarchy, target_nodes, 2000.0)
+    for source in (0, engine.n_nodes // 2, engine.n_nodes - 1):
+        assert all(d <= 300.0 for _, d, _ in buckets.nearest(hierarchy, source, 10, limit=300.0))
+
+
+def test_save_and_load(city, tmp_path):
+    engine, hierarchy = city
+    hierarchy.save(str(tmp_path / "ch"))
+    loaded = ContractionHierarchy.load(str(tmp_path / "ch"), engine.fingerprint)
+    assert loaded is not None and loaded.n_shortcuts == hierarchy.n_shortcuts
+    assert loaded.query(0, engine.n_nodes - 1) == hierarchy.query(0, engine.n_nodes - 1)
+    assert ContractionHierarchy.load(str(tmp_path / "ch"), "інший граф") is None
+
+
+def test_calibrate_saves_choice(city, tmp_path):
+    engine, hierarchy = city
+    timings = hierarchy.calibrate(engine, 1500.0, samples=5, n_targets=20)
+    assert set(timings) == {"nearest_ch_ms", "nearest_dijkstra_ms"}
+    hierarchy.save(str(tmp_path / "ch"))
+    loaded = ContractionHierarchy.load(str(tmp_path / "ch"), engine.fingerprint)
+    assert loaded.timings == timings and loaded.build_seconds == hierarchy.build_seconds
+    assert loaded.faster_for_nearest == (timings["nearest_ch_ms"] < timings["nearest_dijkstra_ms"])
+    loaded.timings["nearest_ch_ms"] = loaded.timings["nearest_dijkstra_ms"] + 1
+    assert not loaded.faster_for_nearest
+    # Стара ієрархія без замірів вважається швидшою
+    assert ContractionHierarchy(hierarchy.rank, *hierarchy.up, *hierarchy.down).faster_for_nearest
@@ -0,0 +1,80 @@
+"""База відгуків і користувачів: міграції, кеш токенів і кеші відгуків."""
+import sqlite3
+
+import pytest
+
+from dash_map import db
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    path = str(tmp_path / "shelters.sqlite")
+    db.init_db(path)
+    db.token_cache.clear()
+    yield path
+    db.token_cache.clear()
+
+
+def test_unknown_token_is_not_cached(db_path):
+    assert db.resolve_token("token-1", db_path) is None
+    # Реєстрація в іншому воркері: окреме з'єднання, локальний кеш про неї не знає
+    with sqlite3.connect(db_path) as conn:
+        conn.execute("INSERT INTO users (username, email, token) VALUES ('ann', 'ann@example.com', 'token-1')")
+    assert db.resolve_token("token-1", db_path) == "ann"
+
+
+def test_known_token_is_cached(db_path):
+    assert db.register_user("bob", "bob@example.com", "token-2", db_path) is None
+    assert db.resolve_token("token-2", db_path) == "bob"
+    hits = db.token_cache.hits
+    assert db.resolve_token("token-2", db_path) == "bob"
+    assert db.token_cache.hits == hits + 1
+    db.invalidate_token("token-2", db_path)
+    assert (db_path, "token-2") not in db.token_cache.keys()
+
+
+def test_register_reports_taken_field(db_path):
+    assert db.register_user("bob", "bob@example.com", "token-2", db_path) is None
+    assert db.register_user("bob2", "bob@example.com", "token-3", db_path) == "email"
+    assert db.register_user("bob", "other@example.com", "token-3", db_path) == "username"
+    assert db.register_user("bob3", "bob3@example.com", "token-2", db_path) == "token"
+
+
+def test_migrations_upgrade_old_database(tmp_path):
+    path = str(tmp_path / "old.sqlite")
+    # База до міграцій: лише перша версія схеми, без created_at і лічильників
+    with sqlite3.connect(path) as conn:
+        for statement in db.MIGRATIONS[0]:
+            conn.execute(statement)
+        conn.executemany("INSERT INTO reviews VALUES (?, ?, ?)",
+                         [("Зелена_20", "старий", "ann"), ("Зелена_20", "ще", "bob"), ("Шевченка_1", "так", "ann")])
+        conn.execute("PRAGMA user_version = 1")
+    db.init_db(path)
+    db.init_db(path)  # повторний запуск нічого не змінює
+    conn = db.get_connection(path)
+    assert conn.execute("PRAGMA user_version").fetchone()[0] == len(db.MIGRATIONS)
+    assert db.review_counts(path) == {"Зелена_20": 2, "Шевченка_1": 1}
+    assert db.reviews_revision(path) == 3
+    assert {review['created_at'] for review in db.get_reviews_page("Зелена_20", db_path=path)[0]} == {0}
+
+
+def test_review_caches_see_writes_from_other_workers(db_path):
+    db.add_review("Зелена_20", "перший", "ann", db_path)
+    assert db.review_counts(db_path) == {"Зелена_20": 1}
+    assert [r['review_text'] for r in db.get_reviews_page("Зелена_20", db_path=db_path)[0]] == ["перший"]
+    with sqlite3.connect(db_path) as conn:
+        conn.execute("INSERT INTO reviews (shelter_id, review_text, username, created_at) "
+                     "VALUES ('Зелена_20', 'другий', 'bob', 1e12)")
+    assert db.review_counts(db_path) == {"Зелена_20": 2}
+    assert [r['review_text'] for r in db.get_reviews_page("Зелена_20", db_path=db_path)[0]] == ["другий", "перший"]
+
+
+def test_reviews_pages_follow_cursor(db_path):
+    for i in range(5):
+        db.add_review("Зелена_20", f"відгук {i}", "ann", db_path)
+    page, cursor = db.get_reviews_page("Зелена_20", limit=2, db_path=db_path)
+    texts = [r['review_text'] for r in page]
+    while cursor:
+        page, cursor = db.get_reviews_page("Зелена_20", before=cursor, limit=2, db_path=db_path)
+        texts += [r['review_text'] for r in page]
+    assert texts == [f"відгук {i}" for i in reversed(range(5))]
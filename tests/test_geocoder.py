@@ -0,0 +1,88 @@
+"""Локальний геокодер і кеш адрес у find_shelter_algo."""
+import pytest
+
+from dash_map import find_shelter_algo
+from dash_map import geocoder as geocoder_module
+from dash_map.geocoder import LocalGeocoder
+from dash_map.route_cache import RouteCache
+
+
+class FlakyRemote:
+    """Віддалений геокодер, що відповідає з черги: точка, None (не знайдено) або виняток."""
+
+    def __init__(self, *answers):
+        self.answers = list(answers)
+        self.calls = 0
+
+    def __call__(self, address):
+        self.calls += 1
+        answer = self.answers.pop(0)
+        if isinstance(answer, Exception):
+            raise answer
+        return answer
+
+
+@pytest.fixture
+def geocoder(tmp_path):
+    geocoder = LocalGeocoder(str(tmp_path / "geocode.sqlite"), fallback=None)
+    geocoder.add_addresses([("Зелена", "20а", 49.83, 24.04)], "shelters")
+    geocoder.seed_streets({"городоцька": (49.84, 23.99)})
+    return geocoder
+
+
+@pytest.fixture
+def route_cache(tmp_path, geocoder):
+    find_shelter_algo._route_cache = RouteCache(str(tmp_path / "route_cache.sqlite"))
+    find_shelter_algo.set_geocoder(geocoder)
+    yield find_shelter_algo._route_cache
+    find_shelter_algo._route_cache = None
+    find_shelter_algo.set_geocoder(None)
+
+
+def test_street_centre_is_not_cached(route_cache, geocoder):
+    geocoder.fallback = FlakyRemote(ConnectionError("Nominatim недоступний"), (49.845, 23.995))
+    assert find_shelter_algo.locate_address("вул. Городоцька 100") == (49.84, 23.99)
+    # Після збою повторний запит знову йде до віддаленого геокодера і отримує точку будинку
+    assert find_shelter_algo.locate_address("вул. Городоцька 100") == (49.845, 23.995)
+    assert geocoder.fallback.calls == 2
+    geocoder.fallback = None
+    assert find_shelter_algo.locate_address("Городоцька 100") == (49.845, 23.995)
+
+
+def test_exact_point_is_cached(route_cache, geocoder):
+    assert find_shelter_algo.locate_address("вул. Зелена, 20 А") == (49.83, 24.04)
+    assert route_cache.get('address', "зелена|20а", find_shelter_algo.GEOCODE_VERSION) == [49.83, 24.04]
+
+
+def test_exact_and_fuzzy_lookups(geocoder):
+    assert geocoder.locate("вул. Зелена, 20 А") == ((49.83, 24.04), 'exact')
+    # Одрук у назві вулиці
+    assert geocoder.locate("Зелна 20а") == ((49.83, 24.04), 'fuzzy')
+    assert geocoder.locate("Невідома 1") == (None, None)
+
+
+def test_remote_hit_is_stored(geocoder):
+    geocoder.fallback = FlakyRemote((49.85, 24.01))
+    assert geocoder.locate("Личаківська 5") == ((49.85, 24.01), 'remote')
+    assert geocoder.locate("вул. Личаківська, 5") == ((49.85, 24.01), 'exact')
+    assert geocoder.fallback.calls == 1
+
+
+def test_miss_is_remembered_for_ttl(geocoder, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(geocoder_module.time, "time", lambda: now[0])
+    geocoder.fallback = FlakyRemote(None, None)
+    assert geocoder.geocode("Городоцька 300") == (49.84, 23.99)
+    now[0] += geocoder.miss_ttl - 1
+    assert geocoder.geocode("Городоцька 300") == (49.84, 23.99)
+    assert geocoder.fallback.calls == 1
+    now[0] += 2
+    geocoder.geocode("Городоцька 300")
+    assert geocoder.fallback.calls == 2
+
+
+def test_remote_error_is_not_remembered(geocoder, caplog):
+    geocoder.fallback = FlakyRemote(TimeoutError("timeout"), (49.845, 23.995))
+    assert geocoder.locate("Городоцька 100") == ((49.84, 23.99), 'street')
+    assert "Помилка віддаленого геокодера" in caplog.text
+    assert geocoder.locate("Городоцька 100") == ((49.845, 23.995), 'remote')
@@ -0,0 +1,108 @@
+"""Черга фонових завдань у SQLite: виконання, скасування, дедлайни та помилки обробника."""
+import threading
+import time
+
+import pytest
+
+from dash_map import jobs
+from dash_map.jobs import JobQueue
+
+
+def wait_for(predicate, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.005)
+    return False
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / "jobs.sqlite")
+
+
+def test_job_runs_and_reports_stages(db_path):
+    def handler(payload, progress):
+        progress("geocode")
+        progress("route")
+        return {'sum': payload['a'] + payload['b']}
+
+    queue = JobQueue(handler, db_path, workers=1, poll_interval=0.01)
+    job_id = queue.submit({'a': 2, 'b': 3})
+    assert wait_for(lambda: queue.status(job_id)['status'] == jobs.DONE)
+    job = queue.status(job_id)
+    assert job['result'] == {'sum': 5} and job['stage'] == "route" and job['payload'] == {'a': 2, 'b': 3}
+
+
+def test_queued_jobs_have_positions_and_can_be_cancelled(db_path):
+    # Без потоків завдання лишаються в черзі
+    queue = JobQueue(lambda payload, progress: None, db_path, workers=0)
+    first, second = queue.submit({'n': 1}), queue.submit({'n': 2})
+    assert queue.status(first)['position'] == 0 and queue.status(second)['position'] == 1
+    queue.cancel(first)
+    assert queue.status(first)['status'] == jobs.CANCELLED
+    assert queue._claim()[0] == second
+    assert queue._claim() is None
+    assert queue.counts() == {jobs.CANCELLED: 1, jobs.RUNNING: 1}
+
+
+def test_replaces_cancels_previous_job(db_path):
+    queue = JobQueue(lambda payload, progress: None, db_path, workers=0)
+    first = queue.submit({'n': 1})
+    second = queue.submit({'n': 2}, replaces=first)
+    assert queue.status(first)['status'] == jobs.CANCELLED
+    assert queue.status(second)['status'] == jobs.QUEUED
+
+
+def test_expired_jobs_are_not_claimed(db_path):
+    queue = JobQueue(lambda payload, progress: None, db_path, workers=0)
+    stale = queue.submit({'n': 1}, deadline=0.01)
+    fresh = queue.submit({'n': 2})
+    time.sleep(0.02)
+    assert queue._claim()[0] == fresh
+    job = queue.status(stale)
+    assert job['status'] == jobs.EXPIRED and job['error']
+
+
+def test_status_expires_job_stuck_in_dead_worker(db_path):
+    queue = JobQueue(lambda payload, progress: None, db_path, workers=0)
+    job_id = queue.submit({'n': 1}, deadline=0.05)
+    assert queue._claim()[0] == job_id
+    # Процес, що взяв завдання, «загинув»: завдання так і лишилось running
+    time.sleep(0.06)
+    assert queue.status(job_id)['status'] == jobs.EXPIRED
+
+
+def test_cancel_stops_running_handler(db_path):
+    started, release, stopped = threading.Event(), threading.Event(), threading.Event()
+
+    def handler(payload, progress):
+        started.set()
+        release.wait(5)
+        try:
+            progress("route")
+        except jobs.JobStopped:
+            stopped.set()
+            raise
+        return "не має записатись"
+
+    queue = JobQueue(handler, db_path, workers=1, poll_interval=0.01)
+    job_id = queue.submit({})
+    assert started.wait(5)
+    queue.cancel(job_id)
+    release.set()
+    assert stopped.wait(5)
+    job = queue.status(job_id)
+    assert job['status'] == jobs.CANCELLED and job['result'] is None
+
+
+def test_handler_error_marks_job_failed(db_path, caplog):
+    def handler(payload, progress):
+        raise ValueError("немає графу")
+
+    queue = JobQueue(handler, db_path, workers=1, poll_interval=0.01)
+    job_id = queue.submit({})
+    assert wait_for(lambda: queue.status(job_id)['status'] == jobs.FAILED)
+    assert queue.status(job_id)['error'] == "немає графу"
+    assert "Помилка фонового завдання" in caplog.text
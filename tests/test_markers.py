@@ -0,0 +1,81 @@
+"""Маркери укриттів: кластери за зумом, окремі укриття на великому зумі і кількість відгуків."""
+import re
+
+import pytest
+
+from benchmarks.synthetic import LVIV_CENTER, write_shelters_csv
+from dash_map.markers import INDIVIDUAL_ZOOM, ShelterMarkers, review_shelter_id
+from dash_map.shelter_store import load_store
+
+CITY = {'south': LVIV_CENTER[0] - 1, 'north': LVIV_CENTER[0] + 1,
+        'west': LVIV_CENTER[1] - 1, 'east': LVIV_CENTER[1] + 1}
+
+
+@pytest.fixture(scope="module")
+def store(tmp_path_factory):
+    tmp_path = tmp_path_factory.mktemp("markers")
+    csv_path = write_shelters_csv(str(tmp_path / "shelters.csv"), 300, span_deg=0.1)
+    return load_store(csv_path, str(tmp_path / "store"))
+
+
+def tooltip(marker):
+    return next(child for child in marker.children if type(child).__name__ == "Tooltip").children
+
+
+def popup_text(marker):
+    popup = next(child for child in marker.children if type(child).__name__ == "Popup")
+    return popup.children[0].children
+
+
+# Кількість укриттів і місткість за маркером: кластер чи окреме укриття
+def covered(marker):
+    match = re.match(r"Укриттів: (\d+), загальна місткість: (\d+)", tooltip(marker))
+    if match:
+        return int(match.group(1)), int(match.group(2))
+    return 1, int(re.search(r"місткість: (\d+)", tooltip(marker)).group(1))
+
+
+@pytest.mark.parametrize("zoom", [10, 12, 14])
+def test_clusters_cover_every_shelter(store, zoom):
+    markers = ShelterMarkers(store).for_viewport(CITY, zoom, limit=10_000)
+    counts = [covered(marker) for marker in markers]
+    assert sum(count for count, _ in counts) == len(store)
+    assert sum(capacity for _, capacity in counts) == int(store.capacity.sum())
+    assert len(markers) < len(store)
+
+
+def test_clusters_get_finer_with_zoom(store):
+    markers = ShelterMarkers(store)
+    sizes = [len(markers.for_viewport(CITY, zoom, limit=10_000)) for zoom in range(8, INDIVIDUAL_ZOOM)]
+    assert sizes == sorted(sizes)
+
+
+def test_individual_shelters_from_individual_zoom(store):
+    markers = ShelterMarkers(store)
+    shown = markers.for_viewport(CITY, INDIVIDUAL_ZOOM, limit=10_000)
+    assert len(shown) == len(store)
+    # Від найбільшого укриття і не більше limit
+    assert [covered(marker)[1] for marker in markers.for_viewport(CITY, 17, limit=5)] == \
+        sorted(store.capacity.tolist(), reverse=True)[:5]
+    south, north = LVIV_CENTER[0], LVIV_CENTER[0] + 1
+    inside = sum(south <= lat <= north for lat in store.latitude)
+    assert len(markers.for_viewport(dict(CITY, south=south, north=north), 17, limit=10_000)) == inside
+
+
+def test_review_counts_in_popups(store):
+    markers = ShelterMarkers(store)
+    first = markers.rows[0]
+    counts = {review_shelter_id(first): 4}
+    shown = markers.for_viewport(CITY, 17, limit=3, review_counts=counts)
+    assert popup_text(shown[0]) == "Відгуків: 4" and popup_text(shown[1]) == "Відгуків: 0"
+    # Той самий маркер, поки кількість не змінилась
+    assert markers.for_viewport(CITY, 17, limit=1, review_counts=counts)[0] is shown[0]
+    assert popup_text(markers.for_viewport(CITY, 17, limit=1, review_counts={review_shelter_id(first): 5})[0]) \
+        == "Відгуків: 5"
+
+
+def test_unchanged_markers_are_reused(store):
+    previous = ShelterMarkers(store)
+    markers = ShelterMarkers(store, previous=previous)
+    assert all(a is b for a, b in zip(markers.shelter_markers, previous.shelter_markers))
+    assert ShelterMarkers(store, colour='red', previous=previous).shelter_markers[0] is not previous.shelter_markers[0]
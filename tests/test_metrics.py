@@ -0,0 +1,50 @@
+"""Метрики не мають ламати виклики, які вони вимірюють, і мають правильно об'єднуватись у /metrics."""
+import os
+import threading
+
+from dash_map.metrics import Registry
+
+
+def test_concurrent_dumps_never_raise(tmp_path):
+    registry = Registry(str(tmp_path), dump_interval=0)
+    histogram = registry.histogram("test_seconds", "test")
+    counter = registry.counter("test_total", "test")
+    errors = []
+
+    def work():
+        try:
+            for i in range(300):
+                histogram.observe(i / 1000, op="x")
+                counter.inc(op="x")
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=work) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    assert os.listdir(tmp_path) == [f"{os.getpid()}.json"]
+    assert 'test_total{op="x"} 1200' in registry.render()
+
+
+def test_dump_error_is_logged_not_raised(tmp_path, caplog):
+    blocker = tmp_path / "file"
+    blocker.write_text("")
+    registry = Registry(str(blocker / "metrics"), dump_interval=0)
+    registry.counter("test_total", "test").inc()
+    assert "Не вдалося записати метрики" in caplog.text
+
+
+def test_gauges_computed_on_render_only(tmp_path):
+    calls = []
+    registry = Registry(str(tmp_path), dump_interval=0)
+    registry.gauge("shared_size", "shared", lambda: calls.append(1) or 7)
+    registry.gauge("memory", "per process", lambda: {(('kind', 'rss'),): 5}, per_process=True)
+    registry.counter("test_total", "test").inc()
+    assert calls == []
+    text = registry.render()
+    assert calls == [1]
+    assert "shared_size 7" in text
+    assert f'memory{{kind="rss",pid="{os.getpid()}"}} 5' in text
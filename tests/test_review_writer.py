@@ -0,0 +1,106 @@
+"""Відкладений запис відгуків: пачки, повтори після помилок і синхронний запис при повній черзі."""
+import sqlite3
+import threading
+
+import pytest
+
+from dash_map import db
+from dash_map.review_writer import ReviewWriter
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    path = str(tmp_path / "shelters.sqlite")
+    db.init_db(path)
+    return path
+
+
+@pytest.fixture
+def make_writer(db_path):
+    writers = []
+
+    def make(**kwargs):
+        writer = ReviewWriter(db_path, retry_delay=0.001, **kwargs)
+        writers.append(writer)
+        return writer
+
+    yield make
+    for writer in writers:
+        writer.close()
+
+
+def stored(db_path):
+    with sqlite3.connect(db_path) as conn:
+        return sorted(row[0] for row in conn.execute('SELECT review_text FROM reviews'))
+
+
+def test_reviews_are_written_and_leave_pending(make_writer, db_path):
+    writer = make_writer()
+    for i in range(5):
+        writer.submit("Зелена_20", f"відгук {i}", "ann")
+    assert len(writer.pending_reviews("Зелена_20")) + writer.written == 5
+    writer.flush()
+    assert stored(db_path) == [f"відгук {i}" for i in range(5)]
+    assert writer.written == 5 and writer.pending_count() == 0
+    assert db.review_count("Зелена_20", db_path) == 5
+
+
+def test_failed_batch_is_retried(make_writer, db_path):
+    writer = make_writer(retries=3)
+    write = writer._write
+    failures = []
+
+    def flaky(batch):
+        if len(failures) < 2:
+            failures.append(batch)
+            raise sqlite3.OperationalError("database is locked")
+        write(batch)
+
+    writer._write = flaky
+    writer.submit("Зелена_20", "відгук", "ann")
+    writer.flush()
+    assert len(failures) == 2
+    assert stored(db_path) == ["відгук"]
+    assert writer.written == 1 and writer.failed == 0 and writer.pending_count() == 0
+
+
+def test_bad_review_does_not_sink_the_batch(make_writer, db_path):
+    writer = make_writer(retries=1)
+    release = threading.Event()
+    retry = writer._write_with_retries
+    writer._write_with_retries = lambda batch: (release.wait(5), retry(batch))
+    # Поки потік тримає перший відгук, два наступні збираються в одну пачку разом з поганим
+    writer.submit("Зелена_20", "перший", "ann")
+    writer.submit("Зелена_20", None, "bob")
+    writer.submit("Зелена_20", "третій", "eve")
+    release.set()
+    writer.flush()
+    assert stored(db_path) == ["перший", "третій"]
+    assert writer.failed == 1 and writer.pending_count() == 0
+
+
+def test_full_queue_falls_back_to_synchronous_write(make_writer, db_path):
+    writer = make_writer(maxsize=1, put_timeout=0.01)
+    entered, release = threading.Event(), threading.Event()
+    retry = writer._write_with_retries
+
+    def blocked(batch):
+        entered.set()
+        release.wait(5)
+        retry(batch)
+
+    writer._write_with_retries = blocked
+    writer.submit("Зелена_20", "у потоці", "ann")
+    assert entered.wait(5)
+    writer.submit("Зелена_20", "у черзі", "ann")
+    # Черга повна, а потік зайнятий: відгук записується одразу в цьому ж потоці
+    writer.submit("Зелена_20", "синхронно", "ann")
+    assert stored(db_path) == ["синхронно"]
+    # Помилка синхронного запису доходить до викликача, а відгук не висить у pending
+    with pytest.raises(sqlite3.IntegrityError):
+        writer.submit("Зелена_20", None, "bob")
+    assert writer.pending_count() == 2
+    release.set()
+    writer.flush()
+    assert stored(db_path) == ["синхронно", "у потоці", "у черзі"]
+    assert writer.pending_count() == 0
@@ -0,0 +1,78 @@
+"""Поле найближчих укриттів: повна побудова і оновлення лише від нових укриттів."""
+import numpy as np
+import pytest
+
+from benchmarks.synthetic import grid_engine
+from dash_map.shelter_field import ShelterField
+from dash_map.shelter_index import ShelterIndex
+
+
+@pytest.fixture(scope="module")
+def engine():
+    return grid_engine(12, seed=3)
+
+
+def index_at(engine, nodes, prefix="Укриття"):
+    return ShelterIndex([f"{prefix} {node}" for node in nodes], engine.lat[nodes], engine.lon[nodes])
+
+
+# Відстань від кожного вузла до найближчого з вузлів-укриттів прямим Дейкстрою
+def expected_distance(engine, shelter_nodes):
+    return np.array([engine.shortest_paths(node)[0][shelter_nodes].min() for node in range(engine.n_nodes)])
+
+
+def assert_field_correct(engine, field, shelter_nodes):
+    assert np.allclose(field.distance, expected_distance(engine, shelter_nodes))
+    for node in range(0, engine.n_nodes, 7):
+        path = field.route_from(node)
+        assert path[0] == node and path[-1] == shelter_nodes[field.nearest_shelter[node]]
+        length = sum(engine.shortest_paths(a)[0][b] for a, b in zip(path, path[1:]))
+        assert length == pytest.approx(field.distance[node])
+
+
+@pytest.fixture
+def count_builds(monkeypatch):
+    calls = []
+    build = ShelterField.build.__func__
+    monkeypatch.setattr(ShelterField, "build", classmethod(lambda cls, *args, **kwargs: (
+        calls.append(1), build(cls, *args, **kwargs))[1]))
+    return calls
+
+
+def test_build_matches_dijkstra(engine):
+    nodes = [5, 40, 77, 130]
+    field = ShelterField.build(engine, index_at(engine, nodes))
+    assert_field_correct(engine, field, nodes)
+
+
+def test_added_shelters_update_without_rebuild(engine, count_builds):
+    previous = ShelterField.build(engine, index_at(engine, [5, 40]))
+    nodes = [5, 40, 77, 130]
+    field = ShelterField.update(previous, engine, index_at(engine, nodes))
+    assert len(count_builds) == 1
+    assert_field_correct(engine, field, nodes)
+
+
+def test_renamed_shelters_keep_distances(engine, count_builds):
+    previous = ShelterField.build(engine, index_at(engine, [5, 40]))
+    field = ShelterField.update(previous, engine, index_at(engine, [40, 5], prefix="Нове"))
+    assert len(count_builds) == 1
+    assert np.array_equal(field.distance, previous.distance)
+    # Порядок укриттів у файлі змінився, і номери найближчих укриттів переназначено
+    assert field.names[field.nearest_shelter[5]] == "Нове 5"
+
+
+def test_removed_shelter_triggers_full_rebuild(engine, count_builds):
+    previous = ShelterField.build(engine, index_at(engine, [5, 40, 77]))
+    nodes = [5, 77]
+    field = ShelterField.update(previous, engine, index_at(engine, nodes))
+    assert len(count_builds) == 2
+    assert_field_correct(engine, field, nodes)
+
+
+def test_save_and_load(engine, tmp_path):
+    field = ShelterField.build(engine, index_at(engine, [5, 40]), version="v1")
+    field.save(str(tmp_path / "field"))
+    loaded = ShelterField.load(str(tmp_path / "field"))
+    assert loaded.version == "v1" and loaded.names == field.names
+    assert loaded.route_from(100) == field.route_from(100)
@@ -0,0 +1,60 @@
+"""Колонкове сховище укриттів: збірка, оновлення і одночасна перебудова кількома процесами."""
+import multiprocessing
+import os
+
+import numpy as np
+
+from benchmarks.synthetic import write_shelters_csv
+from dash_map.shelter_store import build_store, load_store
+
+
+def test_load_builds_and_reads_back(tmp_path):
+    csv_path = write_shelters_csv(str(tmp_path / "shelters.csv"), 50)
+    store = load_store(csv_path, str(tmp_path / "store"))
+    assert len(store) == 50 and store.is_fresh_for(csv_path)
+    rows = list(store.rows())
+    assert rows[0].street == "Синтетична 0" and rows[0].building_number == "1"
+    assert np.all(store.capacity >= 10)
+
+
+def test_rebuild_keeps_previous_version_only(tmp_path):
+    csv_path = write_shelters_csv(str(tmp_path / "shelters.csv"), 10)
+    store_dir = str(tmp_path / "store")
+    first = load_store(csv_path, store_dir)
+    for count in (20, 30):
+        write_shelters_csv(csv_path, count)
+        os.utime(csv_path, ns=(os.stat(csv_path).st_mtime_ns + 10**9,) * 2)
+        store = load_store(csv_path, store_dir)
+        assert len(store) == count
+    versions = sorted(name for name in os.listdir(store_dir) if name.startswith("v-"))
+    assert len(versions) == 2
+    # Масиви першої версії вже видалені з диску, але відкрите сховище читається через mmap
+    assert len(first) == 10 and float(first.latitude[0]) > 0
+
+
+def _load_many(csv_path, store_dir, rounds, errors):
+    try:
+        for _ in range(rounds):
+            assert len(load_store(csv_path, store_dir)) > 0
+    except Exception as e:
+        errors.put(repr(e))
+
+
+def test_concurrent_rebuilds_do_not_break_readers(tmp_path):
+    csv_path = write_shelters_csv(str(tmp_path / "shelters.csv"), 200)
+    store_dir = str(tmp_path / "store")
+    build_store(csv_path, store_dir)
+    errors = multiprocessing.Queue()
+    processes = [multiprocessing.Process(target=_load_many, args=(csv_path, store_dir, 40, errors))
+                 for _ in range(4)]
+    for process in processes:
+        process.start()
+    for round_ in range(15):
+        # CSV замінюється цілком, як під час оновлення файлу укриттів, а не переписується на місці
+        write_shelters_csv(f"{csv_path}.tmp", 200 + round_)
+        os.replace(f"{csv_path}.tmp", csv_path)
+        build_store(csv_path, store_dir)
+    for process in processes:
+        process.join()
+    assert errors.empty(), errors.get()
+    assert len(load_store(csv_path, store_dir)) == 214